@@ -6,7 +6,7 @@ from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 from starlette.status import HTTP_401_UNAUTHORIZED
 
-from database import SessionLocal
+from database import get_async_db, run_db
 from models import User
 
 SECRET_KEY = "your_fixed_secret_key_which_is_at_least_32_bytes_long"
@@ -26,16 +26,9 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 async def get_current_user(
     token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
-    db: Session = Depends(get_db)
+    db=Depends(get_async_db)
 ) -> User:
     """
     token este un obiect HTTPAuthorizationCredentials cu .scheme (ex: "Bearer")
@@ -67,7 +60,7 @@ async def get_current_user(
     def get_user_by_username(db: Session, username: str):
         return db.query(User).filter(User.username == username).first()
 
-    user = get_user_by_username(db, username=username)
+    user = await run_db(db, get_user_by_username, username)
     if user is None:
         raise credentials_exception
 
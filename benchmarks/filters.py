@@ -0,0 +1,81 @@
+"""
+Latency and peak memory of each registered filter on a decoded image, plus the original float64 sepia for
+comparison and, for pixelwise filters, in-place strip processing. Run from the repository root:
+
+    python -m benchmarks.filters [--megapixels 24] [--runs 3]
+"""
+import argparse
+import multiprocessing
+import statistics
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.preprocessing import _peak_rss_kb, make_jpeg
+from image_filters import FILTERS, apply_filter, apply_pipeline_in_strips, filter_names
+
+
+STRIPS = " (strips)"
+
+
+def legacy_sepia(image: Image.Image) -> Image.Image:
+    sepia_matrix = np.array([
+        [0.393, 0.769, 0.189],
+        [0.349, 0.686, 0.168],
+        [0.272, 0.534, 0.131]
+    ])
+    return Image.fromarray(np.dot(np.array(image), sepia_matrix.T).clip(0, 255).astype(np.uint8))
+
+
+def benchmark_params(name: str, image: Image.Image) -> dict:
+    if name == "crop":
+        return {"left": image.width // 4, "top": image.height // 4,
+                "right": image.width * 3 // 4, "bottom": image.height * 3 // 4}
+    if name == "resize":
+        return {"width": image.width // 2}
+    return {}
+
+
+def _measure(name: str, image_bytes: bytes, runs: int, results):
+    # make_jpeg images decode straight to RGB; a convert() copy would raise the baseline peak
+    image = Image.open(BytesIO(image_bytes))
+    image.load()
+    before = _peak_rss_kb()
+    durations = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        if name == "legacy sepia":
+            legacy_sepia(image)
+        elif name.endswith(STRIPS):
+            apply_pipeline_in_strips(image, [{"op": name[:-len(STRIPS)], "params": {}}])
+        else:
+            apply_filter(image, name, **benchmark_params(name, image))
+        durations.append(time.perf_counter() - started_at)
+    results.put((statistics.median(durations), _peak_rss_kb() - before))
+
+
+def measure(name: str, image_bytes: bytes, runs: int):
+    """Run one filter in a fresh process, so its peak RSS above the decoded image is its own."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(name, image_bytes, runs, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark photo filters")
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    image_bytes = make_jpeg(args.megapixels)
+    print(f"{args.megapixels:g} MP image, {args.runs} runs; peak RSS is above the decoded image")
+    strip_names = [name + STRIPS for name in filter_names() if FILTERS[name].pixelwise]
+    for name in ["legacy sepia"] + filter_names() + strip_names:
+        median, peak_kb = measure(name, image_bytes, args.runs)
+        print(f"{name:>26}: median {median * 1000:7.1f} ms, peak RSS +{peak_kb / 1024:6.1f} MB")
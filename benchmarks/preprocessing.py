@@ -0,0 +1,88 @@
+"""
+Latency and peak memory of classification preprocessing: the original full decode + resize against the
+draft-mode pipeline in subject_predictor._preprocess. Run from the repository root:
+
+    python -m benchmarks.preprocessing [--megapixels 24] [--runs 10]
+"""
+import argparse
+import multiprocessing
+import resource
+import statistics
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from subject_predictor import _preprocess
+
+
+def legacy_preprocess(image_bytes: bytes) -> np.ndarray:
+    img = Image.open(BytesIO(image_bytes)).convert('RGB')
+    img = img.resize((224, 224))
+    return np.asarray(img, dtype=np.float32) / 127.5 - 1.0
+
+
+VARIANTS = {"legacy": legacy_preprocess, "draft": _preprocess}
+
+
+def make_jpeg(megapixels: float) -> bytes:
+    width = int((megapixels * 1e6 * 3 / 2) ** 0.5)
+    height = int(width * 2 / 3)
+    # Smooth gradients plus noise: compresses like a photo, unlike flat colour or pure noise
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    noise = np.random.RandomState(0).randint(-20, 20, size=(height, width, 1))
+    image = Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _peak_rss_kb() -> int:
+    # VmHWM starts over in a new process image; ru_maxrss keeps the parent's peak across exec on Linux
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure(variant: str, image_bytes: bytes, runs: int, results):
+    preprocess = VARIANTS[variant]
+    before = _peak_rss_kb()
+    durations = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        preprocess(image_bytes)
+        durations.append(time.perf_counter() - started_at)
+    peak_kb = _peak_rss_kb() - before
+    results.put((statistics.median(durations), min(durations), peak_kb))
+
+
+def measure(variant: str, image_bytes: bytes, runs: int):
+    """Run one variant in a fresh process, so its peak RSS is not hidden by the other's."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(variant, image_bytes, runs, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark classification preprocessing")
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    image_bytes = make_jpeg(args.megapixels)
+    print(f"{args.megapixels:g} MP JPEG, {len(image_bytes) / 1e6:.1f} MB, {args.runs} runs")
+    for variant in VARIANTS:
+        median, best, peak_kb = measure(variant, image_bytes, args.runs)
+        print(f"{variant:>7}: median {median * 1000:7.1f} ms, best {best * 1000:7.1f} ms, "
+              f"peak RSS +{peak_kb / 1024:6.1f} MB")
@@ -0,0 +1,193 @@
+import abc
+import hashlib
+import mmap
+import os
+import tempfile
+from functools import lru_cache
+
+BLOB_STORE = os.getenv("BLOB_STORE", "local")  # local | s3 | s3-local
+BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH", "./blobs")
+BLOB_STORE_BUCKET = os.getenv("BLOB_STORE_BUCKET", "gallery-blobs")
+BLOB_STORE_ENDPOINT_URL = os.getenv("BLOB_STORE_ENDPOINT_URL")
+
+
+def content_key(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore(abc.ABC):
+    """Content-addressed storage for encrypted image blobs. Keys are the SHA-256 of the stored bytes."""
+
+    @abc.abstractmethod
+    def put(self, data) -> str:
+        ...
+
+    @abc.abstractmethod
+    def get(self, key: str):
+        """Return the blob as a bytes-like object (possibly a read-only memory map)."""
+
+    @abc.abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        ...
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files sharded by key prefix (ab/cd/abcd...), read through mmap."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data) -> str:
+        key = content_key(data)
+        path = self.path(key)
+        if os.path.exists(path):
+            return key
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write next to the final path and rename, so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key
+
+    def get(self, key: str):
+        with open(self.path(key), "rb") as blob_file:
+            if os.fstat(blob_file.fileno()).st_size == 0:
+                return b""
+            # The mapping stays valid after the file is closed; pages are loaded on demand
+            return mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore(BlobStore):
+    """Blobs in an S3-compatible bucket. `client` is a boto3 S3 client or anything with the same methods."""
+
+    def __init__(self, client, bucket: str, prefix: str = "blobs/"):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key[:2]}/{key[2:4]}/{key}"
+
+    def put(self, data) -> str:
+        key = content_key(data)
+        if not self.exists(key):
+            self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=bytes(data))
+        return key
+
+    def get(self, key: str):
+        return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except Exception as e:
+            if _is_not_found(e):
+                return False
+            raise
+        return True
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+
+class ObjectNotFound(Exception):
+    def __init__(self, key: str):
+        super().__init__(key)
+        # Same shape as botocore's ClientError.response
+        self.response = {"Error": {"Code": "404", "Key": key}}
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def read(self) -> bytes:
+        return self._data
+
+
+class LocalS3Client:
+    """Directory-backed stand-in for the subset of the boto3 S3 client used by S3BlobStore."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as object_file:
+            object_file.write(Body)
+        return {}
+
+    def get_object(self, Bucket: str, Key: str):
+        try:
+            with open(self._path(Bucket, Key), "rb") as object_file:
+                return {"Body": _Body(object_file.read())}
+        except FileNotFoundError:
+            raise ObjectNotFound(Key)
+
+    def head_object(self, Bucket: str, Key: str):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise ObjectNotFound(Key)
+        return {"ContentLength": os.path.getsize(path)}
+
+    def delete_object(self, Bucket: str, Key: str):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+
+def _is_not_found(error: Exception) -> bool:
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+@lru_cache(maxsize=None)
+def get_blob_store() -> BlobStore:
+    if BLOB_STORE == "local":
+        return LocalBlobStore(BLOB_STORE_PATH)
+    if BLOB_STORE == "s3-local":
+        return S3BlobStore(LocalS3Client(BLOB_STORE_PATH), BLOB_STORE_BUCKET)
+    if BLOB_STORE == "s3":
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("BLOB_STORE=s3 requires the boto3 package")
+        return S3BlobStore(boto3.client("s3", endpoint_url=BLOB_STORE_ENDPOINT_URL), BLOB_STORE_BUCKET)
+    raise ValueError(f"Unknown BLOB_STORE: {BLOB_STORE}")
+
+
+def load_blob(blob_store: BlobStore, key: str, inline_data):
+    """Blob bytes for a photo version: from the store, or from the legacy in-row column."""
+    if key is not None:
+        return blob_store.get(key)
+    return inline_data
@@ -0,0 +1,93 @@
+import hashlib
+import hmac
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from subject_backends import Analysis
+
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFICATION_CACHE_MAX_ENTRIES", "10000"))
+# Must stay the same across restarts and workers, or the stored results stop matching
+CLASSIFICATION_CACHE_KEY = os.getenv("CLASSIFICATION_CACHE_KEY", "").encode() or None
+# On by default once a key is set; enabling it without one stops the API from starting
+CLASSIFICATION_CACHE_ENABLED = os.getenv(
+    "CLASSIFICATION_CACHE_ENABLED", "true" if CLASSIFICATION_CACHE_KEY else "false"
+).lower() == "true"
+
+
+def check_cache_key():
+    """Called at startup: the cache refuses to run without CLASSIFICATION_CACHE_KEY."""
+    if CLASSIFICATION_CACHE_ENABLED and CLASSIFICATION_CACHE_KEY is None:
+        raise RuntimeError("CLASSIFICATION_CACHE_ENABLED requires CLASSIFICATION_CACHE_KEY")
+
+
+def content_hmac(user_id: int, image_data: bytes) -> str:
+    """
+    Keyed digest of an upload. Scoped to the uploader, so a hit never tells one user that another
+    uploaded the same image.
+    """
+    if CLASSIFICATION_CACHE_KEY is None:
+        raise RuntimeError("CLASSIFICATION_CACHE_KEY is not set")
+    digest = hmac.new(CLASSIFICATION_CACHE_KEY, f"{user_id}:".encode(), hashlib.sha256)
+    digest.update(image_data)
+    return digest.hexdigest()
+
+
+class ClassificationCache:
+    """
+    LRU map of content HMAC -> Analysis (label and encoded embedding, or None), in front of the
+    classification_results table.
+    """
+
+    def __init__(self, max_entries: int = CLASSIFICATION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, digest: str) -> Optional[Analysis]:
+        with self._lock:
+            analysis = self._entries.get(digest)
+            if analysis is not None:
+                self._entries.move_to_end(digest)
+                self.memory_hits += 1
+            return analysis
+
+    def put(self, digest: str, analysis: Analysis):
+        with self._lock:
+            self._entries[digest] = analysis
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_db_hit(self):
+        with self._lock:
+            self.db_hits += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.db_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                # Every hit is one forward pass that did not run
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+classification_cache = ClassificationCache()
@@ -0,0 +1,50 @@
+import base64
+import logging
+import os
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from subject_predictor import INFERENCE_MAX_BATCH_SIZE
+
+CLASSIFICATION_MODE = os.getenv("CLASSIFICATION_MODE", "sync")  # sync | background
+CLASSIFICATION_JOB_LEASE_SECONDS = float(os.getenv("CLASSIFICATION_JOB_LEASE_SECONDS", "120"))
+CLASSIFICATION_JOB_MAX_ATTEMPTS = int(os.getenv("CLASSIFICATION_JOB_MAX_ATTEMPTS", "3"))
+CLASSIFICATION_WORKER_POLL_SECONDS = float(os.getenv("CLASSIFICATION_WORKER_POLL_SECONDS", "5"))
+# Enough jobs in flight for the inference batcher to fill its batches
+CLASSIFICATION_WORKER_CONCURRENCY = int(os.getenv("CLASSIFICATION_WORKER_CONCURRENCY", str(INFERENCE_MAX_BATCH_SIZE)))
+
+# 32 bytes, base64; must be the same for every worker that can pick up a job. Required in background mode: queued
+# jobs hold the plaintext image, sealed under this key
+_JOB_KEY = os.getenv("CLASSIFICATION_JOB_KEY")
+CLASSIFICATION_JOB_KEY = base64.b64decode(_JOB_KEY) if _JOB_KEY else None
+
+logger = logging.getLogger(__name__)
+
+_NONCE_SIZE = 12
+
+
+def check_job_key():
+    """Called at startup: background classification refuses to run without CLASSIFICATION_JOB_KEY."""
+    if CLASSIFICATION_JOB_KEY is not None:
+        return
+    if CLASSIFICATION_MODE == "background":
+        raise RuntimeError("CLASSIFICATION_MODE=background requires CLASSIFICATION_JOB_KEY (32 bytes, base64)")
+    logger.warning("CLASSIFICATION_JOB_KEY is not set; CLASSIFICATION_MODE=background will refuse to start")
+
+
+def _job_cipher() -> AESGCM:
+    if CLASSIFICATION_JOB_KEY is None:
+        raise RuntimeError("CLASSIFICATION_JOB_KEY is not set")
+    return AESGCM(CLASSIFICATION_JOB_KEY)
+
+
+def seal_work_item(image_data: bytes, user_id: int) -> bytes:
+    nonce = os.urandom(_NONCE_SIZE)
+    # Bound to the uploader, so a work item cannot be replayed into another user's job
+    return nonce + _job_cipher().encrypt(nonce, image_data, str(user_id).encode())
+
+
+def open_work_item(work_item: bytes, user_id: int) -> bytes:
+    return _job_cipher().decrypt(
+        work_item[:_NONCE_SIZE], work_item[_NONCE_SIZE:], str(user_id).encode()
+    )
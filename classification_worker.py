@@ -0,0 +1,83 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from classification_jobs import CLASSIFICATION_WORKER_CONCURRENCY, CLASSIFICATION_WORKER_POLL_SECONDS
+from database import SessionLocal
+from services.classification_service import ClassificationService
+
+logger = logging.getLogger(__name__)
+
+
+class ClassificationWorker:
+    """
+    Runs queued classification jobs in the API process. Jobs live in the database, so the ones left over
+    from a restart (or from another process) are picked up on the next poll.
+    """
+
+    def __init__(self, session_factory=SessionLocal, concurrency: int = CLASSIFICATION_WORKER_CONCURRENCY,
+                 poll_seconds: float = CLASSIFICATION_WORKER_POLL_SECONDS):
+        self._session_factory = session_factory
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.completed = 0
+        self.retried = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._loop, name="classification-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def notify(self):
+        """A job was committed; look for it now rather than at the next poll."""
+        self._wake.set()
+
+    def run_pending(self) -> int:
+        """Run the jobs that are due, up to `concurrency` at a time. Returns how many finished."""
+        with self._session_factory() as db:
+            job_ids = ClassificationService(db).due_job_ids(self.concurrency)
+        if not job_ids:
+            return 0
+
+        # Jobs run side by side so that their predictions share forward passes in the inference batcher
+        with ThreadPoolExecutor(max_workers=len(job_ids), thread_name_prefix="classification-job") as executor:
+            finished = sum(executor.map(self._run_job, job_ids))
+        self.completed += finished
+        self.retried += len(job_ids) - finished
+        return finished
+
+    def stats(self) -> dict:
+        return {"running": self._thread is not None, "completed": self.completed, "retried": self.retried}
+
+    def _run_job(self, job_id: int) -> bool:
+        try:
+            with self._session_factory() as db:
+                return ClassificationService(db).run_job(job_id)
+        except Exception:
+            logger.exception("Classification job %s failed", job_id)
+            return False
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                finished = self.run_pending()
+            except Exception:
+                logger.exception("Polling classification jobs failed")
+                finished = 0
+            if not finished:
+                self._wake.wait(self.poll_seconds)
+
+
+classification_worker = ClassificationWorker()
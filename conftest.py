@@ -1,17 +1,32 @@
+import base64
+import os
+import tempfile
+
 import pytest
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from fastapi.testclient import TestClient
 
-from main import app, get_db
+# Keep blobs written by the tests out of the working tree
+os.environ.setdefault("BLOB_STORE_PATH", tempfile.mkdtemp(prefix="gallery-test-blobs-"))
+# Background classification and the classification cache refuse to run without their keys
+os.environ.setdefault("CLASSIFICATION_JOB_KEY", base64.b64encode(os.urandom(32)).decode())
+os.environ.setdefault("CLASSIFICATION_CACHE_KEY", os.urandom(16).hex())
+
+from main import app, get_async_db
 from database import Base
+from classification_cache import classification_cache
+from subject_cache import subject_cache
+from vector_index import vector_indexes
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 @pytest.fixture(scope="session")
 def db_engine():
@@ -37,7 +52,28 @@ def client(db_session):
         finally:
             pass
 
-    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_db
+    with TestClient(app) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+@pytest.fixture(scope="function")
+def async_client(db_engine, monkeypatch):
+    """
+    A client whose endpoints get real AsyncSessions (aiosqlite) on the test database, as with an async driver in
+    production. Nothing is rolled back; clean_db resets the tables for the next test.
+    """
+    # Unpooled: aiosqlite connections belong to the event loop of the TestClient that opened them
+    async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+    AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    # run_db(..., blocking=True) opens sync sessions, which have to reach the same database
+    monkeypatch.setattr("database.SessionLocal", TestingSessionLocal)
+    app.dependency_overrides[get_async_db] = override_get_async_db
     with TestClient(app) as c:
         yield c
     app.dependency_overrides.clear()
@@ -46,4 +82,8 @@ def client(db_session):
 def clean_db(db_engine):
     # Use the test database engine instead of creating a new one
     Base.metadata.drop_all(bind=db_engine)
-    Base.metadata.create_all(bind=db_engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=db_engine)
+    # Subject ids and classifications from the previous test's (rolled back) database
+    subject_cache.clear()
+    classification_cache.clear()
+    vector_indexes.clear()
\ No newline at end of file
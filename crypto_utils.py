@@ -1,9 +1,25 @@
+import hashlib
+import hmac
 import os
+import struct
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+from executors import crypto_pool
+from key_cache import key_cache
+
+# Segmented blob format: a versioned header followed by fixed-size chunks, each sealed with its own tag.
+# Chunk nonces are the header's random prefix + chunk index + a last-chunk flag, and every chunk
+# authenticates the header, so chunks cannot be reordered, truncated or spliced between blobs.
+CHUNK_MAGIC = b"PCFC"
+CHUNK_FORMAT_VERSION = 1
+CHUNK_SIZE = int(os.getenv("ENCRYPTION_CHUNK_SIZE", str(64 * 1024)))
+_CHUNK_HEADER = struct.Struct(">4sBIQ7s")
+_TAG_SIZE = 16
+
 def derive_key(password: str, salt: bytes) -> bytes:
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
@@ -14,17 +30,119 @@ def derive_key(password: str, salt: bytes) -> bytes:
     )
     return kdf.derive(password.encode())
 
-def encrypt_image(data: bytes, password: str) -> tuple:
-    salt = os.urandom(16)
+def _derive_in_pool(password: str, salt: bytes) -> bytes:
+    return crypto_pool.call(derive_key, password, salt)
+
+def get_key(password: str, salt: bytes, user_id: int = None, confirm=None) -> bytes:
+    # Without a user to scope the entry to, fall back to an uncached derivation. Keys are only cached once
+    # confirm(key) has checked them, e.g. against the gallery key verifier
+    if user_id is None:
+        return _derive_in_pool(password, salt)
+    return key_cache.get_or_derive(user_id, salt, password, _derive_in_pool, confirm)
+
+def generate_salt() -> bytes:
+    return os.urandom(16)
+
+def key_verifier(master_key: bytes) -> bytes:
+    # Lets a wrong gallery password be rejected before touching any photo
+    return hmac.new(master_key, b"gallery-key-verifier", hashlib.sha256).digest()
+
+def generate_data_key() -> bytes:
+    return AESGCM.generate_key(bit_length=256)
+
+def wrap_key(master_key: bytes, data_key: bytes) -> bytes:
+    return aes_key_wrap(master_key, data_key, backend=default_backend())
+
+def unwrap_key(master_key: bytes, wrapped_key: bytes) -> bytes:
+    return aes_key_unwrap(master_key, wrapped_key, backend=default_backend())
+
+def encrypt_image(data: bytes, key: bytes) -> tuple:
     nonce = os.urandom(12)
-    key = derive_key(password, salt)
     aesgcm = AESGCM(key)
     encrypted_data = aesgcm.encrypt(nonce, data, None)
     tag = encrypted_data[-16:]
     ciphertext = encrypted_data[:-16]
-    return ciphertext, salt, nonce, tag
+    return ciphertext, nonce, tag
+
+def decrypt_image(encrypted_data: bytes, nonce: bytes, tag: bytes, key: bytes) -> bytes:
+    aesgcm = AESGCM(key)
+    return aesgcm.decrypt(nonce, encrypted_data + tag, None)
+
+def _chunk_nonce(prefix: bytes, index: int, last: bool) -> bytes:
+    return prefix + struct.pack(">IB", index, 1 if last else 0)
+
+def _chunk_count(size: int, chunk_size: int) -> int:
+    return max(1, -(-size // chunk_size))
+
+def iter_encrypt_chunked(data: bytes, key: bytes, chunk_size: int = CHUNK_SIZE):
+    nonce_prefix = os.urandom(7)
+    header = _CHUNK_HEADER.pack(CHUNK_MAGIC, CHUNK_FORMAT_VERSION, chunk_size, len(data), nonce_prefix)
+    yield header
 
-def decrypt_image(encrypted_data: bytes, salt: bytes, nonce: bytes, tag: bytes, password: str) -> bytes:
-    key = derive_key(password, salt)
     aesgcm = AESGCM(key)
-    return aesgcm.decrypt(nonce, encrypted_data + tag, None)
\ No newline at end of file
+    view = memoryview(data)
+    count = _chunk_count(len(data), chunk_size)
+    for index in range(count):
+        chunk = view[index * chunk_size:(index + 1) * chunk_size]
+        yield aesgcm.encrypt(_chunk_nonce(nonce_prefix, index, index == count - 1), chunk, header)
+
+def encrypt_chunked(data: bytes, key: bytes, chunk_size: int = CHUNK_SIZE) -> bytes:
+    return b"".join(iter_encrypt_chunked(data, key, chunk_size))
+
+class ChunkedDecryptor:
+    """Random access to the plaintext of a segmented blob, decrypting only the chunks a read touches."""
+
+    def __init__(self, blob, key: bytes):
+        self.blob = memoryview(blob)
+        self.header = bytes(self.blob[:_CHUNK_HEADER.size])
+        magic, version, self.chunk_size, self.size, self.nonce_prefix = _CHUNK_HEADER.unpack(self.header)
+        if magic != CHUNK_MAGIC or version != CHUNK_FORMAT_VERSION:
+            raise ValueError("Unsupported encrypted blob format")
+
+        self.chunk_count = _chunk_count(self.size, self.chunk_size)
+        expected_length = _CHUNK_HEADER.size + self.size + self.chunk_count * _TAG_SIZE
+        if len(self.blob) != expected_length:
+            raise ValueError("Encrypted blob is truncated or corrupted")
+
+        self.aesgcm = AESGCM(key)
+        self._last_chunk = (None, None)
+
+    def decrypt_chunk(self, index: int) -> bytes:
+        if self._last_chunk[0] == index:
+            return self._last_chunk[1]
+
+        start = _CHUNK_HEADER.size + index * (self.chunk_size + _TAG_SIZE)
+        sealed = self.blob[start:start + self.chunk_size + _TAG_SIZE]
+        nonce = _chunk_nonce(self.nonce_prefix, index, index == self.chunk_count - 1)
+        chunk = self.aesgcm.decrypt(nonce, sealed, self.header)
+        self._last_chunk = (index, chunk)
+        return chunk
+
+    def iter_range(self, start: int = 0, end: int = None):
+        """Yield the plaintext bytes in [start, end] (inclusive, like an HTTP byte range)."""
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        if start > end:
+            return
+
+        for index in range(start // self.chunk_size, end // self.chunk_size + 1):
+            chunk = self.decrypt_chunk(index)
+            chunk_start = index * self.chunk_size
+            yield chunk[max(start - chunk_start, 0):end - chunk_start + 1]
+
+    def read_all(self) -> bytes:
+        return b"".join(self.iter_range())
+
+class DecryptedBuffer:
+    """The ChunkedDecryptor interface over an image that was decrypted in one piece."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.size = len(data)
+
+    def iter_range(self, start: int = 0, end: int = None):
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        if start <= end:
+            yield self.data[start:end + 1]
+
+    def read_all(self) -> bytes:
+        return self.data
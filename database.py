@@ -1,20 +1,177 @@
 # database.py
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./gallery.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds; -1 disables
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# File-backed SQLite: WAL journal, pragmas applied on connect, and all writes serialized through one connection
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable at checkpoints under WAL
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+SQLITE_WRITE_QUEUE_TIMEOUT = int(os.getenv("SQLITE_WRITE_QUEUE_TIMEOUT", "60"))  # seconds waiting for the writer
+
+# DATABASE_URL may name either driver; the other engine gets its counterpart.
+# Plain sqlite:// URLs stay synchronous and use the sync fallback.
+_SYNC_DRIVERS = {"postgresql+asyncpg": "postgresql+psycopg", "sqlite+aiosqlite": "sqlite"}
+_ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg"}
+
+
+def sync_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=_SYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def async_url(url: str):
+    """The async form of `url`, or None when the backend is only used synchronously."""
+    url = make_url(url)
+    if url.drivername in _SYNC_DRIVERS:
+        return url
+    drivername = _ASYNC_DRIVERS.get(url.get_backend_name())
+    return url.set(drivername=drivername) if drivername else None
+
+
+def engine_options(url) -> dict:
+    if make_url(url).get_backend_name() == "sqlite":
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def is_file_sqlite(url) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def configure_sqlite(engine):
+    """Apply the SQLite production pragmas to every new DBAPI connection of `engine`."""
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+    return engine
+
+
+def create_engines(url):
+    """
+    (engine, write_engine) for `url`. write_engine is a single-connection engine that queues writers on
+    file-backed SQLite, and None for databases that handle concurrent writers themselves.
+    """
+    options = engine_options(url)
+    engine = create_engine(sync_url(url), **options)
+    if not is_file_sqlite(url):
+        return engine, None
 
-DATABASE_URL = "sqlite:///./gallery.db"  # Pentru început, putem folosi SQLite
+    write_engine = create_engine(
+        sync_url(url), pool_size=1, max_overflow=0, pool_timeout=SQLITE_WRITE_QUEUE_TIMEOUT, **options
+    )
+    return configure_sqlite(engine), configure_sqlite(write_engine)
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}  # doar pentru SQLite
+
+class RoutingSession(Session):
+    """
+    Reads go through the pooled engine. Flushes, DML and every statement after them until the transaction
+    ends go through the writer, so a transaction reads its own writes and holds the writer only while writing.
+    """
+
+    def __init__(self, *args, writer=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writer = writer
+        self._writing = False
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if self.writer is not None and (self._writing or self._flushing or isinstance(clause, UpdateBase)):
+            self._writing = True
+            return self.writer
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+    def commit(self):
+        super().commit()
+        self._writing = False
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            self._writing = False
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._writing = False
+
+
+# The sync engines serve migrations and the services that run in worker threads (crypto, imaging)
+engine, write_engine = create_engines(DATABASE_URL)
+# Committed objects stay loaded, so returning them after a commit does not trigger a reload
+SessionLocal = sessionmaker(
+    class_=RoutingSession, autocommit=False, autoflush=False, expire_on_commit=False, bind=engine,
+    writer=write_engine
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+_async_url = async_url(DATABASE_URL)
+async_engine = create_async_engine(_async_url, **engine_options(_async_url)) if _async_url else None
+if async_engine is not None and is_file_sqlite(_async_url):
+    configure_sqlite(async_engine.sync_engine)
+AsyncSessionLocal = (
+    async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False) if async_engine else None
+)
+
 Base = declarative_base()
 
-# Dependență pentru DB
-def get_db():
-    db = SessionLocal()
-    try:
+
+async def get_async_db():
+    """An AsyncSession when the database has an async driver, otherwise a sync Session (see run_db)."""
+    if AsyncSessionLocal is None:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+        return
+
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
+
+
+async def run_db(db, fn, *args, blocking: bool = False):
+    """
+    Run `fn(session, *args)` against a session from get_async_db without blocking the event loop. The sync
+    fallback runs it in the threadpool. An AsyncSession runs it through the async driver's greenlet bridge,
+    which is on the event loop thread itself; pass blocking=True when `fn` also derives keys, encrypts or
+    processes images (or waits on the pools that do), so that it runs in the threadpool on a sync session instead.
+    """
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(fn, db, *args)
+    if blocking:
+        return await run_in_threadpool(_run_in_sync_session, fn, *args)
+    return await db.run_sync(fn, *args)
+
+
+def _run_in_sync_session(fn, *args):
+    with SessionLocal() as session:
+        return fn(session, *args)
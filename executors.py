@@ -0,0 +1,239 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+CPU_COUNT = os.cpu_count() or 1
+CRYPTO_POOL_SIZE = int(os.getenv("CRYPTO_POOL_SIZE", str(CPU_COUNT)))
+IMAGING_POOL_SIZE = int(os.getenv("IMAGING_POOL_SIZE", str(max(1, CPU_COUNT // 2))))
+# Inference worker processes; 0 runs the model in the API process
+INFERENCE_PROCESSES = int(os.getenv("INFERENCE_PROCESSES", "0"))
+# One thread per inference process keeps every process busy with a batch
+ML_POOL_SIZE = int(os.getenv("ML_POOL_SIZE", str(max(1, INFERENCE_PROCESSES))))
+
+# Number of recent queue wait times kept per pool for percentile reporting
+_WAIT_SAMPLES = 1024
+
+_END = object()
+
+
+class StagePool:
+    """
+    A sized thread pool for one kind of CPU-bound work, with queue-depth and wait-time metrics.
+    Only leaf work (a KDF, a cipher pass, a decode, a forward pass) should be submitted here;
+    a task that waits on the same pool can deadlock it once every worker is busy.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-pool")
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=_WAIT_SAMPLES)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+
+        def run():
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self._waits.append(time.perf_counter() - submitted_at)
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        return self._executor.submit(run)
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn on the pool and block until it finishes. For code that is already off the event loop."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    async def iterate(self, iterator):
+        """Drive a blocking iterator from the event loop, producing each item on the pool."""
+        while True:
+            item = await self.run(next, iterator, _END)
+            if item is _END:
+                return
+            yield item
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "wait_ms_p50": _percentile(waits, 0.50) * 1000,
+                "wait_ms_p99": _percentile(waits, 0.99) * 1000,
+                "wait_ms_max": (waits[-1] if waits else 0.0) * 1000,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class StageTimings:
+    """Recent wall-clock durations of each stage of a request pipeline, for percentile reporting."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._failures = {}
+
+    @contextmanager
+    def stage(self, stage: str, timings: dict = None):
+        """
+        Time the block as `stage`; also store the duration in seconds in `timings` when given. A block left by
+        an exception counts as a failure of the stage.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            with self._lock:
+                self._failures[stage] = self._failures.get(stage, 0) + 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started_at
+            if timings is not None:
+                timings[stage] = elapsed
+            with self._lock:
+                self._samples.setdefault(stage, deque(maxlen=_WAIT_SAMPLES)).append(elapsed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = {stage: sorted(durations) for stage, durations in self._samples.items()}
+            failures = dict(self._failures)
+        return {
+            stage: {
+                "count": len(durations),
+                "failures": failures.get(stage, 0),
+                "ms_p50": _percentile(durations, 0.50) * 1000,
+                "ms_p99": _percentile(durations, 0.99) * 1000,
+                "ms_max": durations[-1] * 1000,
+            }
+            for stage, durations in samples.items()
+        }
+
+
+class MicroBatcher:
+    """
+    Collects concurrent calls into batches for `run_batch(items) -> results` (one result per item, same order).
+    A batch closes when it reaches max_batch_size or max_wait_ms after its first item, then runs on `pool`,
+    up to one batch per pool worker at a time; the next batch fills while they run. Callers block on their
+    own result only.
+    """
+
+    def __init__(self, name: str, run_batch, max_batch_size: int, max_wait_ms: float, pool: StagePool = None):
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._run_batch = run_batch
+        self._pool = pool
+        self._slots = threading.Semaphore(pool.max_workers) if pool is not None else None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    def call(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        self._ensure_started()
+        return future.result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+            }
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, name=f"{self.name}-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        while True:
+            if self._slots is not None:
+                # Wait for a free worker first: calls arriving meanwhile queue up and form a larger batch
+                self._slots.acquire()
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+            if self._pool is not None:
+                self._pool.submit(self._run, batch).add_done_callback(lambda _: self._slots.release())
+            else:
+                self._run(batch)
+
+    def _run(self, batch: list):
+        try:
+            results = self._run_batch([item for item, _ in batch])
+        except BaseException as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+crypto_pool = StagePool("crypto", CRYPTO_POOL_SIZE)
+imaging_pool = StagePool("imaging", IMAGING_POOL_SIZE)
+ml_pool = StagePool("ml", ML_POOL_SIZE)
+
+POOLS = (crypto_pool, imaging_pool, ml_pool)
+
+upload_timings = StageTimings("upload")
+
+
+def pool_stats() -> dict:
+    return {pool.name: pool.stats() for pool in POOLS}
@@ -0,0 +1,53 @@
+"""
+Export the MobileNetV2 subject model for SUBJECT_MODEL_BACKEND=onnx. Needs tensorflow and tf2onnx, which the
+API itself then no longer imports; --quantize also needs onnxruntime.
+
+    python export_subject_model.py                                   # models/mobilenet_v2.onnx + .labels.json
+    python export_subject_model.py --quantize --output models/mobilenet_v2.int8.onnx
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from subject_backends import SUBJECT_MODEL_PATH, embedding_model, labels_path
+
+
+def export_onnx(output_path: str = SUBJECT_MODEL_PATH, quantize: bool = False, write_labels: bool = True):
+    import tensorflow as tf
+
+    # Outputs: class scores, then the pooled embedding used for similarity search
+    model = embedding_model(tf)
+    # Keras only exports models that have been called once
+    model(np.zeros((1, 224, 224, 3), dtype=np.float32))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    if not quantize:
+        model.export(output_path, format="onnx")
+    else:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        # int8 weights with dynamically quantized activations; no calibration set required
+        float_path = f"{output_path}.float32"
+        model.export(float_path, format="onnx")
+        try:
+            quantize_dynamic(float_path, output_path, weight_type=QuantType.QInt8)
+        finally:
+            os.remove(float_path)
+
+    if write_labels:
+        # Class names in index order, so the ONNX backend does not need Keras to decode predictions
+        decoded = tf.keras.applications.mobilenet_v2.decode_predictions(np.eye(1000, dtype=np.float32), top=1)
+        with open(labels_path(output_path), "w") as labels_file:
+            json.dump([top[0][1] for top in decoded], labels_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the subject classification model to ONNX")
+    parser.add_argument("--output", default=SUBJECT_MODEL_PATH)
+    parser.add_argument("--quantize", action="store_true", help="int8 dynamic quantization")
+    args = parser.parse_args()
+
+    export_onnx(args.output, quantize=args.quantize)
+    print(f"Wrote {args.output} and {labels_path(args.output)}")
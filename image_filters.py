@@ -0,0 +1,223 @@
+"""
+Registry of photo filters. A filter takes an RGB image and returns the filtered RGB image; it should run in
+Pillow's C paths (a colour matrix, a LUT, a convolution) or as a numpy kernel over bounded float32 strips, never
+as a whole-image float64 array. Register new filters with @register_filter; PhotoService looks them up by name.
+
+A pipeline is an ordered list of {"op": name, "params": {...}} steps applied to one decoded image. Params
+measured in pixels are declared as spatial, so a pipeline can be previewed on a downscaled image.
+"""
+import inspect
+import os
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+from PIL import Image, ImageFilter as PILImageFilter, ImageOps
+
+# Rows per strip in strip processing and per float32 working buffer in numpy kernels: 256 rows of a 6000 px wide
+# RGB image is ~18 MB as float32
+STRIP_ROWS = int(os.getenv("FILTER_STRIP_ROWS", "256"))
+# Larger images are filtered strip by strip in place when every step is pixelwise
+FILTER_STRIP_MIN_PIXELS = int(os.getenv("FILTER_STRIP_MIN_PIXELS", str(8_000_000)))
+# Images above this are refused before decoding; also caps resize targets. Stays below Pillow's own
+# decompression bomb error (2 * Image.MAX_IMAGE_PIXELS)
+FILTER_MAX_PIXELS = int(os.getenv("FILTER_MAX_PIXELS", str(150_000_000)))
+MAX_PIPELINE_STEPS = int(os.getenv("MAX_PIPELINE_STEPS", "16"))
+PREVIEW_MAX_EDGE = int(os.getenv("PREVIEW_MAX_EDGE", "2048"))
+PREVIEW_JPEG_QUALITY = int(os.getenv("PREVIEW_JPEG_QUALITY", "80"))
+
+
+class ImageFilter(NamedTuple):
+    name: str
+    apply: Callable[..., Image.Image]
+    # Each output pixel depends only on the same input pixel, not on its neighbours or position
+    pixelwise: bool
+    # Params given in pixels of the full-size image
+    spatial_params: tuple = ()
+    # (size, **params) -> size of the result, for filters that change it
+    output_size: Optional[Callable[..., tuple]] = None
+
+
+FILTERS = {}
+
+
+def register_filter(name: str, pixelwise: bool = True, spatial_params: tuple = (), output_size=None):
+    def decorator(apply):
+        FILTERS[name] = ImageFilter(name, apply, pixelwise, spatial_params, output_size)
+        return apply
+    return decorator
+
+
+def filter_names() -> list:
+    return list(FILTERS)
+
+
+def apply_filter(image: Image.Image, name: str, **params) -> Image.Image:
+    """Apply a registered filter to an RGB image; KeyError for an unknown name."""
+    return FILTERS[name].apply(image, **params)
+
+
+def validate_pipeline(steps) -> list:
+    """
+    Normalized copy of a pipeline: every op registered, every param accepted by it and numeric params
+    numbers. Raises ValueError describing the first problem.
+    """
+    if not isinstance(steps, list) or len(steps) > MAX_PIPELINE_STEPS:
+        raise ValueError(f"A pipeline is a list of at most {MAX_PIPELINE_STEPS} steps")
+
+    normalized = []
+    for step in steps:
+        if not isinstance(step, dict) or not isinstance(step.get("params", {}), dict):
+            raise ValueError('Each pipeline step must look like {"op": name, "params": {...}}')
+        op, params = step.get("op"), dict(step.get("params", {}))
+        if op not in FILTERS:
+            raise ValueError(f"Invalid filter name {op!r}. Available filters: {', '.join(filter_names())}")
+
+        signature = inspect.signature(FILTERS[op].apply)
+        try:
+            signature.bind(None, **params)
+        except TypeError:
+            accepted = [name for name in signature.parameters][1:]
+            raise ValueError(f"Invalid parameters for {op}; accepted: {', '.join(accepted) or 'none'}")
+        for name, value in params.items():
+            if signature.parameters[name].annotation in (int, float) and (
+                    isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise ValueError(f"{op}: {name} must be a number")
+        normalized.append({"op": op, "params": params})
+    return normalized
+
+
+def apply_pipeline(image: Image.Image, steps: list, scale: float = 1.0) -> Image.Image:
+    """Apply validated steps in order; `scale` is the size of `image` relative to the full-size photo."""
+    for step in steps:
+        image_filter = FILTERS[step["op"]]
+        params = {
+            name: value * scale if name in image_filter.spatial_params else value
+            for name, value in step["params"].items()
+        }
+        image = image_filter.apply(image, **params)
+    return image
+
+
+def pipeline_is_pixelwise(steps: list) -> bool:
+    return all(FILTERS[step["op"]].pixelwise for step in steps)
+
+
+def apply_pipeline_in_strips(image: Image.Image, steps: list, strip_rows: int = STRIP_ROWS) -> Image.Image:
+    """
+    Apply pixelwise steps to `image` in place, one horizontal strip at a time, so that the decoded image is the
+    only full-size buffer instead of one more per step.
+    """
+    for top in range(0, image.height, strip_rows):
+        box = (0, top, image.width, min(top + strip_rows, image.height))
+        image.paste(apply_pipeline(image.crop(box), steps), box)
+    return image
+
+
+def pipeline_output_size(size: tuple, steps: list) -> tuple:
+    """Size of the image a pipeline renders from a full-size image of `size`."""
+    for step in steps:
+        output_size = FILTERS[step["op"]].output_size
+        if output_size is not None:
+            size = output_size(size, **step["params"])
+    return size
+
+
+def pipeline_summary(steps: list) -> str:
+    """Op names in order, e.g. "crop > sepia"; stored as Photo.filter_applied for listing by filter."""
+    return " > ".join(step["op"] for step in steps)
+
+
+def _lut(function) -> list:
+    """A 768-entry lookup table applying `function` (vectorized over 0..255) to each RGB band."""
+    values = np.clip(np.rint(function(np.arange(256, dtype=np.float32))), 0, 255).astype(np.uint8)
+    return values.tolist() * 3
+
+
+def _crop_size(size: tuple, left: int, top: int, right: int, bottom: int) -> tuple:
+    return right - left, bottom - top
+
+
+@register_filter("crop", pixelwise=False, spatial_params=("left", "top", "right", "bottom"), output_size=_crop_size)
+def crop(image: Image.Image, left: int, top: int, right: int, bottom: int) -> Image.Image:
+    left, top, right, bottom = round(left), round(top), round(right), round(bottom)
+    if not (0 <= left < right <= image.width and 0 <= top < bottom <= image.height):
+        raise ValueError(f"Crop box must lie within the {image.width}x{image.height} image")
+    return image.crop((left, top, right, bottom))
+
+
+def _resize_size(size: tuple, width: int = 0, height: int = 0) -> tuple:
+    """width x height, with a zero dimension following the aspect ratio."""
+    if width < 0 or height < 0 or not (width or height):
+        raise ValueError("Resize needs a positive width or height")
+    width = max(1, round(width)) if width else max(1, round(size[0] * height / size[1]))
+    height = max(1, round(height)) if height else max(1, round(size[1] * width / size[0]))
+    if width * height > FILTER_MAX_PIXELS:
+        raise ValueError(f"Resize target exceeds {FILTER_MAX_PIXELS} pixels")
+    return width, height
+
+
+@register_filter("resize", pixelwise=False, spatial_params=("width", "height"), output_size=_resize_size)
+def resize(image: Image.Image, width: int = 0, height: int = 0) -> Image.Image:
+    """Resize to width x height; a zero dimension follows the aspect ratio."""
+    return image.resize(_resize_size(image.size, width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+@register_filter("sepia")
+def sepia(image: Image.Image) -> Image.Image:
+    # Pillow applies the matrix per pixel in C, clamping to 0..255, with no intermediate arrays
+    return image.convert("RGB", (
+        0.393, 0.769, 0.189, 0,
+        0.349, 0.686, 0.168, 0,
+        0.272, 0.534, 0.131, 0,
+    ))
+
+
+@register_filter("black and white")
+def black_and_white(image: Image.Image) -> Image.Image:
+    return image.convert("L").convert("RGB")
+
+
+@register_filter("color inversion")
+def color_inversion(image: Image.Image) -> Image.Image:
+    return ImageOps.invert(image)
+
+
+@register_filter("brightness")
+def brightness(image: Image.Image, factor: float = 1.2) -> Image.Image:
+    return image.point(_lut(lambda values: values * factor))
+
+
+@register_filter("contrast")
+def contrast(image: Image.Image, factor: float = 1.2) -> Image.Image:
+    # Around mid-grey rather than the image mean (as ImageEnhance does), so it needs no pass over the image
+    return image.point(_lut(lambda values: (values - 128) * factor + 128))
+
+
+@register_filter("blur", pixelwise=False, spatial_params=("radius",))
+def blur(image: Image.Image, radius: float = 2) -> Image.Image:
+    return image.filter(PILImageFilter.GaussianBlur(radius))
+
+
+@register_filter("sharpen", pixelwise=False, spatial_params=("radius",))
+def sharpen(image: Image.Image, radius: float = 2, percent: int = 150) -> Image.Image:
+    return image.filter(PILImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=3))
+
+
+# Not pixelwise: the falloff depends on where the pixel sits in the whole image
+@register_filter("vignette", pixelwise=False)
+def vignette(image: Image.Image, strength: float = 0.5) -> Image.Image:
+    """Darken towards the corners: each pixel is scaled by 1 - strength * (distance from centre / half-diagonal)²."""
+    width, height = image.size
+    # Squared distance is separable: a column term plus a row term, broadcast per strip
+    x_falloff = (np.linspace(-1, 1, width, dtype=np.float32) ** 2) * (strength / 2)
+    y_falloff = (np.linspace(-1, 1, height, dtype=np.float32) ** 2) * (strength / 2)
+    result = Image.new("RGB", image.size)
+    buffer = np.empty((min(STRIP_ROWS, height), width, 3), dtype=np.float32)
+    for top in range(0, height, STRIP_ROWS):
+        strip = np.asarray(image.crop((0, top, width, min(top + STRIP_ROWS, height))))
+        work = buffer[:len(strip)]
+        scale = 1 - y_falloff[top:top + len(strip), None] - x_falloff[None, :]
+        np.multiply(strip, scale[..., None], out=work)
+        np.clip(np.rint(work, out=work), 0, 255, out=work)
+        result.paste(Image.fromarray(work.astype(np.uint8)), (0, top))
+    return result
@@ -0,0 +1,272 @@
+import functools
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from executors import CPU_COUNT, INFERENCE_PROCESSES
+from subject_backends import create_backend
+
+# Threads each inference process gives TensorFlow / onnxruntime; by default the cores are split between them
+INFERENCE_THREADS_PER_PROCESS = int(
+    os.getenv("INFERENCE_THREADS_PER_PROCESS", str(max(1, CPU_COUNT // max(1, INFERENCE_PROCESSES))))
+)
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_TIMEOUT_SECONDS", "60"))
+INFERENCE_WORKER_START_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_WORKER_START_TIMEOUT_SECONDS", "300"))
+INFERENCE_HEALTH_CHECK_SECONDS = float(os.getenv("INFERENCE_HEALTH_CHECK_SECONDS", "10"))
+# A healthy idle worker answers a ping at once; a short timeout keeps a stuck one from being held for long
+INFERENCE_PING_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_PING_TIMEOUT_SECONDS", "5"))
+
+# Delay between attempts to restart a worker, doubling up to the maximum
+_RESTART_BACKOFF_SECONDS = 1.0
+_RESTART_BACKOFF_MAX_SECONDS = 30.0
+
+IMAGE_SHAPE = (224, 224, 3)
+
+# Fresh interpreters: forking a process that already runs TensorFlow or the API's threads is unsafe
+_context = multiprocessing.get_context("spawn")
+
+
+class InferenceWorkerError(RuntimeError):
+    pass
+
+
+def _worker_main(connection, shm_name: str, build):
+    """Entry point of an inference process: load the model once, then classify batches from shared memory."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        try:
+            backend = build()
+        except Exception as e:
+            connection.send(("error", repr(e)))
+            return
+        connection.send(("ready", os.getpid()))
+        while True:
+            try:
+                command, count = connection.recv()
+            except EOFError:
+                return
+            if command == "stop":
+                return
+            if command == "ping":
+                connection.send(("pong", None))
+                continue
+            try:
+                batch = np.ndarray((count, *IMAGE_SHAPE), dtype=np.float32, buffer=shm.buf)
+                analyses = backend.analyze(batch)
+                del batch
+                connection.send(("ok", analyses))
+            except Exception as e:
+                connection.send(("error", repr(e)))
+    finally:
+        shm.close()
+
+
+class _Worker:
+    """One inference process, its pipe and the shared-memory input buffer it reads batches from."""
+
+    def __init__(self, index: int, build, max_batch_size: int):
+        self.index = index
+        self.max_batch_size = max_batch_size
+        self._build = build
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max_batch_size * int(np.prod(IMAGE_SHAPE)) * np.dtype(np.float32).itemsize
+        )
+        self._inputs = np.ndarray((max_batch_size, *IMAGE_SHAPE), dtype=np.float32, buffer=self._shm.buf)
+        self.process = None
+        self.connection = None
+        self.batches = 0
+        self.restarts = 0
+
+    def start(self):
+        self.launch()
+        self.wait_ready()
+
+    def launch(self):
+        parent_end, child_end = _context.Pipe()
+        self.process = _context.Process(
+            target=_worker_main, args=(child_end, self._shm.name, self._build),
+            name=f"inference-worker-{self.index}", daemon=True
+        )
+        self.process.start()
+        child_end.close()
+        self.connection = parent_end
+
+    def wait_ready(self, timeout: float = INFERENCE_WORKER_START_TIMEOUT_SECONDS):
+        self._receive("ready", timeout)
+
+    def restart(self):
+        self.kill()
+        self.restarts += 1
+        self.start()
+
+    def classify(self, images: list, timeout: float = INFERENCE_TIMEOUT_SECONDS) -> list:
+        for offset, image in enumerate(images):
+            self._inputs[offset] = image
+        self.connection.send(("predict", len(images)))
+        analyses = self._receive("ok", timeout)
+        self.batches += 1
+        return analyses
+
+    def ping(self, timeout: float) -> bool:
+        try:
+            self.connection.send(("ping", None))
+            self._receive("pong", timeout)
+            return True
+        except (InferenceWorkerError, OSError):
+            return False
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def kill(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.process = None
+
+    def close(self):
+        if self.alive():
+            try:
+                self.connection.send(("stop", None))
+                self.process.join(timeout=5)
+            except OSError:
+                pass
+        self.kill()
+        del self._inputs
+        self._shm.close()
+        self._shm.unlink()
+
+    def stats(self) -> dict:
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive(),
+            "batches": self.batches,
+            "restarts": self.restarts,
+        }
+
+    def _receive(self, expected: str, timeout: float):
+        try:
+            if not self.connection.poll(timeout):
+                raise InferenceWorkerError(f"Inference worker {self.index} did not answer within {timeout}s")
+            status, payload = self.connection.recv()
+        except (EOFError, OSError):
+            raise InferenceWorkerError(f"Inference worker {self.index} exited")
+        if status == "error":
+            raise RuntimeError(payload)
+        if status != expected:
+            raise InferenceWorkerError(f"Inference worker {self.index} sent {status!r}, expected {expected!r}")
+        return payload
+
+
+class ProcessPoolBackend:
+    """
+    Runs the model in separate processes, each with its own pinned thread pools, so inference neither contends
+    with the API's threads nor is capped by one interpreter. Batches go through shared memory and analyses come
+    back over a pipe. Workers that die or stop answering are restarted in the background.
+
+    Stands in for an InferenceBackend wherever only classify() is called; scores stay in the worker processes.
+    """
+
+    def __init__(self, processes: int, build, max_batch_size: int,
+                 health_check_seconds: float = INFERENCE_HEALTH_CHECK_SECONDS):
+        self.max_batch_size = max_batch_size
+        self._workers = [_Worker(index, build, max_batch_size) for index in range(processes)]
+        self._idle = queue.Queue()
+        self._closed = threading.Event()
+        try:
+            # Models load in parallel; the pool is only returned once every process is ready
+            for worker in self._workers:
+                worker.launch()
+            for worker in self._workers:
+                worker.wait_ready()
+                self._idle.put(worker)
+        except BaseException:
+            self.close()
+            raise
+
+        self._monitor = threading.Thread(
+            target=self._check_health, args=(health_check_seconds,), name="inference-health", daemon=True
+        )
+        self._monitor.start()
+
+    def classify(self, images: list) -> list:
+        analyses = []
+        for start in range(0, len(images), self.max_batch_size):
+            analyses.extend(self._classify_on_worker(images[start:start + self.max_batch_size]))
+        return analyses
+
+    def close(self):
+        self._closed.set()
+        for worker in self._workers:
+            worker.close()
+
+    def stats(self) -> dict:
+        return {
+            "processes": len(self._workers),
+            "idle": self._idle.qsize(),
+            "workers": [worker.stats() for worker in self._workers],
+        }
+
+    def _classify_on_worker(self, images: list) -> list:
+        try:
+            worker = self._idle.get(timeout=INFERENCE_TIMEOUT_SECONDS)
+        except queue.Empty:
+            raise InferenceWorkerError(f"No inference worker became available within {INFERENCE_TIMEOUT_SECONDS}s")
+        try:
+            analyses = worker.classify(images)
+        except InferenceWorkerError:
+            self._restart_in_background(worker)
+            raise
+        except BaseException:
+            # The model failed on this batch; the process itself is fine
+            self._idle.put(worker)
+            raise
+        self._idle.put(worker)
+        return analyses
+
+    def _restart_in_background(self, worker: _Worker):
+        def restart():
+            delay = _RESTART_BACKOFF_SECONDS
+            while not self._closed.is_set():
+                try:
+                    worker.restart()
+                except Exception:
+                    # A dead process, a timeout or a model that fails to build: try again later
+                    self._closed.wait(delay)
+                    delay = min(delay * 2, _RESTART_BACKOFF_MAX_SECONDS)
+                    continue
+                self._idle.put(worker)
+                return
+
+        threading.Thread(target=restart, name=f"inference-restart-{worker.index}", daemon=True).start()
+
+    def _check_health(self, interval: float):
+        while not self._closed.wait(interval):
+            # Only idle workers are pinged, one at a time so the others keep serving; a busy one proves itself
+            # by answering its batch
+            for _ in range(self._idle.qsize()):
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if worker.alive() and worker.ping(INFERENCE_PING_TIMEOUT_SECONDS):
+                    self._idle.put(worker)
+                else:
+                    self._restart_in_background(worker)
+
+
+def create_process_pool(processes: int, max_batch_size: int, **backend_options) -> ProcessPoolBackend:
+    build = functools.partial(
+        create_backend,
+        intra_op_threads=INFERENCE_THREADS_PER_PROCESS,
+        inter_op_threads=1,
+        **backend_options
+    )
+    return ProcessPoolBackend(processes, build, max_batch_size)
@@ -0,0 +1,11 @@
+def test_readiness(client):
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+    assert response.json()["model"]["enabled"] is True
+
+
+def test_metrics(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert set(response.json()["executors"]) == {"crypto", "imaging", "ml"}
@@ -34,6 +34,7 @@ def test_upload_photo(client, db_session):
     assert response.json()["filename"] == "test.jpg"
     assert response.json()["subject_id"] == 1
     assert response.json()["filter_applied"] is None
+    assert "persist;dur=" in response.headers["Server-Timing"]
 
 def test_upload_photo_no_subject(client, db_session):
     # Register and login first
@@ -83,6 +84,43 @@ def test_get_user_photos(client, db_session):
     print("RESPONSE:", response.json())
 
     assert len(response.json()) > 0
+    assert "X-Next-Cursor" not in response.headers
+
+def test_get_user_photos_pages_through_next_cursor_header(client, db_session):
+    client.post("/register", json={"username": "testuser", "password": "testpass"})
+    login = client.post("/login", json={"username": "testuser", "password": "testpass"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    for _ in range(3):
+        client.post("/photos/", files={"file": create_test_image()},
+                    data={"gallery_password": "testpass", "subject_name": "my_subject"}, headers=headers)
+
+    first = client.get("/photos/", params={"limit": 2}, headers=headers)
+    assert first.status_code == 200
+    assert len(first.json()) == 2
+    second = client.get("/photos/", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]}, headers=headers)
+    assert len(second.json()) == 1
+    assert "X-Next-Cursor" not in second.headers
+    assert {photo["id"] for photo in first.json() + second.json()} == {1, 2, 3}
+
+def test_photo_endpoints_with_async_sessions(async_client):
+    async_client.post("/register", json={"username": "asyncuser", "password": "testpass"})
+    login = async_client.post("/login", json={"username": "asyncuser", "password": "testpass"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    # Runs in the threadpool on a sync session
+    upload = async_client.post("/photos/", files={"file": create_test_image()},
+                               data={"gallery_password": "testpass", "subject_name": "my_subject"}, headers=headers)
+    assert upload.status_code == 200
+
+    # Run through AsyncSession.run_sync
+    photos = async_client.get("/photos/", headers=headers)
+    assert [photo["id"] for photo in photos.json()] == [upload.json()["id"]]
+    subjects = async_client.get("/subjects/", headers=headers)
+    assert [subject["name"] for subject in subjects.json()] == ["my_subject"]
+
+    photo = async_client.get(f"/photos/{upload.json()['id']}", params={"gallery_password": "testpass"}, headers=headers)
+    assert photo.status_code == 200
+    assert photo.content == create_test_image().getvalue()
 
 def test_duplicate_photo(client, db_session):
     # Register and login
@@ -180,7 +218,8 @@ def test_apply_filter_to_photo(client, db_session):
     photo_id = photo["id"]
 
     # Define filters to test including restore 'none'
-    filters = ["none", "sepia", "black and white", "color inversion"]
+    filters = ["none", "sepia", "black and white", "color inversion", "brightness", "contrast", "blur", "sharpen",
+               "vignette"]
 
     for filter_name in filters:
         response = client.patch(
@@ -253,12 +292,148 @@ def test_get_photo_decryption_failure(client: TestClient, monkeypatch):
     print("JSON: ", upload_resp.json())
     photo_id = upload_resp.json()["id"]
 
-    # Monkeypatch decrypt_image to raise Exception to simulate failure
+    # Monkeypatch the blob decryptor to raise Exception to simulate failure
     from services import photo_service
-    monkeypatch.setattr(photo_service, "decrypt_image", lambda *args, **kwargs: (_ for _ in ()).throw(Exception("fail")))
+    monkeypatch.setattr(photo_service, "ChunkedDecryptor", lambda *args, **kwargs: (_ for _ in ()).throw(Exception("fail")))
 
     # Request the photo endpoint expecting a 400 error
     resp = client.get(f"/photos/{photo_id}", params={"gallery_password": "testpass"}, headers=headers)
     assert resp.status_code == 400
     assert resp.json()["detail"] == "Decryption failed"
 
+
+def test_get_photo_byte_range(client, db_session):
+    client.post("/register", json={"username": "testuser", "password": "testpass"})
+    login = client.post("/login", json={"username": "testuser", "password": "testpass"})
+    token = login.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    test_image = create_test_image()
+    image_data = test_image.getvalue()
+    upload_response = client.post(
+        "/photos/",
+        files={"file": ("test.jpg", test_image, "image/jpeg")},
+        data={"gallery_password": "testpass", "subject_name": "my_subject"},
+        headers=headers
+    )
+    photo_id = upload_response.json()["id"]
+
+    response = client.get(
+        f"/photos/{photo_id}",
+        params={"gallery_password": "testpass"},
+        headers={**headers, "Range": "bytes=100-199"}
+    )
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{len(image_data)}"
+    assert response.content == image_data[100:200]
+
+    response = client.get(
+        f"/photos/{photo_id}",
+        params={"gallery_password": "testpass"},
+        headers={**headers, "Range": f"bytes={len(image_data)}-"}
+    )
+    assert response.status_code == 416
+
+
+def test_get_similar_photos(client, db_session, monkeypatch):
+    import numpy as np
+    from subject_backends import Analysis
+
+    monkeypatch.setattr("services.photo_service.EMBEDDINGS_ENABLED", True)
+    vectors = iter([[1.0, 0.0], [0.0, 1.0], [0.9, 0.1]])
+    monkeypatch.setattr(
+        "services.classification_service.analyze_image",
+        lambda image_data: Analysis("seashore", np.array(next(vectors), dtype=np.float32))
+    )
+
+    client.post("/register", json={"username": "testuser", "password": "testpass"})
+    login = client.post("/login", json={"username": "testuser", "password": "testpass"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    photo_ids = []
+    for color in ("red", "green", "blue"):
+        file = io.BytesIO()
+        Image.new('RGB', (100, 100), color=color).save(file, 'jpeg')
+        file.seek(0)
+        response = client.post(
+            "/photos/",
+            files={"file": ("test.jpg", file, "image/jpeg")},
+            data={"gallery_password": "testpass", "subject_name": "my_subject"},
+            headers=headers
+        )
+        photo_ids.append(response.json()["id"])
+
+    response = client.get(f"/photos/{photo_ids[0]}/similar", params={"k": 1}, headers=headers)
+    assert response.status_code == 200
+    assert [match["photo"]["id"] for match in response.json()] == [photo_ids[2]]
+    assert response.json()[0]["similarity"] > 0.9
+
+    assert client.get("/photos/9999/similar", headers=headers).status_code == 404
+    assert client.get(f"/photos/{photo_ids[0]}/similar", params={"k": 0}, headers=headers).status_code == 422
+
+
+def test_apply_filter_pipeline(client, db_session):
+    client.post("/register", json={"username": "testuser", "password": "testpass"})
+    login = client.post("/login", json={"username": "testuser", "password": "testpass"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    upload_response = client.post(
+        "/photos/",
+        files={"file": ("test.jpg", create_test_image(), "image/jpeg")},
+        data={"gallery_password": "testpass", "subject_name": "my_subject"},
+        headers=headers
+    )
+    photo_id = upload_response.json()["id"]
+
+    pipeline = ('[{"op": "crop", "params": {"left": 0, "top": 0, "right": 50, "bottom": 40}}, '
+                '{"op": "sepia"}, {"op": "contrast", "params": {"factor": 1.3}}]')
+    response = client.patch(
+        f"/photos/{photo_id}/filter",
+        data={"pipeline": pipeline, "gallery_password": "testpass"},
+        headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()["filter_applied"] == "crop > sepia > contrast"
+    assert [step["op"] for step in response.json()["filter_pipeline"]] == ["crop", "sepia", "contrast"]
+
+    image_response = client.get(f"/photos/{photo_id}", params={"gallery_password": "testpass"}, headers=headers)
+    assert Image.open(io.BytesIO(image_response.content)).size == (50, 40)
+
+    for data in ({"pipeline": "not json"}, {"filter_name": "sepia", "pipeline": "[]"}, {}):
+        response = client.patch(
+            f"/photos/{photo_id}/filter", data={**data, "gallery_password": "testpass"}, headers=headers
+        )
+        assert response.status_code == 400
+
+
+def test_preview_photo(client, db_session):
+    client.post("/register", json={"username": "testuser", "password": "testpass"})
+    login = client.post("/login", json={"username": "testuser", "password": "testpass"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    upload_response = client.post(
+        "/photos/",
+        files={"file": ("test.jpg", create_test_image(), "image/jpeg")},
+        data={"gallery_password": "testpass", "subject_name": "my_subject"},
+        headers=headers
+    )
+    photo_id = upload_response.json()["id"]
+
+    response = client.get(
+        f"/photos/{photo_id}/preview",
+        params={"gallery_password": "testpass", "filter": "sepia", "max_edge": 32},
+        headers=headers
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(response.content)).size == (32, 32)
+
+    photo = client.get("/photos/", headers=headers).json()[0]
+    assert photo["filter_applied"] is None
+
+    response = client.get(
+        f"/photos/{photo_id}/preview",
+        params={"gallery_password": "testpass", "filter": "posterize"},
+        headers=headers
+    )
+    assert response.status_code == 400
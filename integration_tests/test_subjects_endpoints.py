@@ -32,6 +32,16 @@ def test_get_user_subjects(client):
     subjects = response.json()
     assert any(subject["name"] == subject_name for subject in subjects)
 
+    response = client.get("/subjects/", params={"summary": "true"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == [{
+        "name": subject_name,
+        "id": created_subject["id"],
+        "user_id": created_subject["user_id"],
+        "photo_count": 0,
+        "latest_upload": None
+    }]
+
 def test_duplicate_subjects(client):
     # Register a new user
     register_response = client.post("/register", json={"username": "testuser", "password": "testpass"})
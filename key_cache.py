@@ -0,0 +1,116 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+KEY_CACHE_MAX_BYTES = int(os.getenv("KEY_CACHE_MAX_BYTES", str(256 * 1024)))
+KEY_CACHE_TTL_SECONDS = float(os.getenv("KEY_CACHE_TTL_SECONDS", "900"))
+
+# Rough per-entry bookkeeping cost (dict slot, tuple, bytearray headers) on top of the raw key material
+_ENTRY_OVERHEAD = 256
+
+# Per-process secret so that the cache never holds a plain, fast-to-brute-force hash of a password
+_DIGEST_SECRET = os.urandom(32)
+
+
+def password_digest(password: str) -> bytes:
+    return hmac.new(_DIGEST_SECRET, password.encode(), hashlib.sha256).digest()
+
+
+def _zeroize(buffer: bytearray):
+    for i in range(len(buffer)):
+        buffer[i] = 0
+
+
+class KeyCache:
+    """
+    LRU + TTL cache for derived encryption keys, keyed on (user_id, salt, password digest).
+    Evicted keys are overwritten in place before being dropped.
+    """
+
+    def __init__(self, max_bytes: int = KEY_CACHE_MAX_BYTES, ttl_seconds: float = KEY_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_derive(self, user_id, salt: bytes, password: str, derive, confirm=None) -> bytes:
+        """
+        The cached key, or derive(password, salt). A derived key is only cached once confirm(key) accepts it,
+        so wrong passwords neither evict other users' keys nor get served later; without `confirm` it is not
+        cached at all.
+        """
+        cache_key = (user_id, bytes(salt), password_digest(password))
+
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                key, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(cache_key)
+                    self.hits += 1
+                    return bytes(key)
+                self._remove(cache_key)
+            self.misses += 1
+
+        # Derive outside the lock so that one slow KDF does not serialize every other user
+        derived = derive(password, salt)
+        if confirm is not None and confirm(derived):
+            self.put(cache_key, derived)
+        return derived
+
+    def put(self, cache_key: tuple, key: bytes):
+        entry_size = self._entry_size(cache_key, key)
+        if entry_size > self.max_bytes:
+            return
+
+        with self._lock:
+            if cache_key in self._entries:
+                self._remove(cache_key)
+            self._entries[cache_key] = (bytearray(key), time.monotonic() + self.ttl_seconds)
+            self._size += entry_size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == user_id]:
+                self._remove(cache_key)
+
+    def clear(self):
+        with self._lock:
+            for cache_key in list(self._entries):
+                self._remove(cache_key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, cache_key: tuple):
+        key, _ = self._entries.pop(cache_key)
+        self._size -= self._entry_size(cache_key, key)
+        _zeroize(key)
+
+    @staticmethod
+    def _entry_size(cache_key: tuple, key) -> int:
+        return len(key) + len(cache_key[1]) + len(cache_key[2]) + _ENTRY_OVERHEAD
+
+
+key_cache = KeyCache()
@@ -1,21 +1,57 @@
 # main.py
-from typing import Optional
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional, Union
 
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, Form, Depends, Query
-from fastapi.responses import Response
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, UploadFile, File, Form, Depends, Query, Header, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
 from starlette import status
 
 from auth import get_current_user
-from database import  get_db
+from classification_cache import check_cache_key, classification_cache
+from classification_jobs import CLASSIFICATION_MODE, check_job_key
+from classification_worker import classification_worker
+from database import get_async_db, run_db
+from executors import crypto_pool, pool_stats, upload_timings
+from image_filters import PREVIEW_MAX_EDGE
+from key_cache import key_cache
+from subject_cache import subject_cache
+from variant_cache import variant_cache
+from vector_index import vector_indexes
 from models import User
 from services.auth_service import AuthService
+from services.gallery_service import GalleryService
 from services.photo_service import PhotoService
+from services.similarity_service import SimilarityService
 from services.subject_service import SubjectService
+from subject_predictor import (
+    CLASSIFICATION_ENABLED, MODEL_WARMUP, inference_worker_stats, model_loader, predict_batcher, shutdown_inference,
+    warm_up
+)
 import schemas
 
-app = FastAPI(title="Image Gallery API")
+_PIPELINE_ADAPTER = TypeAdapter(list[schemas.FilterStep])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if CLASSIFICATION_ENABLED and MODEL_WARMUP:
+        # Loads in the background: the API already serves, and /ready reports 503 until the model is up.
+        # Not on ml_pool itself, since the warm-up prediction waits for a forward pass on that pool.
+        threading.Thread(target=warm_up, name="model-warmup", daemon=True).start()
+    if CLASSIFICATION_ENABLED:
+        check_cache_key()
+        check_job_key()
+    if CLASSIFICATION_ENABLED and CLASSIFICATION_MODE == "background":
+        classification_worker.start()
+    yield
+    classification_worker.stop()
+    shutdown_inference()
+
+
+app = FastAPI(title="Image Gallery API", lifespan=lifespan)
 
 @app.post(
     "/register",
@@ -29,9 +65,8 @@ app = FastAPI(title="Image Gallery API")
     },
     tags=["Authentication"],
 )
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    auth_service = AuthService(db)
-    return auth_service.register_user(user.username, user.password)
+async def register(user: schemas.UserCreate, db=Depends(get_async_db)):
+    return await run_db(db, lambda session: AuthService(session).register_user(user.username, user.password))
 
 
 @app.post(
@@ -46,27 +81,47 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
     },
     tags=["Authentication"],
 )
-def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
-    auth_service = AuthService(db)
-    return auth_service.login_user(user.username, user.password)
+async def login(user: schemas.UserLogin, db=Depends(get_async_db)):
+    return await run_db(db, lambda session: AuthService(session).login_user(user.username, user.password))
+
+@app.post(
+    "/logout",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Log out the current user",
+    description="Drop every cached gallery key derived for the authenticated user.",
+    responses={
+        204: {"description": "Logged out successfully"},
+        401: {"description": "Unauthorized - user authentication required"},
+    },
+    tags=["Authentication"],
+)
+async def logout(
+        db=Depends(get_async_db),
+        current_user: User = Depends(get_current_user)
+):
+    await run_db(db, lambda session: AuthService(session).logout_user(current_user.id))
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @app.get(
     "/subjects/",
-    response_model=list[schemas.SubjectOut],
+    response_model=Union[list[schemas.SubjectSummaryOut], list[schemas.SubjectOut]],
     summary="Get all subjects for the current user",
-    description="Retrieve the list of all subjects (categories or tags) belonging to the authenticated user.",
+    description="Retrieve the list of all subjects (categories or tags) belonging to the authenticated user. "
+                "With summary=true, each subject carries its photo count and latest upload time instead of its photos.",
     responses={
         200: {"description": "List of subjects returned successfully"},
         401: {"description": "Unauthorized - user authentication required"}
     },
     tags=["Subjects"],
 )
-def get_user_subjects(
-        db: Session = Depends(get_db),
+async def get_user_subjects(
+        summary: bool = Query(False),
+        db=Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
-    subject_service = SubjectService(db)
-    return subject_service.get_user_subjects(current_user.id)
+    if summary:
+        return await run_db(db, lambda session: SubjectService(session).get_subject_summaries(current_user.id))
+    return await run_db(db, lambda session: SubjectService(session).get_user_subjects(current_user.id))
 
 
 @app.post(
@@ -82,35 +137,44 @@ def get_user_subjects(
     },
     tags=["Subjects"],
 )
-def create_subject(
+async def create_subject(
         name: str = Form(..., example="Vacation"),
-        db: Session = Depends(get_db),
+        db=Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
-    subject_service = SubjectService(db)
-    return subject_service.create_subject(name, current_user.id)
+    # Serialized inside the session: the photos relationship is loaded lazily
+    return await run_db(db, lambda session: schemas.SubjectOut.model_validate(
+        SubjectService(session).create_subject(name, current_user.id), from_attributes=True
+    ))
 
 @app.post(
     "/photos/",
     response_model=schemas.PhotoOut,
     summary="Upload a photo",
-    description="Upload a photo file with a gallery password and optional subject name. If subject_name is 'noSubject', the system will try to predict it automatically.",
+    description="Upload a photo file with a gallery password and optional subject name. If subject_name is 'noSubject', the system will try to predict it automatically; with CLASSIFICATION_MODE=background the photo is returned with classification_status 'pending' and its subject is assigned later.",
     responses={
-        200: {"description": "Photo uploaded successfully"},
+        200: {"description": "Photo uploaded successfully; the Server-Timing header breaks down the upload stages"},
         400: {"description": "Bad request, e.g., file reading or encryption failed"},
         401: {"description": "Unauthorized"},
     },
     tags=["Photos"],
 )
 async def upload_photo(
+        response: Response,
         file: UploadFile = File(...),
         gallery_password: str = Form(..., example="galleryPass123"),
         subject_name: Optional[str] = Form(None, example="Vacation"),
-        db: Session = Depends(get_db),
+        db=Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
-    photo_service = PhotoService(db)
-    return photo_service.upload_photo(file, gallery_password, subject_name, current_user.id)
+    timings = {}
+    photo = await run_db(db, lambda session: PhotoService(session).upload_photo(
+        file, gallery_password, subject_name, current_user.id, timings
+    ), blocking=True)
+    response.headers["Server-Timing"] = ", ".join(
+        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+    )
+    return photo
 
 
 @app.get(
@@ -119,40 +183,103 @@ async def upload_photo(
     description="Retrieve and decrypt the photo data with the provided gallery password for the authenticated user.",
     responses={
         200: {"content": {"image/jpeg": {}}, "description": "Photo returned successfully"},
+        206: {"content": {"image/jpeg": {}}, "description": "Requested byte range returned successfully"},
         400: {"description": "Decryption failed"},
         401: {"description": "Unauthorized"},
         404: {"description": "Photo not found"},
+        416: {"description": "Requested range not satisfiable"},
     },
     tags=["Photos"],
 )
 async def get_photo(
         photo_id: int,
         gallery_password: str = Query(..., example="galleryPass123"),
-        db: Session = Depends(get_db),
+        range_header: Optional[str] = Header(None, alias="Range"),
+        db=Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
-    photo_service = PhotoService(db)
-    decrypted_data, mime_type = photo_service.get_photo(photo_id, gallery_password, current_user.id)
-    return Response(content=decrypted_data, media_type=mime_type)
+    reader, mime_type = await run_db(db, lambda session: PhotoService(session).open_photo(
+        photo_id, gallery_password, current_user.id
+    ), blocking=True)
+
+    headers = {"Accept-Ranges": "bytes"}
+    byte_range = parse_range_header(range_header, reader.size)
+    if byte_range is None:
+        headers["Content-Length"] = str(reader.size)
+        return StreamingResponse(crypto_pool.iterate(reader.iter_range()), media_type=mime_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{reader.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        crypto_pool.iterate(reader.iter_range(start, end)),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=mime_type,
+        headers=headers
+    )
+
+
+def parse_range_header(range_header: Optional[str], size: int):
+    """Parse a single `bytes=` range into inclusive (start, end); anything else is served in full."""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
 
 
 @app.get(
     "/photos/",
     response_model=list[schemas.PhotoOut],
-    summary="Get all photos for the current user",
-    description="Retrieve a list of all photos uploaded by the authenticated user.",
+    summary="Get the photos of the current user",
+    description="Retrieve a page of photo metadata for the authenticated user, newest first. When more photos "
+                "follow, the X-Next-Cursor header holds the cursor to pass back to fetch the next page; it is "
+                "absent on the last page.",
     responses={
-        200: {"description": "List of photos returned successfully"},
+        200: {
+            "description": "Page of photos returned successfully",
+            "headers": {"X-Next-Cursor": {"description": "Cursor of the next page", "schema": {"type": "string"}}},
+        },
+        400: {"description": "Invalid cursor"},
         401: {"description": "Unauthorized"},
     },
     tags=["Photos"],
 )
-def get_user_photos(
-        db: Session = Depends(get_db),
+async def get_user_photos(
+        response: Response,
+        limit: int = Query(50, ge=1, le=200),
+        cursor: Optional[str] = Query(None),
+        subject_id: Optional[int] = Query(None, example=5),
+        filter_applied: Optional[str] = Query(None, example="sepia", description="Use 'none' for unfiltered photos"),
+        uploaded_after: Optional[datetime] = Query(None, example="2025-08-01T00:00:00Z"),
+        uploaded_before: Optional[datetime] = Query(None, example="2025-09-01T00:00:00Z"),
+        db=Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
-    photo_service = PhotoService(db)
-    return photo_service.get_user_photos(current_user.id)
+    page = await run_db(db, lambda session: PhotoService(session).get_photo_page(
+        current_user.id, limit, cursor, subject_id, filter_applied, uploaded_after, uploaded_before
+    ))
+    # The body stays a plain list, as before pagination, so existing clients keep working
+    if page["next_cursor"] is not None:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["items"]
 
 
 @app.post(
@@ -167,13 +294,38 @@ def get_user_photos(
     },
     tags=["Photos"],
 )
-def duplicate_photo(
+async def duplicate_photo(
+        photo_id: int,
+        db=Depends(get_async_db),
+        current_user: User = Depends(get_current_user)
+):
+    return await run_db(db, lambda session: PhotoService(session).duplicate_photo(photo_id, current_user.id))
+
+
+@app.get(
+    "/photos/{photo_id}/similar",
+    response_model=list[schemas.SimilarPhotoOut],
+    summary="Find visually similar photos",
+    description="Nearest neighbours of a photo within the authenticated user's gallery, ranked by cosine similarity "
+                "of the embeddings stored at upload time. No image is decrypted, so no gallery password is needed.",
+    responses={
+        200: {"description": "Similar photos returned successfully, most similar first"},
+        401: {"description": "Unauthorized"},
+        404: {"description": "Photo not found"},
+        409: {"description": "The photo has no embedding yet (still queued, or uploaded with embeddings disabled)"},
+    },
+    tags=["Photos"],
+)
+async def get_similar_photos(
         photo_id: int,
-        db: Session = Depends(get_db),
+        k: int = Query(10, ge=1, le=100, description="Number of photos to return"),
+        db=Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
-    photo_service = PhotoService(db)
-    return photo_service.duplicate_photo(photo_id, current_user.id)
+    # Ranking scores the gallery's embeddings in numpy
+    return await run_db(db, lambda session: SimilarityService(session).similar_photos(
+        photo_id, current_user.id, k
+    ), blocking=True)
 
 
 @app.patch(
@@ -188,42 +340,200 @@ def duplicate_photo(
     },
     tags=["Photos"],
 )
-def update_photo_subject(
+async def update_photo_subject(
         photo_id: int,
         subject_name: str = Form(..., example="Vacation"),
-        db: Session = Depends(get_db),
+        db=Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
-    photo_service = PhotoService(db)
-    return photo_service.update_photo_subject(photo_id, subject_name, current_user.id)
+    return await run_db(
+        db, lambda session: PhotoService(session).update_photo_subject(photo_id, subject_name, current_user.id)
+    )
 
 
 @app.patch(
     "/photos/{photo_id}/filter",
     response_model=schemas.PhotoOut,
-    summary="Apply a filter to a photo",
+    summary="Apply a filter or a pipeline of edits to a photo",
     description=(
-        "Apply an image filter to a photo. Supported filters: none, sepia, black and white, color inversion. "
-        "If 'none' is provided, the original image is restored. Requires gallery password."
+        "Apply an image filter to a photo. Supported filters: none, sepia, black and white, color inversion, "
+        "brightness, contrast, blur, sharpen, vignette. "
+        "If 'none' is provided, the original image is restored. Alternatively send `pipeline`, a JSON list of "
+        'steps such as [{"op": "crop", "params": {"left": 0, "top": 0, "right": 800, "bottom": 600}}, '
+        '{"op": "sepia"}, {"op": "contrast", "params": {"factor": 1.3}}], rendered from the original in one pass; '
+        "crop and resize are also available there, and an empty list restores the original. "
+        "Requires gallery password."
     ),
     responses={
         200: {"description": "Filter applied successfully"},
-        400: {"description": "Invalid filter name or decryption failed"},
+        400: {"description": "Invalid filter name, pipeline or parameters, or decryption failed"},
         401: {"description": "Unauthorized"},
         404: {"description": "Photo not found"},
+        413: {"description": "Image exceeds FILTER_MAX_PIXELS"},
         500: {"description": "Server error applying filter"},
     },
     tags=["Photos"],
 )
 async def apply_filter_to_photo(
         photo_id: int,
-        filter_name: str = Form(..., example="sepia"),
+        filter_name: Optional[str] = Form(None, example="sepia"),
+        pipeline: Optional[str] = Form(None, example='[{"op": "sepia"}, {"op": "contrast", "params": {"factor": 1.3}}]'),
+        gallery_password: str = Form(..., example="galleryPass123"),
+        db=Depends(get_async_db),
+        current_user: User = Depends(get_current_user)
+):
+    if (filter_name is None) == (pipeline is None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Send either filter_name or pipeline")
+    if filter_name is not None:
+        return await run_db(db, lambda session: PhotoService(session).apply_filter_to_photo(
+            photo_id, filter_name, gallery_password, current_user.id
+        ), blocking=True)
+
+    steps = parse_pipeline(pipeline)
+    return await run_db(db, lambda session: PhotoService(session).apply_pipeline_to_photo(
+        photo_id, steps, gallery_password, current_user.id
+    ), blocking=True)
+
+
+def parse_pipeline(pipeline: str) -> list:
+    try:
+        return [step.model_dump() for step in _PIPELINE_ADAPTER.validate_json(pipeline)]
+    except ValidationError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail='pipeline must be a JSON list of {"op": name, "params": {...}} steps')
+
+
+@app.get(
+    "/photos/{photo_id}/preview",
+    summary="Preview a filter or pipeline without applying it",
+    description=(
+        "Render the original photo with a filter (`filter`) or a pipeline of edits (`pipeline`, as in "
+        "PATCH /photos/{photo_id}/filter) as a JPEG of at most max_edge pixels on its longer side. The original is "
+        "decoded at reduced size and nothing is stored. Without either, previews the original. "
+        "Requires gallery password."
+    ),
+    responses={
+        200: {"content": {"image/jpeg": {}}, "description": "Preview returned successfully"},
+        400: {"description": "Invalid filter name, pipeline or parameters, or decryption failed"},
+        401: {"description": "Unauthorized"},
+        404: {"description": "Photo not found"},
+        413: {"description": "Image exceeds FILTER_MAX_PIXELS"},
+    },
+    tags=["Photos"],
+)
+async def preview_photo(
+        photo_id: int,
+        gallery_password: str = Query(..., example="galleryPass123"),
+        filter_name: Optional[str] = Query(None, alias="filter", example="sepia"),
+        pipeline: Optional[str] = Query(None, example='[{"op": "sepia"}, {"op": "contrast", "params": {"factor": 1.3}}]'),
+        max_edge: int = Query(512, ge=16, le=PREVIEW_MAX_EDGE),
+        db=Depends(get_async_db),
+        current_user: User = Depends(get_current_user)
+):
+    if filter_name is not None and pipeline is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Send either filter or pipeline")
+    if pipeline is not None:
+        steps = parse_pipeline(pipeline)
+    else:
+        steps = [] if filter_name in (None, "none") else [{"op": filter_name, "params": {}}]
+
+    preview = await run_db(db, lambda session: PhotoService(session).preview_photo(
+        photo_id, steps, max_edge, gallery_password, current_user.id
+    ), blocking=True)
+    return Response(preview, media_type="image/jpeg")
+
+
+@app.put(
+    "/gallery/password",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Change the gallery password",
+    description="Re-wrap every photo key of the authenticated user under a master key derived from the new gallery password. Image data is not re-encrypted.",
+    responses={
+        204: {"description": "Gallery password changed successfully"},
+        400: {"description": "Invalid gallery password"},
+        401: {"description": "Unauthorized"},
+    },
+    tags=["Gallery"],
+)
+async def change_gallery_password(
+        old_gallery_password: str = Form(..., example="galleryPass123"),
+        new_gallery_password: str = Form(..., example="newGalleryPass456"),
+        db=Depends(get_async_db),
+        current_user: User = Depends(get_current_user)
+):
+    await run_db(db, lambda session: GalleryService(session).change_gallery_password(
+        current_user.id, old_gallery_password, new_gallery_password
+    ), blocking=True)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@app.post(
+    "/gallery/migrate",
+    response_model=schemas.GalleryMigrationOut,
+    summary="Migrate legacy photos to the gallery master key",
+    description="Wrap the per-photo keys of photos uploaded before envelope encryption with the gallery master key, so they no longer need a key derivation per read.",
+    responses={
+        200: {"description": "Legacy photos migrated successfully"},
+        400: {"description": "Invalid gallery password"},
+        401: {"description": "Unauthorized"},
+    },
+    tags=["Gallery"],
+)
+async def migrate_gallery(
         gallery_password: str = Form(..., example="galleryPass123"),
-        db: Session = Depends(get_db),
+        db=Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
-    photo_service = PhotoService(db)
-    return photo_service.apply_filter_to_photo(photo_id, filter_name, gallery_password, current_user.id)
+    migrated = await run_db(db, lambda session: GalleryService(session).migrate_legacy_photos(
+        current_user.id, gallery_password
+    ), blocking=True)
+    return {"migrated": migrated}
+
+
+@app.get(
+    "/ready",
+    summary="Readiness check",
+    description="Reports whether this worker is ready to take traffic. With MODEL_WARMUP enabled, "
+                "that includes the subject classification model being loaded.",
+    responses={
+        200: {"description": "Ready"},
+        503: {"description": "The subject model is still loading or failed to load"},
+    },
+    tags=["Monitoring"],
+)
+def get_readiness():
+    model = {"enabled": CLASSIFICATION_ENABLED, **model_loader.status()}
+    ready = not (CLASSIFICATION_ENABLED and MODEL_WARMUP) or model["state"] == "ready"
+    return JSONResponse(
+        {"status": "ready" if ready else "not_ready", "model": model},
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+@app.get(
+    "/metrics",
+    summary="Get runtime metrics",
+    description="Queue depth and wait times of the crypto, imaging and ML executor pools, upload stage durations, "
+                "inference batch sizes and worker processes, the gallery key, subject and classification cache "
+                "counters, background classification jobs, the similarity indexes and filter variant reuse.",
+    responses={
+        200: {"description": "Metrics returned successfully"},
+    },
+    tags=["Monitoring"],
+)
+def get_metrics():
+    return {
+        "executors": pool_stats(),
+        "upload_stages": upload_timings.stats(),
+        "inference": predict_batcher.stats(),
+        "inference_workers": inference_worker_stats(),
+        "key_cache": key_cache.stats(),
+        "subject_cache": subject_cache.stats(),
+        "classification_cache": classification_cache.stats(),
+        "classification_worker": classification_worker.stats(),
+        "similarity_index": vector_indexes.stats(),
+        "variant_cache": variant_cache.stats(),
+    }
 
 
 if __name__ == '__main__':
@@ -0,0 +1,243 @@
+"""
+Schema upgrades for databases created from older versions of models.py, and data migrations.
+
+    python migrations.py                    # create tables, sync columns/constraints/indexes, move photo versions to blobs
+    python migrations.py migrate-blobs      # move in-row image blobs into the blob store
+
+Columns that are no longer in models.py are dropped, after the data migrations below have moved their contents.
+"""
+import argparse
+import hashlib
+
+from sqlalchemy import MetaData, Table, UniqueConstraint, inspect, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import AddConstraint, CreateTable
+
+import models  # noqa: F401 - registers the tables on Base.metadata
+from blob_store import get_blob_store
+from database import Base, engine
+
+# Per-version columns that lived on photos before blobs got their own table
+_LEGACY_VERSION_COLUMNS = ("encrypted_data", "blob_key", "blob_size", "wrapped_key", "encryption_salt", "nonce", "tag")
+
+
+def upgrade(bind: Engine = engine):
+    Base.metadata.create_all(bind=bind)
+    _add_missing_columns(bind)
+    _move_photo_versions_to_blobs(bind)
+    _backfill_filter_pipelines(bind)
+    _sync_column_constraints(bind)
+    _create_missing_indexes(bind)
+    _normalize_sqlite_timestamps(bind)
+
+
+def _add_missing_columns(bind: Engine):
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in existing]
+        if not missing:
+            continue
+
+        # Added as nullable; NOT NULL is enforced by _sync_column_constraints once data is migrated
+        with bind.begin() as conn:
+            for column in missing:
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+
+
+def _sync_column_constraints(bind: Engine):
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+        obsolete = [name for name in existing if name not in table.columns]
+        changed = [
+            column for column in table.columns
+            if column.name in existing and column.nullable != existing[column.name]["nullable"]
+        ]
+        existing_uniques = {
+            tuple(unique["column_names"]): unique["name"] for unique in inspector.get_unique_constraints(table.name)
+        }
+        model_uniques = {
+            tuple(column.name for column in constraint.columns): constraint
+            for constraint in table.constraints if isinstance(constraint, UniqueConstraint)
+        }
+        dropped_uniques = [name for columns, name in existing_uniques.items() if columns not in model_uniques]
+        added_uniques = [constraint for columns, constraint in model_uniques.items() if columns not in existing_uniques]
+        if not obsolete and not changed and not dropped_uniques and not added_uniques:
+            continue
+
+        if bind.dialect.name == "sqlite":
+            _rebuild_sqlite_table(bind, table, existing)
+            continue
+
+        with bind.begin() as conn:
+            for name in dropped_uniques:
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} DROP CONSTRAINT {name}')
+            for name in obsolete:
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} DROP COLUMN {name}')
+            for column in changed:
+                action = "DROP NOT NULL" if column.nullable else "SET NOT NULL"
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} {action}')
+            for constraint in added_uniques:
+                conn.execute(AddConstraint(constraint))
+
+
+def _create_missing_indexes(bind: Engine):
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind)
+
+
+def _normalize_sqlite_timestamps(bind: Engine):
+    # CURRENT_TIMESTAMP has no fractional seconds, but SQLAlchemy binds datetimes with them; SQLite compares
+    # the text, so keyset pagination would re-return rows stored by the old server default
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as conn:
+        conn.exec_driver_sql(
+            "UPDATE photos SET uploaded_at = uploaded_at || '.000000' WHERE length(uploaded_at) = 19"
+        )
+
+
+def _rebuild_sqlite_table(bind: Engine, table, existing: dict):
+    # SQLite cannot alter column constraints in place: copy into a fresh table and swap it in
+    new_name = f"_new_{table.name}"
+    create_sql = str(CreateTable(table).compile(dialect=bind.dialect))
+    create_sql = create_sql.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {new_name} ", 1)
+    columns = ", ".join(column.name for column in table.columns if column.name in existing)
+
+    with bind.begin() as conn:
+        conn.exec_driver_sql(create_sql)
+        conn.exec_driver_sql(f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name}")
+        conn.exec_driver_sql(f"DROP TABLE {table.name}")
+        conn.exec_driver_sql(f"ALTER TABLE {new_name} RENAME TO {table.name}")
+        for index in table.indexes:
+            index.create(conn)
+
+
+def _move_photo_versions_to_blobs(bind: Engine):
+    """
+    Turn the original/current columns of each photo into reference-counted blob rows.
+    Versions with identical ciphertext and key material (upload + current, old duplicates) share one blob.
+    """
+    photos = Table("photos", MetaData(), autoload_with=bind)
+    if "encrypted_data" not in photos.c:
+        return
+    blobs = Base.metadata.tables["blobs"]
+
+    with bind.connect() as conn:
+        photo_ids = conn.execute(
+            select(photos.c.id).where(photos.c.blob_id.is_(None)).order_by(photos.c.id)
+        ).scalars().all()
+
+    shared_blobs = {}
+    for photo_id in photo_ids:
+        with bind.begin() as conn:
+            row = conn.execute(select(photos).where(photos.c.id == photo_id)).mappings().one()
+            blob_ids = {}
+            for prefix in ("original_", ""):
+                version = {name: row.get(prefix + name) for name in _LEGACY_VERSION_COLUMNS}
+                content_id = version["blob_key"] or hashlib.sha256(version["encrypted_data"] or b"").hexdigest()
+                signature = (row["owner_id"], content_id, version["wrapped_key"], version["encryption_salt"],
+                             version["nonce"], version["tag"])
+
+                if signature not in shared_blobs:
+                    shared_blobs[signature] = conn.execute(
+                        blobs.insert().values(
+                            owner_id=row["owner_id"],
+                            ref_count=0,
+                            storage_key=version["blob_key"],
+                            size=version["blob_size"],
+                            encrypted_data=None if version["blob_key"] else version["encrypted_data"],
+                            wrapped_key=version["wrapped_key"],
+                            encryption_salt=version["encryption_salt"],
+                            nonce=version["nonce"],
+                            tag=version["tag"]
+                        )
+                    ).inserted_primary_key[0]
+                blob_ids[prefix] = shared_blobs[signature]
+                conn.execute(
+                    update(blobs).where(blobs.c.id == blob_ids[prefix]).values(ref_count=blobs.c.ref_count + 1)
+                )
+
+            conn.execute(
+                update(photos)
+                .where(photos.c.id == photo_id)
+                .values(original_blob_id=blob_ids["original_"], blob_id=blob_ids[""])
+            )
+
+
+def _backfill_filter_pipelines(bind: Engine):
+    # Photos filtered before pipelines existed carry only the filter name
+    photos = Base.metadata.tables["photos"]
+    with bind.begin() as conn:
+        filter_names = conn.execute(
+            select(photos.c.filter_applied).distinct()
+            .where(photos.c.filter_applied.is_not(None), photos.c.filter_pipeline.is_(None))
+        ).scalars().all()
+        for filter_name in filter_names:
+            conn.execute(
+                update(photos)
+                .where(photos.c.filter_applied == filter_name, photos.c.filter_pipeline.is_(None))
+                .values(filter_pipeline=[{"op": filter_name, "params": {}}])
+            )
+
+
+def migrate_blobs(bind: Engine = engine, blob_store=None, batch_size: int = 100) -> int:
+    """
+    Move in-row blobs into the blob store one blob at a time, so the API can keep serving.
+    Each row is only updated if its data has not changed since it was copied; rerun to pick up stragglers.
+    """
+    blob_store = blob_store or get_blob_store()
+    blobs = Base.metadata.tables["blobs"]
+
+    moved = 0
+    last_id = 0
+    while True:
+        with bind.connect() as conn:
+            blob_ids = conn.execute(
+                select(blobs.c.id)
+                .where(blobs.c.id > last_id, blobs.c.encrypted_data.is_not(None))
+                .order_by(blobs.c.id)
+                .limit(batch_size)
+            ).scalars().all()
+        if not blob_ids:
+            return moved
+
+        for blob_id in blob_ids:
+            with bind.connect() as conn:
+                data = conn.execute(select(blobs.c.encrypted_data).where(blobs.c.id == blob_id)).scalar()
+            if data is None:
+                continue
+
+            storage_key = blob_store.put(data)
+            with bind.begin() as conn:
+                result = conn.execute(
+                    update(blobs)
+                    .where(
+                        blobs.c.id == blob_id,
+                        blobs.c.storage_key.is_(None),
+                        blobs.c.encrypted_data == data
+                    )
+                    .values(storage_key=storage_key, size=len(data), encrypted_data=None)
+                )
+            moved += result.rowcount
+        last_id = blob_ids[-1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Database migrations for the image gallery")
+    subcommands = parser.add_subparsers(dest="command")
+    subcommands.add_parser("upgrade", help="bring the schema in line with models.py (default)")
+    blobs_parser = subcommands.add_parser("migrate-blobs", help="move in-row image blobs into the blob store")
+    blobs_parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.command == "migrate-blobs":
+        print(f"Moved {migrate_blobs(batch_size=args.batch_size)} blobs")
+    else:
+        upgrade()
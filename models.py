@@ -1,5 +1,7 @@
 # models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, LargeBinary
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -12,14 +14,19 @@ class User(Base):
     username = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
 
+    # Gallery master key parameters; the key itself is derived from the gallery password on demand
+    gallery_salt = Column(LargeBinary, nullable=True)
+    gallery_key_verifier = Column(LargeBinary, nullable=True)
+
     photos = relationship("Photo", back_populates="owner")
 
 
 class Subject(Base):
     __tablename__ = "subjects"
+    __table_args__ = (UniqueConstraint("user_id", "name", name="uq_subjects_user_name"),)
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, nullable=False)
+    name = Column(String, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"))  # Adăugăm user_id pentru proprietate
 
     photos = relationship("Photo", back_populates="subject")
@@ -27,27 +34,123 @@ class Subject(Base):
 
 class Photo(Base):
     __tablename__ = "photos"
+    # Keyset pagination over (uploaded_at, id), newest first, optionally narrowed by subject or filter
+    __table_args__ = (
+        Index("ix_photos_owner_uploaded", "owner_id", "uploaded_at", "id"),
+        Index("ix_photos_owner_subject_uploaded", "owner_id", "subject_id", "uploaded_at", "id"),
+        Index("ix_photos_owner_filter_uploaded", "owner_id", "filter_applied", "uploaded_at", "id"),
+    )
+    # Fetch server-generated values with INSERT ... RETURNING instead of a refresh() round trip
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, nullable=False)
+    # Ordered [{"op", "params"}] edits applied to the original; NULL when unfiltered. filter_applied is the
+    # op names joined (image_filters.pipeline_summary), kept so listings can be narrowed by filter via an index
+    filter_pipeline = Column(JSON, nullable=True)
     filter_applied = Column(String, nullable=True)
-    uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Set client-side so every row is stored with the same precision the pagination cursor binds with
+    uploaded_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now())
 
-    # Fields for the original encrypted image
-    original_encrypted_data = Column(LargeBinary, nullable=False)
-    original_encryption_salt = Column(LargeBinary, nullable=False)
-    original_nonce = Column(LargeBinary, nullable=False)
-    original_tag = Column(LargeBinary, nullable=False)
-
-    # Fields for the current (possibly filtered) encrypted image
-    encrypted_data = Column(LargeBinary, nullable=False)
-    encryption_salt = Column(LargeBinary, nullable=False)
-    nonce = Column(LargeBinary, nullable=False)
-    tag = Column(LargeBinary, nullable=False)
+    # Original upload and current (possibly filtered) version; both may point at the same blob
+    original_blob_id = Column(Integer, ForeignKey("blobs.id"), nullable=False)
+    blob_id = Column(Integer, ForeignKey("blobs.id"), nullable=False)
 
     mime_type = Column(String, nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id"))
     subject_id = Column(Integer, ForeignKey("subjects.id"), nullable=True)
+    # Automatic classification of noSubject uploads: pending | classified | unclassified; NULL when the user chose
+    classification_status = Column(String, nullable=True)
 
     owner = relationship("User", back_populates="photos")
     subject = relationship("Subject", back_populates="photos")
+    original_blob = relationship("Blob", foreign_keys=[original_blob_id])
+    blob = relationship("Blob", foreign_keys=[blob_id])
+
+
+# What listings render (schemas.PhotoOut); used with load_only so they never touch blob references
+PHOTO_METADATA_COLUMNS = (
+    Photo.id, Photo.filename, Photo.filter_applied, Photo.filter_pipeline, Photo.uploaded_at,
+    Photo.owner_id, Photo.subject_id, Photo.mime_type, Photo.classification_status
+)
+
+
+class Blob(Base):
+    """An encrypted image shared by reference between photo versions and duplicates."""
+    __tablename__ = "blobs"
+    __mapper_args__ = {"eager_defaults": True}
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # Photo.original_blob_id + Photo.blob_id + PhotoVariant.blob_id references
+    ref_count = Column(Integer, nullable=False, default=0)
+
+    storage_key = Column(String, nullable=True, index=True)  # content key in the blob store
+    size = Column(Integer, nullable=True)
+    encrypted_data = Column(LargeBinary, nullable=True)  # legacy rows not yet moved to the blob store
+
+    wrapped_key = Column(LargeBinary, nullable=True)
+    encryption_salt = Column(LargeBinary, nullable=True)  # legacy rows, keyed by the gallery password
+    nonce = Column(LargeBinary, nullable=True)  # single-shot blobs; NULL for the chunked format
+    tag = Column(LargeBinary, nullable=True)
+
+
+class PhotoVariant(Base):
+    """
+    A rendered filter pipeline of a photo, kept so that applying it again is a pointer swap. Holds one reference
+    on its blob, which is encrypted under its own data key like any photo version.
+    """
+    __tablename__ = "photo_variants"
+    __table_args__ = (
+        UniqueConstraint("photo_id", "pipeline_key", name="uq_photo_variants_photo_pipeline"),
+        # Per-user eviction walks variants least recently used first
+        Index("ix_photo_variants_owner_used", "owner_id", "last_used_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    photo_id = Column(Integer, ForeignKey("photos.id"), nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    pipeline_key = Column(String(64), nullable=False)  # variant_cache.pipeline_key
+    source_blob_id = Column(Integer, nullable=False)  # the original it was rendered from; stale once that changes
+    blob_id = Column(Integer, ForeignKey("blobs.id"), nullable=False)
+    size = Column(Integer, nullable=False)
+    last_used_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+
+
+class ClassificationResult(Base):
+    """A predicted subject, keyed by an HMAC of the uploader and the plaintext image so it reveals nothing about content."""
+    __tablename__ = "classification_results"
+
+    content_hmac = Column(String(64), primary_key=True)
+    label = Column(String, nullable=False)
+    embedding = Column(LargeBinary, nullable=True)  # vector_index.encode_embedding; NULL for older results
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ClassificationJob(Base):
+    """
+    Background classification of an upload. The image is sealed under the server's job key, because the
+    gallery key needs a password the server does not keep; the row is deleted once the photo is back-filled.
+    """
+    __tablename__ = "classification_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    photo_id = Column(Integer, ForeignKey("photos.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    work_item = Column(LargeBinary, nullable=False)  # nonce + AES-GCM ciphertext of the plaintext image
+    attempts = Column(Integer, nullable=False, default=0)
+    locked_until = Column(DateTime(timezone=True), nullable=True, index=True)  # claimed by a worker until then
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    photo = relationship("Photo")
+
+
+class PhotoEmbedding(Base):
+    """Pooled MobileNetV2 features of a photo's upload, for similarity search within its owner's gallery."""
+    __tablename__ = "photo_embeddings"
+
+    photo_id = Column(Integer, ForeignKey("photos.id"), primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    vector = Column(LargeBinary, nullable=False)  # vector_index.encode_embedding
+
+    photo = relationship("Photo")
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, Optional
 from pydantic import BaseModel, Field
 
 class UserCreate(BaseModel):
@@ -21,9 +21,14 @@ class Token(BaseModel):
     access_token: str = Field(..., example="eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9...")
     token_type: str = Field(..., example="bearer")
 
+class FilterStep(BaseModel):
+    op: str = Field(..., example="contrast")
+    params: dict[str, Any] = Field({}, example={"factor": 1.3})
+
 class PhotoBase(BaseModel):
     filename: str = Field(..., example="beach_sunset.jpg")
     filter_applied: Optional[str] = Field(None, example="sepia")
+    filter_pipeline: Optional[list[FilterStep]] = None
 
 class PhotoCreate(PhotoBase):
     gallery_password: str = Field(..., example="galleryPass123")
@@ -36,10 +41,15 @@ class PhotoOut(PhotoBase):
     subject_id: Optional[int] = Field(None, example=5)
     subject_name: Optional[str] = Field(None, example="Holiday")
     mime_type: str = Field(..., example="image/jpeg")
+    classification_status: Optional[str] = Field(None, example="pending")
 
     class Config:
         orm_mode = True
 
+class SimilarPhotoOut(BaseModel):
+    photo: PhotoOut
+    similarity: float = Field(..., example=0.87)
+
 class SubjectBase(BaseModel):
     name: str = Field(..., example="Vacation")
 
@@ -50,3 +60,12 @@ class SubjectOut(SubjectBase):
 
     class Config:
         orm_mode = True
+
+class SubjectSummaryOut(SubjectBase):
+    id: int = Field(..., example=5)
+    user_id: int = Field(..., example=1)
+    photo_count: int = Field(..., example=42)
+    latest_upload: Optional[datetime] = Field(None, example="2025-08-20T15:23:01Z")
+
+class GalleryMigrationOut(BaseModel):
+    migrated: int = Field(..., example=12)
@@ -4,6 +4,7 @@ from fastapi import HTTPException, Depends
 from sqlalchemy.orm import Session
 
 from auth import create_access_token, verify_hashed_password
+from key_cache import key_cache
 import crud
 
 
@@ -26,4 +27,8 @@ class AuthService:
         access_token = create_access_token(
             data={"sub": db_user.username}, expires_delta=access_token_expires
         )
-        return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+        return {"access_token": access_token, "token_type": "bearer"}
+
+    def logout_user(self, user_id: int):
+        # Tokens are stateless, but derived gallery keys must not outlive the session
+        key_cache.invalidate_user(user_id)
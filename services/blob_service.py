@@ -0,0 +1,55 @@
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from blob_store import get_blob_store, load_blob
+from models import Blob
+
+
+class BlobService:
+    """
+    Reference-counted encrypted blobs. Photos share blobs until one of them changes; a blob row
+    and its stored object are removed once no photo version points at it any more.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.blob_store = get_blob_store()
+        self._garbage = []
+
+    def create(self, encrypted_data, wrapped_key: bytes, owner_id: int, refs: int = 1) -> Blob:
+        blob = Blob(
+            owner_id=owner_id,
+            ref_count=refs,
+            storage_key=self.blob_store.put(encrypted_data),
+            size=len(encrypted_data),
+            wrapped_key=wrapped_key
+        )
+        self.db.add(blob)
+        return blob
+
+    def read(self, blob: Blob):
+        return load_blob(self.blob_store, blob.storage_key, blob.encrypted_data)
+
+    def incref(self, blob_id: int, refs: int = 1):
+        self.db.execute(
+            update(Blob).where(Blob.id == blob_id).values(ref_count=Blob.ref_count + refs)
+        )
+
+    def decref(self, blob_id: int, refs: int = 1):
+        self.db.execute(
+            update(Blob).where(Blob.id == blob_id).values(ref_count=Blob.ref_count - refs)
+        )
+        blob = self.db.get(Blob, blob_id)
+        self.db.refresh(blob, ["ref_count"])
+        if blob.ref_count <= 0:
+            self.db.delete(blob)
+            if blob.storage_key is not None:
+                self._garbage.append(blob.storage_key)
+
+    def collect_garbage(self):
+        """Delete stored objects of released blobs. Call after the releasing transaction has committed."""
+        for storage_key in self._garbage:
+            # Identical ciphertext may back more than one blob row
+            if not self.db.query(Blob.id).filter(Blob.storage_key == storage_key).first():
+                self.blob_store.delete(storage_key)
+        self._garbage = []
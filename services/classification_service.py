@@ -0,0 +1,190 @@
+# services/classification_service.py
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import event, or_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from classification_cache import CLASSIFICATION_CACHE_ENABLED, classification_cache, content_hmac
+from classification_jobs import (
+    CLASSIFICATION_JOB_LEASE_SECONDS, CLASSIFICATION_JOB_MAX_ATTEMPTS, open_work_item
+)
+from executors import crypto_pool
+from models import ClassificationJob, ClassificationResult, Photo, PhotoEmbedding
+from subject_backends import Analysis
+from subject_predictor import EMBEDDINGS_ENABLED, analyze_image
+from services.similarity_service import SimilarityService
+from services.subject_service import SubjectService
+from vector_index import encode_embedding
+
+# Dialects with INSERT ... ON CONFLICT
+_CONFLICT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+_PENDING_KEY = "classification_results_pending"
+
+logger = logging.getLogger(__name__)
+
+
+class ClassificationService:
+    def __init__(self, db: Session):
+        self.db = db
+        self.similarity_service = SimilarityService(db)
+        self.subject_service = SubjectService(db)
+
+    def analyze(self, image_data: bytes, user_id: int, need_embedding: bool = False) -> Analysis:
+        """
+        Predicted subject and encoded embedding of an upload; re-uploads of the same bytes are answered from the
+        cache instead of the model while CLASSIFICATION_CACHE_ENABLED. A new result is staged on the session and
+        only written when it commits, so classifying does not take the SQLite writer. Prediction errors propagate.
+        """
+        if not CLASSIFICATION_CACHE_ENABLED:
+            return self._predict(image_data)
+
+        digest = content_hmac(user_id, image_data)
+        analysis = self._lookup(digest, need_embedding)
+        if analysis is not None:
+            return analysis
+
+        analysis = self._predict(image_data)
+        self.db.info.setdefault(_PENDING_KEY, {})[digest] = analysis
+        classification_cache.put(digest, analysis)
+        return analysis
+
+    def cached_analysis(self, image_data: bytes, user_id: int, need_embedding: bool = False) -> Optional[Analysis]:
+        """The stored result for these bytes, without running the model."""
+        if not CLASSIFICATION_CACHE_ENABLED:
+            return None
+        # A miss here is counted once the queued job looks the image up again
+        return self._lookup(content_hmac(user_id, image_data), need_embedding, record_miss=False)
+
+    def enqueue(self, photo: Photo, work_item: bytes, user_id: int, classify: bool = True):
+        """
+        Queue the photo for background analysis; `work_item` comes from seal_work_item. With classify=False only
+        its embedding is filled in. Not committed.
+        """
+        if classify:
+            photo.classification_status = "pending"
+        self.db.add(ClassificationJob(photo=photo, user_id=user_id, work_item=work_item))
+
+    def copy_job(self, source: Photo, copy: Photo):
+        """Give a copy of a photo that is still queued its own job, so both are filled in."""
+        job = self.db.query(ClassificationJob).filter(ClassificationJob.photo_id == source.id).first()
+        if job is None:
+            return
+        self.db.add(ClassificationJob(photo=copy, user_id=job.user_id, work_item=job.work_item))
+
+    def due_job_ids(self, limit: int) -> list:
+        now = datetime.now(timezone.utc)
+        return [job_id for job_id, in self.db.query(ClassificationJob.id).filter(
+            or_(ClassificationJob.locked_until.is_(None), ClassificationJob.locked_until < now)
+        ).order_by(ClassificationJob.id).limit(limit)]
+
+    def run_job(self, job_id: int) -> bool:
+        """
+        Analyze a queued photo, assign its subject if it is pending and store its embedding. A failed attempt
+        keeps the job, which is retried once its lease expires; after CLASSIFICATION_JOB_MAX_ATTEMPTS a pending
+        photo is filed under "unclassified". Returns whether the job finished.
+        """
+        if not self._claim(job_id):
+            return False
+
+        job = self.db.get(ClassificationJob, job_id)
+        try:
+            image_data = crypto_pool.call(open_work_item, job.work_item, job.user_id)
+            analysis = self.analyze(image_data, job.user_id, need_embedding=EMBEDDINGS_ENABLED)
+            classification_status = "classified"
+        except Exception:
+            # Retries show up as "retried" under classification_worker on /metrics
+            logger.exception("Classification job %s failed on attempt %s of %s", job_id, job.attempts,
+                             CLASSIFICATION_JOB_MAX_ATTEMPTS)
+            if job.attempts < CLASSIFICATION_JOB_MAX_ATTEMPTS:
+                self.db.rollback()
+                return False
+            logger.warning("Classification job %s gave up; photo %s is filed as unclassified", job_id, job.photo_id)
+            analysis = Analysis("unclassified", None)
+            classification_status = "unclassified"
+
+        photo = self.db.get(Photo, job.photo_id)
+        if photo is not None:
+            # Leave photos alone whose subject the user set in the meantime
+            if photo.classification_status == "pending":
+                photo.subject_id = self.subject_service.resolve_subject_id(analysis.label, job.user_id)
+                photo.classification_status = classification_status
+            if EMBEDDINGS_ENABLED and analysis.embedding is not None and self.db.get(PhotoEmbedding, photo.id) is None:
+                self.similarity_service.add_embedding(photo, analysis.embedding, job.user_id)
+        self.db.delete(job)
+        self.db.commit()
+        return True
+
+    def _claim(self, job_id: int) -> bool:
+        # Conditional UPDATE, so only one worker (of any process) runs a job at a time
+        now = datetime.now(timezone.utc)
+        claimed = self.db.execute(
+            update(ClassificationJob).where(
+                ClassificationJob.id == job_id,
+                or_(ClassificationJob.locked_until.is_(None), ClassificationJob.locked_until < now)
+            ).values(
+                locked_until=now + timedelta(seconds=CLASSIFICATION_JOB_LEASE_SECONDS),
+                attempts=ClassificationJob.attempts + 1
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        self.db.commit()
+        return claimed == 1
+
+    def _predict(self, image_data: bytes) -> Analysis:
+        prediction = analyze_image(image_data)
+        return Analysis(
+            prediction.label, encode_embedding(prediction.embedding) if prediction.embedding is not None else None
+        )
+
+    def _lookup(self, digest: str, need_embedding: bool, record_miss: bool = True) -> Optional[Analysis]:
+        analysis = classification_cache.get(digest)
+        if analysis is not None and (analysis.embedding is not None or not need_embedding):
+            return analysis
+
+        row = self.db.query(ClassificationResult.label, ClassificationResult.embedding).filter(
+            ClassificationResult.content_hmac == digest
+        ).first()
+        # Results stored before embeddings were kept count as misses when an embedding is needed
+        if row is not None and (row.embedding is not None or not need_embedding):
+            analysis = Analysis(row.label, row.embedding)
+            classification_cache.record_db_hit()
+            classification_cache.put(digest, analysis)
+            return analysis
+
+        if record_miss:
+            classification_cache.record_miss()
+        return None
+
+
+def _store(db: Session, digest: str, analysis: Analysis):
+    insert = _CONFLICT_INSERTS.get(db.get_bind().dialect.name)
+    if insert is not None:
+        # A concurrent upload of the same image may have stored it first, or an older result lacks the embedding
+        statement = insert(ClassificationResult).values(
+            content_hmac=digest, label=analysis.label, embedding=analysis.embedding
+        )
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[ClassificationResult.content_hmac],
+            set_={"label": statement.excluded.label, "embedding": statement.excluded.embedding}
+        ))
+        return
+    try:
+        with db.begin_nested():
+            db.merge(ClassificationResult(content_hmac=digest, label=analysis.label, embedding=analysis.embedding))
+    except IntegrityError:
+        pass
+
+
+@event.listens_for(Session, "before_commit")
+def _write_staged_results(db: Session):
+    for digest, analysis in db.info.pop(_PENDING_KEY, {}).items():
+        _store(db, digest, analysis)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_staged_results(db: Session):
+    db.info.pop(_PENDING_KEY, None)
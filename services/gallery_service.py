@@ -0,0 +1,109 @@
+import hmac
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from blob_store import get_blob_store, load_blob
+from models import Blob, User
+from crypto_utils import (
+    get_key, generate_salt, key_verifier, generate_data_key, wrap_key, unwrap_key, decrypt_image
+)
+from key_cache import key_cache
+
+
+class GalleryService:
+    """
+    Envelope encryption for a user's gallery: one master key derived from the gallery password,
+    and a random data key per encrypted image, stored wrapped by the master key.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.blob_store = get_blob_store()
+
+    def get_master_key(self, user_id: int, gallery_password: str) -> bytes:
+        user = self.db.get(User, user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        # The first gallery operation fixes the password the gallery is keyed on; it is saved with that
+        # operation's commit
+        if user.gallery_salt is None:
+            user.gallery_salt = generate_salt()
+            # The verifier is made from this key, so it is right by definition
+            master_key = get_key(gallery_password, user.gallery_salt, user_id, confirm=lambda key: True)
+            user.gallery_key_verifier = key_verifier(master_key)
+            return master_key
+
+        verifier = user.gallery_key_verifier
+        master_key = get_key(gallery_password, user.gallery_salt, user_id,
+                             confirm=lambda key: hmac.compare_digest(key_verifier(key), verifier))
+        if not hmac.compare_digest(key_verifier(master_key), verifier):
+            raise HTTPException(status_code=400, detail="Invalid gallery password")
+        return master_key
+
+    def new_data_key(self, master_key: bytes) -> tuple:
+        data_key = generate_data_key()
+        return data_key, wrap_key(master_key, data_key)
+
+    def get_data_key(self, blob: Blob, master_key: bytes, gallery_password: str) -> bytes:
+        if blob.wrapped_key is not None:
+            return unwrap_key(master_key, blob.wrapped_key)
+
+        # Legacy blob: the image key was derived from the gallery password with a per-image salt. Not cached:
+        # nothing vouches for it before it decrypts, and reads that succeed wrap it under the master key
+        return get_key(gallery_password, blob.encryption_salt, blob.owner_id)
+
+    def adopt_legacy_key(self, blob: Blob, master_key: bytes, data_key: bytes):
+        """
+        Wrap a legacy derived key with the master key so later reads skip the per-image KDF.
+        Only call this once the key has been proven to decrypt the image.
+        """
+        if blob.wrapped_key is None:
+            blob.wrapped_key = wrap_key(master_key, data_key)
+            blob.encryption_salt = None
+
+    def migrate_legacy_photos(self, user_id: int, gallery_password: str) -> int:
+        master_key = self.get_master_key(user_id, gallery_password)
+        legacy_blobs = self.db.query(Blob).filter(
+            Blob.owner_id == user_id,
+            Blob.wrapped_key.is_(None)
+        ).all()
+
+        migrated = sum(self._migrate_blob(blob, master_key, gallery_password) for blob in legacy_blobs)
+        self.db.commit()
+        return migrated
+
+    def change_gallery_password(self, user_id: int, old_password: str, new_password: str):
+        old_master_key = self.get_master_key(user_id, old_password)
+        user = self.db.get(User, user_id)
+        blobs = self.db.query(Blob).filter(Blob.owner_id == user_id).all()
+
+        for blob in blobs:
+            self._migrate_blob(blob, old_master_key, old_password)
+
+        user.gallery_salt = generate_salt()
+        new_master_key = get_key(new_password, user.gallery_salt, user_id)
+        user.gallery_key_verifier = key_verifier(new_master_key)
+
+        # Only the wrapped data keys change; the image blobs stay as they are
+        for blob in blobs:
+            if blob.wrapped_key is not None:
+                blob.wrapped_key = wrap_key(new_master_key, unwrap_key(old_master_key, blob.wrapped_key))
+
+        self.db.commit()
+        key_cache.invalidate_user(user_id)
+
+    def _migrate_blob(self, blob: Blob, master_key: bytes, gallery_password: str) -> bool:
+        """Adopt the legacy key of a blob; blobs encrypted under another password are left untouched."""
+        if blob.wrapped_key is not None:
+            return False
+
+        data_key = self.get_data_key(blob, master_key, gallery_password)
+        try:
+            encrypted_data = load_blob(self.blob_store, blob.storage_key, blob.encrypted_data)
+            decrypt_image(bytes(encrypted_data), blob.nonce, blob.tag, data_key)
+        except Exception:
+            return False
+        self.adopt_legacy_key(blob, master_key, data_key)
+        return True
@@ -1,65 +1,153 @@
 # services/photo_service.py
+import base64
 import io
-from fastapi import HTTPException, UploadFile
-from sqlalchemy.orm import Session
-from PIL import Image, ImageOps
-import numpy as np
+import logging
+from datetime import datetime, timezone
+from typing import Optional
 
-from models import Photo, Subject
-from crypto_utils import encrypt_image, decrypt_image
-from subject_predictor import predict_image
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, load_only
+from starlette import status
+from PIL import Image
+
+from models import PHOTO_METADATA_COLUMNS, Photo
+from crypto_utils import encrypt_chunked, decrypt_image, ChunkedDecryptor, DecryptedBuffer
+from image_filters import (
+    FILTER_MAX_PIXELS, FILTER_STRIP_MIN_PIXELS, PREVIEW_JPEG_QUALITY, apply_pipeline, apply_pipeline_in_strips,
+    pipeline_is_pixelwise, pipeline_output_size, pipeline_summary, validate_pipeline
+)
+from executors import crypto_pool, imaging_pool, upload_timings
+from classification_jobs import CLASSIFICATION_MODE, seal_work_item
+from classification_worker import classification_worker
+from subject_predictor import CLASSIFICATION_ENABLED, EMBEDDINGS_ENABLED
+from services.blob_service import BlobService
+from services.classification_service import ClassificationService
+from services.gallery_service import GalleryService
+from services.similarity_service import SimilarityService
+from services.subject_service import SubjectService
+from services.variant_service import VariantService
+from variant_cache import pipeline_key
+
+logger = logging.getLogger(__name__)
 
 
 class PhotoService:
     def __init__(self, db: Session):
         self.db = db
+        self.blob_service = BlobService(db)
+        self.classification_service = ClassificationService(db)
+        self.gallery_service = GalleryService(db)
+        self.similarity_service = SimilarityService(db)
+        self.subject_service = SubjectService(db)
+        self.variant_service = VariantService(db, self.blob_service)
+
+    def upload_photo(self, file: UploadFile, gallery_password: str, subject_name: str, user_id: int,
+                     timings: Optional[dict] = None):
+        """
+        Upload pipeline: read -> classify -> encrypt -> persist. The subject, blob and photo rows (and a
+        first-use gallery key, a new classification result, the embedding) are written in one transaction with
+        a single commit. Stage durations are recorded in upload_timings and, when given, in `timings`. With
+        CLASSIFICATION_MODE=background the model does not run here; the upload is queued and its subject and
+        embedding are back-filled later.
+        """
+        with upload_timings.stage("read", timings):
+            image_data = file.file.read()
+
+        needs_label = subject_name == 'noSubject'
+        analysis = None
+        queue_job = False
+        classification_status = None
+        if CLASSIFICATION_ENABLED and (needs_label or EMBEDDINGS_ENABLED):
+            if CLASSIFICATION_MODE == "background":
+                # Stored right away; the worker fills in what an earlier upload of the same bytes did not
+                analysis = self.classification_service.cached_analysis(image_data, user_id, EMBEDDINGS_ENABLED)
+                queue_job = analysis is None
+            else:
+                try:
+                    with upload_timings.stage("classify", timings):
+                        analysis = self.classification_service.analyze(image_data, user_id, EMBEDDINGS_ENABLED)
+                except Exception:
+                    # Counted as a failed "classify" stage on /metrics; the upload is stored without a label or
+                    # embedding
+                    logger.exception("Analyzing an upload of user %s failed", user_id)
+
+        if needs_label and analysis is not None:
+            subject_name, classification_status = analysis.label, "classified"
+        elif needs_label and not queue_job:
+            subject_name = classification_status = "unclassified"
+        elif needs_label:
+            subject_name = None
+
+        with upload_timings.stage("encrypt", timings):
+            master_key = self.gallery_service.get_master_key(user_id, gallery_password)
+            data_key, wrapped_key = self.gallery_service.new_data_key(master_key)
+            encrypted_data = crypto_pool.call(encrypt_chunked, image_data, data_key)
+            work_item = crypto_pool.call(seal_work_item, image_data, user_id) if queue_job else None
+            # Only the ciphertext is needed from here on
+            del image_data
+
+        with upload_timings.stage("persist", timings):
+            # Original and current version share one blob until a filter is applied. The ciphertext is stored
+            # before the first statement that takes the SQLite writer
+            blob = self.blob_service.create(encrypted_data, wrapped_key, user_id, refs=2)
+            subject_id = self.subject_service.resolve_subject_id(subject_name, user_id) if subject_name else None
+
+            photo = Photo(
+                filename=file.filename,
+                original_blob=blob,
+                blob=blob,
+                mime_type=file.content_type,
+                owner_id=user_id,
+                subject_id=subject_id,
+                classification_status=classification_status
+            )
 
-    def upload_photo(self, file: UploadFile, gallery_password: str, subject_name: str, user_id: int):
-        image_data = file.file.read()
-
-        if subject_name == 'noSubject':
-            try:
-                subject_name = predict_image(image_data)
-            except Exception as e:
-                subject_name = "unclassified"
-
-        encrypted_data, salt, nonce, tag = encrypt_image(image_data, gallery_password)
-
-        # Handle subject
-        subject = None
-        if subject_name:
-            subject = self.db.query(Subject).filter(
-                Subject.name == subject_name,
-                Subject.user_id == user_id
-            ).first()
-            if not subject:
-                subject = Subject(name=subject_name, user_id=user_id)
-                self.db.add(subject)
-                self.db.commit()
-                self.db.refresh(subject)
-
-        photo = Photo(
-            filename=file.filename,
-            original_encrypted_data=encrypted_data,
-            original_encryption_salt=salt,
-            original_nonce=nonce,
-            original_tag=tag,
-            encrypted_data=encrypted_data,
-            encryption_salt=salt,
-            nonce=nonce,
-            tag=tag,
-            mime_type=file.content_type,
-            owner_id=user_id,
-            subject_id=subject.id if subject else None
-        )
+            # Generated ids come back through INSERT ... RETURNING (eager_defaults), so no refresh is needed
+            self.db.add(photo)
+            if analysis is not None and analysis.embedding is not None and EMBEDDINGS_ENABLED:
+                self.similarity_service.add_embedding(photo, analysis.embedding, user_id)
+            if work_item is not None:
+                self.classification_service.enqueue(photo, work_item, user_id, classify=needs_label)
+            self.db.commit()
 
-        self.db.add(photo)
-        self.db.commit()
-        self.db.refresh(photo)
+        if work_item is not None:
+            classification_worker.notify()
 
         return photo
 
     def get_photo(self, photo_id: int, gallery_password: str, user_id: int):
+        reader, mime_type = self.open_photo(photo_id, gallery_password, user_id)
+        return reader.read_all(), mime_type
+
+    def open_photo(self, photo_id: int, gallery_password: str, user_id: int):
+        """Return a reader over the decrypted current image that decrypts lazily, range by range."""
+        photo = self.db.query(Photo).filter(
+            Photo.id == photo_id,
+            Photo.owner_id == user_id
+        ).first()
+
+        if not photo:
+            raise HTTPException(status_code=404, detail="Photo not found")
+
+        master_key = self.gallery_service.get_master_key(user_id, gallery_password)
+        try:
+            data_key = self.gallery_service.get_data_key(photo.blob, master_key, gallery_password)
+            reader = crypto_pool.call(self._open_blob, photo.blob, data_key)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail="Decryption failed")
+
+        if photo.blob.wrapped_key is None:
+            self.gallery_service.adopt_legacy_key(photo.blob, master_key, data_key)
+            self.db.commit()
+
+        return reader, photo.mime_type
+
+    def preview_photo(self, photo_id: int, pipeline: list, max_edge: int, gallery_password: str, user_id: int) -> bytes:
+        """
+        JPEG of the original with the pipeline applied, at most max_edge pixels on its longer side. The original is
+        decoded at reduced size and nothing is written to the database.
+        """
         photo = self.db.query(Photo).filter(
             Photo.id == photo_id,
             Photo.owner_id == user_id
@@ -69,20 +157,69 @@ class PhotoService:
             raise HTTPException(status_code=404, detail="Photo not found")
 
         try:
-            decrypted_data = decrypt_image(
-                photo.encrypted_data,
-                photo.encryption_salt,
-                photo.nonce,
-                photo.tag,
-                gallery_password
+            pipeline = validate_pipeline(pipeline)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        master_key = self.gallery_service.get_master_key(user_id, gallery_password)
+        try:
+            data_key = self.gallery_service.get_data_key(photo.original_blob, master_key, gallery_password)
+            decrypted_data = crypto_pool.call(
+                lambda: self._open_blob(photo.original_blob, data_key).read_all()
             )
         except Exception as e:
             raise HTTPException(status_code=400, detail="Decryption failed")
 
-        return decrypted_data, photo.mime_type
+        return imaging_pool.call(self._render_preview, decrypted_data, pipeline, max_edge)
 
     def get_user_photos(self, user_id: int):
-        return self.db.query(Photo).filter(Photo.owner_id == user_id).all()
+        return self._photo_listing(user_id).all()
+
+    def get_photo_page(
+            self,
+            user_id: int,
+            limit: int = 50,
+            cursor: Optional[str] = None,
+            subject_id: Optional[int] = None,
+            filter_applied: Optional[str] = None,
+            uploaded_after: Optional[datetime] = None,
+            uploaded_before: Optional[datetime] = None
+    ):
+        """Newest-first page of photo metadata; pass the returned next_cursor to get the following page."""
+        query = self._photo_listing(user_id)
+
+        if subject_id is not None:
+            query = query.filter(Photo.subject_id == subject_id)
+        if filter_applied is not None:
+            # "none" lists unfiltered photos, matching the restore filter name
+            query = query.filter(Photo.filter_applied.is_(None) if filter_applied == "none"
+                                 else Photo.filter_applied == filter_applied)
+        if uploaded_after is not None:
+            query = query.filter(Photo.uploaded_at >= _as_utc(uploaded_after))
+        if uploaded_before is not None:
+            query = query.filter(Photo.uploaded_at < _as_utc(uploaded_before))
+        if cursor:
+            uploaded_at, photo_id = _decode_cursor(cursor)
+            query = query.filter(or_(
+                Photo.uploaded_at < uploaded_at,
+                and_(Photo.uploaded_at == uploaded_at, Photo.id < photo_id)
+            ))
+
+        # One extra row tells whether another page exists
+        photos = query.limit(limit + 1).all()
+        next_cursor = None
+        if len(photos) > limit:
+            photos = photos[:limit]
+            next_cursor = _encode_cursor(photos[-1])
+
+        return {"items": photos, "next_cursor": next_cursor}
+
+    def _photo_listing(self, user_id: int):
+        return self.db.query(Photo).options(
+            load_only(*PHOTO_METADATA_COLUMNS)
+        ).filter(
+            Photo.owner_id == user_id
+        ).order_by(Photo.uploaded_at.desc(), Photo.id.desc())
 
     def duplicate_photo(self, photo_id: int, user_id: int):
         original_photo = self.db.query(Photo).filter(
@@ -101,23 +238,23 @@ class PhotoService:
         else:
             new_filename = f"{original_photo.filename}_duplicated"
 
+        # Metadata-only copy: both versions of the duplicate reference the source's current blob
+        self.blob_service.incref(original_photo.blob_id, 2)
         duplicated_photo = Photo(
             filename=new_filename,
-            original_encrypted_data=original_photo.encrypted_data,
-            original_encryption_salt=original_photo.encryption_salt,
-            original_nonce=original_photo.nonce,
-            original_tag=original_photo.tag,
-            encrypted_data=original_photo.encrypted_data,
-            encryption_salt=original_photo.encryption_salt,
-            nonce=original_photo.nonce,
-            tag=original_photo.tag,
+            original_blob_id=original_photo.blob_id,
+            blob_id=original_photo.blob_id,
             mime_type=original_photo.mime_type,
             owner_id=user_id,
             subject_id=original_photo.subject_id,
-            filter_applied=original_photo.filter_applied
+            filter_pipeline=original_photo.filter_pipeline,
+            filter_applied=original_photo.filter_applied,
+            classification_status=original_photo.classification_status
         )
 
         self.db.add(duplicated_photo)
+        self.similarity_service.copy_embedding(original_photo, duplicated_photo)
+        self.classification_service.copy_job(original_photo, duplicated_photo)
         self.db.commit()
         self.db.refresh(duplicated_photo)
 
@@ -132,25 +269,25 @@ class PhotoService:
         if not photo:
             raise HTTPException(status_code=404, detail="Photo not found")
 
-        subject = None
-        if subject_name:
-            subject = self.db.query(Subject).filter(
-                Subject.name == subject_name,
-                Subject.user_id == user_id
-            ).first()
-            if not subject:
-                subject = Subject(name=subject_name, user_id=user_id)
-                self.db.add(subject)
-                self.db.commit()
-                self.db.refresh(subject)
-
-        photo.subject_id = subject.id if subject else None
+        photo.subject_id = self.subject_service.resolve_subject_id(subject_name, user_id) if subject_name else None
+        # Chosen by the user now; a pending classification will not override it
+        photo.classification_status = None
         self.db.commit()
         self.db.refresh(photo)
 
         return photo
 
     def apply_filter_to_photo(self, photo_id: int, filter_name: str, gallery_password: str, user_id: int):
+        """A single filter with default parameters; "none" restores the original."""
+        pipeline = [] if filter_name == "none" else [{"op": filter_name, "params": {}}]
+        return self.apply_pipeline_to_photo(photo_id, pipeline, gallery_password, user_id)
+
+    def apply_pipeline_to_photo(self, photo_id: int, pipeline: list, gallery_password: str, user_id: int):
+        """
+        Render an ordered list of {"op", "params"} steps from the original in one decode, filter and encode
+        pass, and make it the photo's current version. An empty pipeline restores the original, and a pipeline
+        rendered before is reused from the photo's variants.
+        """
         photo = self.db.query(Photo).filter(
             Photo.id == photo_id,
             Photo.owner_id == user_id
@@ -159,76 +296,159 @@ class PhotoService:
         if not photo:
             raise HTTPException(status_code=404, detail="Photo not found")
 
-        # For the "none" filter, restore the original image
-        if filter_name == "none":
-            photo.encrypted_data = photo.original_encrypted_data
-            photo.encryption_salt = photo.original_encryption_salt
-            photo.nonce = photo.original_nonce
-            photo.tag = photo.original_tag
-            photo.filter_applied = None
-
-            self.db.commit()
-            self.db.refresh(photo)
-            return photo
-
-        # For other filters, decrypt the original image and apply the filter
         try:
-            decrypted_data = decrypt_image(
-                photo.original_encrypted_data,
-                photo.original_encryption_salt,
-                photo.original_nonce,
-                photo.original_tag,
-                gallery_password
+            pipeline = validate_pipeline(pipeline)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # For an empty pipeline, restore the original image
+        if not pipeline:
+            return self._set_current_version(photo, photo.original_blob_id, None)
+
+        # A variant rendered before only needs to become the current version again
+        master_key = self.gallery_service.get_master_key(user_id, gallery_password)
+        key = pipeline_key(pipeline)
+        variant = self.variant_service.find(photo, key)
+        if variant is not None:
+            return self._set_current_version(photo, variant.blob_id, pipeline)
+
+        # Otherwise decrypt the original image and apply the pipeline
+        try:
+            original_key = self.gallery_service.get_data_key(photo.original_blob, master_key, gallery_password)
+            decrypted_data = crypto_pool.call(
+                lambda: self._open_blob(photo.original_blob, original_key).read_all()
             )
         except Exception as e:
             raise HTTPException(status_code=400, detail="Decryption failed")
 
-        # Apply filter
-        try:
-            image = Image.open(io.BytesIO(decrypted_data))
+        self.gallery_service.adopt_legacy_key(photo.original_blob, master_key, original_key)
 
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+        # Apply filters
+        filtered_data = imaging_pool.call(self._render_pipeline, decrypted_data, pipeline)
+
+        # Re-encrypt the filtered image under a fresh data key
+        data_key, wrapped_key = self.gallery_service.new_data_key(master_key)
+        encrypted_data = crypto_pool.call(encrypt_chunked, filtered_data, data_key)
+        blob = self.blob_service.create(encrypted_data, wrapped_key, user_id)
+        self.db.flush()
+        self.variant_service.add(photo, key, blob)
+
+        return self._set_current_version(photo, blob.id, pipeline, already_referenced=True)
+
+    def _set_current_version(self, photo: Photo, blob_id: int, pipeline: Optional[list],
+                             already_referenced: bool = False):
+        self._replace_current_blob(photo, blob_id, already_referenced)
+        photo.filter_pipeline = pipeline or None
+        photo.filter_applied = pipeline_summary(pipeline) if pipeline else None
+
+        self.db.commit()
+        self.blob_service.collect_garbage()
+        self.db.refresh(photo)
 
-            if filter_name == "sepia":
-                img_array = np.array(image)
-                sepia_matrix = np.array([
-                    [0.393, 0.769, 0.189],
-                    [0.349, 0.686, 0.168],
-                    [0.272, 0.534, 0.131]
-                ])
-                transformed_sepia = np.dot(img_array, sepia_matrix.T).clip(0, 255).astype(np.uint8)
-                filtered_image = Image.fromarray(transformed_sepia)
+        return photo
 
-            elif filter_name == "black and white":
-                filtered_image = image.convert('L').convert('RGB')
+    def _replace_current_blob(self, photo: Photo, blob_id: int, already_referenced: bool = False):
+        if photo.blob_id == blob_id:
+            if already_referenced:
+                self.blob_service.decref(blob_id)
+            return
+
+        if not already_referenced:
+            self.blob_service.incref(blob_id)
+        previous_blob_id = photo.blob_id
+        photo.blob_id = blob_id
+        self.blob_service.decref(previous_blob_id)
+
+    def _open_blob(self, blob, data_key: bytes):
+        encrypted_data = self.blob_service.read(blob)
+        if blob.nonce is None:
+            reader = ChunkedDecryptor(encrypted_data, data_key)
+            # Fail on a wrong key here rather than halfway through a streamed response
+            reader.decrypt_chunk(0)
+            return reader
+        return DecryptedBuffer(decrypt_image(bytes(encrypted_data), blob.nonce, blob.tag, data_key))
+
+    def _render_pipeline(self, decrypted_data: bytes, pipeline: list) -> bytes:
+        try:
+            image = self._open_image(decrypted_data)
+            format = image.format if image.format else 'JPEG'
 
-            elif filter_name == "color inversion":
-                filtered_image = ImageOps.invert(image)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
 
+            if image.width * image.height >= FILTER_STRIP_MIN_PIXELS and pipeline_is_pixelwise(pipeline):
+                filtered_image = apply_pipeline_in_strips(image, pipeline)
             else:
-                raise HTTPException(status_code=400,
-                                    detail="Invalid filter name. Available filters: none, sepia, black and white, color inversion")
+                filtered_image = apply_pipeline(image, pipeline)
 
             img_byte_arr = io.BytesIO()
-            format = image.format if image.format else 'JPEG'
             filtered_image.save(img_byte_arr, format=format)
-            filtered_data = img_byte_arr.getvalue()
+            return img_byte_arr.getvalue()
 
+        except HTTPException:
+            raise
+        except ValueError as e:
+            # Parameters that only fail against this image, such as a crop box outside it
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error applying filter: {str(e)}")
 
-        # Re-encrypt the filtered image
-        encrypted_data, salt, nonce, tag = encrypt_image(filtered_data, gallery_password)
+    def _render_preview(self, decrypted_data: bytes, pipeline: list, max_edge: int) -> bytes:
+        try:
+            image = self._open_image(decrypted_data)
+            # Downscale the source so the pipeline's result comes out at about max_edge, then render at that scale
+            output_size = pipeline_output_size(image.size, pipeline)
+            scale = min(1.0, max_edge / max(1, *output_size))
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            # JPEG decodes straight to a 1/2, 1/4 or 1/8 scale no smaller than `size`
+            image.draft('RGB', size)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            if image.size != size:
+                image = image.resize(size, Image.Resampling.BICUBIC, reducing_gap=3.0)
 
-        # Update the photo record
-        photo.encrypted_data = encrypted_data
-        photo.encryption_salt = salt
-        photo.nonce = nonce
-        photo.tag = tag
-        photo.filter_applied = filter_name
+            preview = apply_pipeline(image, pipeline, scale=scale)
+            preview.thumbnail((max_edge, max_edge))
+
+            img_byte_arr = io.BytesIO()
+            preview.save(img_byte_arr, format='JPEG', quality=PREVIEW_JPEG_QUALITY)
+            return img_byte_arr.getvalue()
+
+        except HTTPException:
+            raise
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error rendering preview: {str(e)}")
+
+    def _open_image(self, decrypted_data: bytes) -> Image.Image:
+        """Open without decoding, refusing images whose decoded size would exceed FILTER_MAX_PIXELS."""
+        try:
+            image = Image.open(io.BytesIO(decrypted_data))
+            too_large = image.width * image.height > FILTER_MAX_PIXELS
+        except Image.DecompressionBombError:
+            too_large = True
+        if too_large:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"Image exceeds {FILTER_MAX_PIXELS} pixels")
+        return image
+
+
+def _as_utc(value: datetime) -> datetime:
+    """
+    An aware bound converted to UTC; naive bounds are taken as UTC already. SQLite stores uploaded_at as UTC
+    wall-clock text and drops the offset when binding, so a +02:00 bound would otherwise be off by two hours.
+    """
+    return value.astimezone(timezone.utc) if value.tzinfo is not None else value
+
+
+def _encode_cursor(photo: Photo) -> str:
+    return base64.urlsafe_b64encode(f"{photo.uploaded_at.isoformat()}|{photo.id}".encode()).decode()
 
-        self.db.commit()
-        self.db.refresh(photo)
 
-        return photo
\ No newline at end of file
+def _decode_cursor(cursor: str):
+    try:
+        uploaded_at, _, photo_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+        return datetime.fromisoformat(uploaded_at), int(photo_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
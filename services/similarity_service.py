@@ -0,0 +1,83 @@
+# services/similarity_service.py
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.orm import Session, load_only
+from starlette import status
+
+from models import PHOTO_METADATA_COLUMNS, Photo, PhotoEmbedding
+from vector_index import VectorIndex, decode_embedding, vector_indexes
+
+
+class SimilarityService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def add_embedding(self, photo: Photo, embedding: bytes, user_id: int):
+        """Store an encoded embedding for the photo; not committed."""
+        self.db.add(PhotoEmbedding(photo=photo, owner_id=user_id, vector=embedding))
+
+    def copy_embedding(self, source: Photo, copy: Photo):
+        vector = self.db.query(PhotoEmbedding.vector).filter(PhotoEmbedding.photo_id == source.id).scalar()
+        if vector is not None:
+            self.add_embedding(copy, vector, copy.owner_id)
+
+    def similar_photos(self, photo_id: int, user_id: int, k: int = 10):
+        """The k photos of the user that look most like this one, from stored embeddings only."""
+        photo = self.db.query(Photo.id).filter(Photo.id == photo_id, Photo.owner_id == user_id).first()
+        if not photo:
+            raise HTTPException(status_code=404, detail="Photo not found")
+
+        vector = self.db.query(PhotoEmbedding.vector).filter(PhotoEmbedding.photo_id == photo_id).scalar()
+        if vector is None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Photo has not been analyzed yet")
+
+        matches = self._index(user_id).search(decode_embedding(vector), k, exclude_photo_id=photo_id)
+        photos = {
+            photo.id: photo for photo in self.db.query(Photo).options(
+                load_only(*PHOTO_METADATA_COLUMNS)
+            ).filter(Photo.id.in_([match_id for match_id, _ in matches]))
+        }
+        return [
+            {"photo": photos[match_id], "similarity": similarity}
+            for match_id, similarity in matches if match_id in photos
+        ]
+
+    def _index(self, user_id: int) -> VectorIndex:
+        # One COUNT tells whether rows were added (by this or another process) since the index was loaded
+        count = self.db.query(func.count(PhotoEmbedding.photo_id)).filter(PhotoEmbedding.owner_id == user_id).scalar()
+        index = vector_indexes.get(user_id)
+        if index is not None and index.size == count:
+            return index
+
+        if index is not None:
+            if index.size < count:
+                index = index.add(self._rows(user_id, after_photo_id=index.max_photo_id))
+            if index.size != count:
+                # Rows added out of photo id order (e.g. by background jobs) or removed: reconcile by id. New rows
+                # join the nearest existing list, so no k-means runs on the request path
+                index = self._reconcile(user_id, index)
+            vector_indexes.put(user_id, index, rebuilt=False)
+            return index
+
+        index = VectorIndex.build(self._rows(user_id))
+        vector_indexes.put(user_id, index, rebuilt=True)
+        return index
+
+    def _reconcile(self, user_id: int, index: VectorIndex) -> VectorIndex:
+        stored = np.array([photo_id for photo_id, in self.db.query(PhotoEmbedding.photo_id).filter(
+            PhotoEmbedding.owner_id == user_id
+        )], dtype=np.int64)
+        index = index.discard(np.setdiff1d(index.photo_ids, stored))
+        missing = np.setdiff1d(stored, index.photo_ids)
+        if len(missing):
+            index = index.add(self.db.query(PhotoEmbedding.photo_id, PhotoEmbedding.vector).filter(
+                PhotoEmbedding.photo_id.in_(missing.tolist())
+            ).order_by(PhotoEmbedding.photo_id).all())
+        return index
+
+    def _rows(self, user_id: int, after_photo_id: int = 0) -> list:
+        return self.db.query(PhotoEmbedding.photo_id, PhotoEmbedding.vector).filter(
+            PhotoEmbedding.owner_id == user_id,
+            PhotoEmbedding.photo_id > after_photo_id
+        ).order_by(PhotoEmbedding.photo_id).all()
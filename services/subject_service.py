@@ -1,9 +1,16 @@
 # services/subject_service.py
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
 from starlette import status
 
-from models import Subject
+from models import PHOTO_METADATA_COLUMNS, Photo, Subject
+from subject_cache import subject_cache
+
+# Dialects with INSERT ... ON CONFLICT ... RETURNING
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
 
 
 class SubjectService:
@@ -11,17 +18,74 @@ class SubjectService:
         self.db = db
 
     def get_user_subjects(self, user_id: int):
-        return self.db.query(Subject).filter(Subject.user_id == user_id).all()
+        # Photos of all subjects arrive in one extra SELECT ... IN query instead of one per subject
+        return self.db.query(Subject).options(
+            selectinload(Subject.photos).load_only(*PHOTO_METADATA_COLUMNS)
+        ).filter(Subject.user_id == user_id).all()
 
-    def create_subject(self, name: str, user_id: int):
-        found_subject = self.db.query(Subject).filter_by(user_id=user_id, name=name).first()
+    def get_subject_summaries(self, user_id: int):
+        rows = self.db.query(
+            Subject.id,
+            Subject.name,
+            Subject.user_id,
+            func.count(Photo.id).label("photo_count"),
+            func.max(Photo.uploaded_at).label("latest_upload")
+        ).outerjoin(
+            Photo, Photo.subject_id == Subject.id
+        ).filter(
+            Subject.user_id == user_id
+        ).group_by(
+            Subject.id, Subject.name, Subject.user_id
+        ).order_by(Subject.name).all()
 
-        if found_subject:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Subject already exists")
+        return [row._asdict() for row in rows]
 
+    def resolve_subject_id(self, name: str, user_id: int) -> int:
+        """Id of the user's subject called `name`, created if missing. Does not commit."""
+        subject_id = subject_cache.get(user_id, name)
+        if subject_id is not None:
+            return subject_id
+
+        subject_id = self._upsert(name, user_id)
+        subject_cache.stage(self.db, user_id, name, subject_id)
+        return subject_id
+
+    def create_subject(self, name: str, user_id: int):
         subject = Subject(name=name, user_id=user_id)
         self.db.add(subject)
-        self.db.commit()
+        try:
+            self.db.commit()
+        except IntegrityError:
+            self.db.rollback()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Subject already exists")
+
         self.db.refresh(subject)
+        subject_cache.put(user_id, name, subject.id)
+
+        return subject
+
+    def _upsert(self, name: str, user_id: int) -> int:
+        insert = _UPSERT_INSERTS.get(self.db.get_bind().dialect.name)
+        if insert is None:
+            return self._select_or_insert(name, user_id)
+
+        # The no-op update makes RETURNING yield the id of an existing row too
+        statement = insert(Subject).values(name=name, user_id=user_id)
+        statement = statement.on_conflict_do_update(
+            index_elements=[Subject.user_id, Subject.name],
+            set_={"name": statement.excluded.name}
+        ).returning(Subject.id)
+        return self.db.execute(statement).scalar_one()
 
-        return subject
\ No newline at end of file
+    def _select_or_insert(self, name: str, user_id: int) -> int:
+        subject = self.db.query(Subject).filter_by(user_id=user_id, name=name).first()
+        if subject:
+            return subject.id
+        try:
+            with self.db.begin_nested():
+                subject = Subject(name=name, user_id=user_id)
+                self.db.add(subject)
+            return subject.id
+        except IntegrityError:
+            # Lost the race to a concurrent insert of the same name
+            return self.db.query(Subject.id).filter_by(user_id=user_id, name=name).scalar()
@@ -0,0 +1,79 @@
+# services/variant_service.py
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Blob, Photo, PhotoVariant
+from services.blob_service import BlobService
+from variant_cache import VARIANT_CACHE_MAX_BYTES_PER_USER, variant_cache
+
+
+class VariantService:
+    """
+    Rendered filter variants of photos, stored as encrypted blobs and evicted least recently used first once a
+    user's variants exceed VARIANT_CACHE_MAX_BYTES_PER_USER. Changes are left for the caller to commit.
+    """
+
+    def __init__(self, db: Session, blob_service: BlobService):
+        self.db = db
+        self.blob_service = blob_service
+
+    def find(self, photo: Photo, key: str) -> Optional[PhotoVariant]:
+        variant = self.db.query(PhotoVariant).filter(
+            PhotoVariant.photo_id == photo.id,
+            PhotoVariant.pipeline_key == key
+        ).first()
+        if variant is not None and variant.source_blob_id != photo.original_blob_id:
+            self._delete(variant)
+            variant_cache.record_invalidations(1)
+            variant = None
+
+        if variant is None:
+            variant_cache.record_miss()
+            return None
+        variant.last_used_at = datetime.now(timezone.utc)
+        variant_cache.record_hit()
+        return variant
+
+    def add(self, photo: Photo, key: str, blob: Blob):
+        """Keep a freshly rendered blob as the photo's variant for this pipeline key."""
+        if VARIANT_CACHE_MAX_BYTES_PER_USER <= 0:
+            return
+        try:
+            with self.db.begin_nested():
+                self.db.add(PhotoVariant(
+                    photo_id=photo.id,
+                    owner_id=photo.owner_id,
+                    pipeline_key=key,
+                    source_blob_id=photo.original_blob_id,
+                    blob_id=blob.id,
+                    size=blob.size or 0
+                ))
+        except IntegrityError:
+            # A concurrent request rendered the same pipeline first; keep theirs
+            return
+        self.blob_service.incref(blob.id)
+        self._evict(photo.owner_id)
+
+    def _evict(self, user_id: int):
+        self.db.flush()
+        variants = self.db.query(PhotoVariant.id, PhotoVariant.size).filter(
+            PhotoVariant.owner_id == user_id
+        ).order_by(PhotoVariant.last_used_at.desc(), PhotoVariant.id.desc()).all()
+
+        total = 0
+        evicted = []
+        for variant_id, size in variants:
+            total += size
+            if total > VARIANT_CACHE_MAX_BYTES_PER_USER:
+                evicted.append(variant_id)
+        for variant_id in evicted:
+            self._delete(self.db.get(PhotoVariant, variant_id))
+        variant_cache.record_evictions(len(evicted))
+
+    def _delete(self, variant: PhotoVariant):
+        # A variant that is also a photo's current version keeps that reference
+        self.db.delete(variant)
+        self.blob_service.decref(variant.blob_id)
@@ -0,0 +1,111 @@
+import abc
+import json
+import os
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+SUBJECT_MODEL_BACKEND = os.getenv("SUBJECT_MODEL_BACKEND", "tensorflow")  # tensorflow | onnx
+SUBJECT_MODEL_PATH = os.getenv("SUBJECT_MODEL_PATH", "./models/mobilenet_v2.onnx")
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))  # 0: onnxruntime's default
+
+
+def embedding_model(tf):
+    """MobileNetV2 with ImageNet weights, returning the class scores and the pooled features that feed them."""
+    model = tf.keras.applications.MobileNetV2(weights='imagenet', input_shape=(224, 224, 3))
+    return tf.keras.Model(model.input, [model.output, model.layers[-2].output])
+
+
+def labels_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".labels.json"
+
+
+class Analysis(NamedTuple):
+    label: str
+    embedding: Optional[np.ndarray]  # pooled (1280,) float32 features; None if the model does not expose them
+
+
+class InferenceBackend(abc.ABC):
+    """
+    MobileNetV2 classifier: preprocessed (N, 224, 224, 3) float32 batches in, (N, 1000) ImageNet scores and
+    (N, 1280) pooled features (the classifier's input) out.
+    """
+
+    @abc.abstractmethod
+    def run(self, batch: np.ndarray) -> tuple:
+        """(scores, embeddings) of a batch; embeddings may be None."""
+
+    @abc.abstractmethod
+    def top_labels(self, scores: np.ndarray) -> list:
+        """Class name (e.g. 'lion') of the best score in each row."""
+
+    def classify(self, images: list) -> list:
+        """Analysis of each preprocessed (224, 224, 3) image."""
+        return self.analyze(np.stack(images))
+
+    def analyze(self, batch: np.ndarray) -> list:
+        scores, embeddings = self.run(batch)
+        labels = self.top_labels(scores)
+        if embeddings is None:
+            return [Analysis(label, None) for label in labels]
+        return [Analysis(label, embedding) for label, embedding in zip(labels, embeddings)]
+
+
+class TensorFlowBackend(InferenceBackend):
+    """The Keras model with ImageNet weights; needs the full tensorflow package."""
+
+    def __init__(self, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        import tensorflow as tf
+        self._tf = tf
+        # Only takes effect before TensorFlow has run anything in this process; 0 keeps its default
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+        self._model = embedding_model(tf)
+
+    def run(self, batch: np.ndarray) -> tuple:
+        # Calling the model directly skips predict()'s per-call dataset and callback setup
+        scores, embeddings = self._model(batch, training=False)
+        return scores.numpy(), embeddings.numpy()
+
+    def top_labels(self, scores: np.ndarray) -> list:
+        decoded = self._tf.keras.applications.mobilenet_v2.decode_predictions(scores, top=1)
+        return [top[0][1] for top in decoded]
+
+
+class OnnxBackend(InferenceBackend):
+    """A model file written by export_subject_model.py, run on onnxruntime's CPU provider."""
+
+    def __init__(self, model_path: str, intra_op_threads: int = ONNX_INTRA_OP_THREADS, inter_op_threads: int = 0):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("SUBJECT_MODEL_BACKEND=onnx requires the onnxruntime package")
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        self._session = onnxruntime.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input_name = self._session.get_inputs()[0].name
+        with open(labels_path(model_path)) as labels_file:
+            self._labels = json.load(labels_file)
+
+    def run(self, batch: np.ndarray) -> tuple:
+        outputs = self._session.run(None, {self._input_name: batch})
+        # Models exported before embeddings were added only have the scores
+        return outputs[0], outputs[1] if len(outputs) > 1 else None
+
+    def top_labels(self, scores: np.ndarray) -> list:
+        return [self._labels[index] for index in scores.argmax(axis=1)]
+
+
+def create_backend(name: str = SUBJECT_MODEL_BACKEND, model_path: str = SUBJECT_MODEL_PATH,
+                   intra_op_threads: int = 0, inter_op_threads: int = 0) -> InferenceBackend:
+    if name == "tensorflow":
+        return TensorFlowBackend(intra_op_threads, inter_op_threads)
+    if name == "onnx":
+        return OnnxBackend(model_path, intra_op_threads or ONNX_INTRA_OP_THREADS, inter_op_threads)
+    raise ValueError(f"Unknown SUBJECT_MODEL_BACKEND: {name}")
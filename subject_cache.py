@@ -0,0 +1,73 @@
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+SUBJECT_CACHE_MAX_ENTRIES = int(os.getenv("SUBJECT_CACHE_MAX_ENTRIES", "10000"))
+
+_PENDING_KEY = "subject_cache_pending"
+
+
+class SubjectCache:
+    """
+    LRU map of (user_id, subject name) -> subject id. Entries resolved inside a transaction are staged on the
+    session and only become visible once it commits, so a rolled-back insert never leaves a dangling id behind.
+    """
+
+    def __init__(self, max_entries: int = SUBJECT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, name: str):
+        with self._lock:
+            subject_id = self._entries.get((user_id, name))
+            if subject_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((user_id, name))
+            self.hits += 1
+            return subject_id
+
+    def put(self, user_id: int, name: str, subject_id: int):
+        with self._lock:
+            self._entries[(user_id, name)] = subject_id
+            self._entries.move_to_end((user_id, name))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stage(self, db: Session, user_id: int, name: str, subject_id: int):
+        db.info.setdefault(_PENDING_KEY, {})[(user_id, name)] = subject_id
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+subject_cache = SubjectCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_staged_subjects(db: Session):
+    for (user_id, name), subject_id in db.info.pop(_PENDING_KEY, {}).items():
+        subject_cache.put(user_id, name, subject_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_staged_subjects(db: Session):
+    db.info.pop(_PENDING_KEY, None)
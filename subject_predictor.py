@@ -1,28 +1,134 @@
-import numpy as np
-from PIL import Image
-import tensorflow as tf
+import os
+import threading
+import time
 from io import BytesIO
 
-# Load model once at startup
-model = tf.keras.applications.MobileNetV2(
-    weights='imagenet',
-    input_shape=(224, 224, 3)
-)
+import numpy as np
+from PIL import Image, ImageOps
+
+from executors import INFERENCE_PROCESSES, MicroBatcher, imaging_pool, ml_pool
+from subject_backends import Analysis, create_backend
+
+CLASSIFICATION_ENABLED = os.getenv("CLASSIFICATION_ENABLED", "true").lower() == "true"
+# Run the model on every upload, not just noSubject ones, to store embeddings for similarity search. Off by default:
+# it loads the model on the first upload of any kind and adds inference (or a queued job) to every upload
+EMBEDDINGS_ENABLED = os.getenv("EMBEDDINGS_ENABLED", "false").lower() == "true"
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "false").lower() == "true"  # load the model at startup, not first use
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "16"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+
+MODEL_INPUT_SIZE = (224, 224)
+
+
+class ClassificationDisabled(Exception):
+    pass
+
+
+class ModelLoader:
+    """Builds a model (here: the inference backend) on first use. Concurrent first callers wait for a single build instead of racing."""
+
+    def __init__(self, build):
+        self._build = build
+        self._lock = threading.Lock()
+        self._model = None
+        self.state = "not_loaded"  # not_loaded | loading | ready | failed
+        self.error = None
+        self.load_seconds = None
+
+    def get(self):
+        model = self._model
+        if model is not None:
+            return model
+
+        with self._lock:
+            if self._model is None:
+                self.state = "loading"
+                started_at = time.perf_counter()
+                try:
+                    self._model = self._build()
+                except Exception as e:
+                    # The next call retries
+                    self.state = "failed"
+                    self.error = str(e)
+                    raise
+                self.load_seconds = time.perf_counter() - started_at
+                self.state = "ready"
+                self.error = None
+        return self._model
+
+    @property
+    def model(self):
+        """The built model, or None; never triggers a build."""
+        return self._model
+
+    def status(self) -> dict:
+        return {"state": self.state, "error": self.error, "load_seconds": self.load_seconds}
+
+
+def _build_backend():
+    if INFERENCE_PROCESSES:
+        from inference_pool import create_process_pool
+        return create_process_pool(INFERENCE_PROCESSES, INFERENCE_MAX_BATCH_SIZE)
+    return create_backend()
+
+
+# TensorFlow / onnxruntime are imported by the backend, so processes that never classify do not pay for them
+model_loader = ModelLoader(_build_backend)
+
+
+def analyze_image(image_bytes: bytes) -> Analysis:
+    """Top class and embedding of image bytes. Concurrent calls share forward passes through the batcher."""
+    if not CLASSIFICATION_ENABLED:
+        raise ClassificationDisabled()
+
+    return predict_batcher.call(imaging_pool.call(_preprocess, image_bytes))
+
 
 def predict_image(image_bytes: bytes) -> str:
-    """Predict top class from image bytes"""
-    # Preprocess image
-    img = Image.open(BytesIO(image_bytes)).convert('RGB')
-    img = img.resize((224, 224))
-    img_array = tf.keras.preprocessing.image.img_to_array(img)
-    img_array = tf.keras.applications.mobilenet_v2.preprocess_input(
-        img_array[np.newaxis, ...]
-    )
-
-    # Predict
-    predictions = model.predict(img_array)
-    decoded = tf.keras.applications.mobilenet_v2.decode_predictions(
-        predictions, top=1
-    )[0][0]
-
-    return decoded[1]  # Return class name (e.g., 'lion')
\ No newline at end of file
+    """Predict top class from image bytes."""
+    return analyze_image(image_bytes).label
+
+
+def _preprocess(image_bytes: bytes) -> np.ndarray:
+    img = Image.open(BytesIO(image_bytes))
+    # JPEGs decode straight at the smallest 1/2, 1/4 or 1/8 scale that still covers the model input
+    img.draft('RGB', MODEL_INPUT_SIZE)
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    # reducing_gap shrinks other formats by whole factors first, then resamples the small remainder
+    img = img.resize(MODEL_INPUT_SIZE, Image.Resampling.BICUBIC, reducing_gap=3.0)
+
+    # mobilenet_v2.preprocess_input (scale pixels to [-1, 1]) in place, without float temporaries
+    pixels = np.empty((*MODEL_INPUT_SIZE, 3), dtype=np.float32)
+    np.multiply(np.asarray(img), 1 / 127.5, out=pixels, casting='unsafe')
+    pixels -= 1.0
+    return pixels
+
+
+def _classify_batch(images: list) -> list:
+    return model_loader.get().classify(images)
+
+
+predict_batcher = MicroBatcher(
+    "predict", _classify_batch, INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, pool=ml_pool
+)
+
+
+def warm_up():
+    """Load the model and run one prediction, so the first upload does not pay for graph tracing either."""
+    image = BytesIO()
+    Image.new('RGB', (224, 224)).save(image, 'JPEG')
+    predict_image(image.getvalue())
+
+
+def inference_worker_stats():
+    """Inference process health when INFERENCE_PROCESSES is set and the pool has started."""
+    backend = model_loader.model
+    return backend.stats() if hasattr(backend, "stats") else None
+
+
+def shutdown_inference():
+    backend = model_loader.model
+    if hasattr(backend, "close"):
+        backend.close()
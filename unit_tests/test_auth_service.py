@@ -1,6 +1,7 @@
 import pytest
 from fastapi import HTTPException
 from datetime import timedelta
+from unittest.mock import patch
 
 from services.auth_service import AuthService
 import crud  # Make sure this is your actual crud module
@@ -61,3 +62,9 @@ def test_login_user_invalid_password(auth_service, db_session):
 
     assert exc.value.status_code == 401
     assert exc.value.detail == "Invalid username or password"
+
+def test_logout_user_invalidates_cached_keys(auth_service):
+    with patch("services.auth_service.key_cache") as mock_cache:
+        auth_service.logout_user(1)
+
+    mock_cache.invalidate_user.assert_called_once_with(1)
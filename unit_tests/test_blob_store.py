@@ -0,0 +1,36 @@
+import pytest
+
+from blob_store import LocalBlobStore, LocalS3Client, S3BlobStore, content_key, load_blob
+
+
+@pytest.fixture(params=["local", "s3-local"])
+def blob_store(request, tmp_path):
+    if request.param == "local":
+        return LocalBlobStore(str(tmp_path))
+    return S3BlobStore(LocalS3Client(str(tmp_path)), "test-bucket")
+
+def test_put_get_round_trip(blob_store):
+    key = blob_store.put(b"encrypted-bytes")
+    assert key == content_key(b"encrypted-bytes")
+    assert blob_store.exists(key)
+    assert bytes(blob_store.get(key)) == b"encrypted-bytes"
+
+def test_put_is_idempotent(blob_store):
+    assert blob_store.put(b"same") == blob_store.put(b"same")
+
+def test_delete(blob_store):
+    key = blob_store.put(b"to-delete")
+    blob_store.delete(key)
+    assert not blob_store.exists(key)
+    blob_store.delete(key)
+
+def test_local_store_shards_paths(tmp_path):
+    blob_store = LocalBlobStore(str(tmp_path))
+    key = blob_store.put(b"sharded")
+    assert blob_store.path(key) == str(tmp_path / key[:2] / key[2:4] / key)
+
+def test_load_blob_falls_back_to_inline_data(tmp_path):
+    blob_store = LocalBlobStore(str(tmp_path))
+    assert load_blob(blob_store, None, b"inline") == b"inline"
+    key = blob_store.put(b"stored")
+    assert bytes(load_blob(blob_store, key, None)) == b"stored"
@@ -0,0 +1,243 @@
+import io
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from cryptography.exceptions import InvalidTag
+from fastapi import UploadFile
+from sqlalchemy.orm import sessionmaker
+
+from classification_cache import check_cache_key, classification_cache, content_hmac
+from classification_jobs import check_job_key, open_work_item, seal_work_item
+from classification_worker import ClassificationWorker
+from database import Base, RoutingSession, create_engines
+from models import ClassificationJob, ClassificationResult, Photo, PhotoEmbedding, User
+from services.classification_service import ClassificationService
+from services.photo_service import PhotoService
+from subject_backends import Analysis
+from vector_index import decode_embedding
+
+IMAGE = b"\xff\xd8 same bytes every time"
+
+@pytest.fixture
+def classification_service(db_session):
+    return ClassificationService(db_session)
+
+def test_content_hmac_is_keyed_per_user():
+    assert content_hmac(1, IMAGE) == content_hmac(1, IMAGE)
+    assert content_hmac(1, IMAGE) != content_hmac(2, IMAGE)
+    assert len(content_hmac(1, IMAGE)) == 64
+
+@patch("services.classification_service.analyze_image", return_value=Analysis("lion", None))
+def test_repeated_upload_skips_inference(mock_predict, classification_service, db_session):
+    assert classification_service.analyze(IMAGE, 1).label == "lion"
+    db_session.commit()
+    assert classification_service.analyze(IMAGE, 1).label == "lion"
+
+    mock_predict.assert_called_once()
+    stored = db_session.query(ClassificationResult).one()
+    assert stored.content_hmac == content_hmac(1, IMAGE)
+    assert stored.label == "lion"
+    assert classification_cache.stats()["memory_hits"] == 1
+
+@patch("services.classification_service.analyze_image", return_value=Analysis("lion", None))
+def test_result_survives_restart_in_db(mock_predict, classification_service, db_session):
+    classification_service.analyze(IMAGE, 1).label
+    db_session.commit()
+    classification_cache.clear()
+
+    assert classification_service.analyze(IMAGE, 1).label == "lion"
+    mock_predict.assert_called_once()
+    assert classification_cache.stats()["db_hits"] == 1
+
+@patch("services.classification_service.analyze_image", side_effect=[Analysis("lion", None), Analysis("tabby", None)])
+def test_other_users_do_not_share_results(mock_predict, classification_service, db_session):
+    assert classification_service.analyze(IMAGE, 1).label == "lion"
+    assert classification_service.analyze(IMAGE, 2).label == "tabby"
+    db_session.commit()
+    assert db_session.query(ClassificationResult).count() == 2
+
+@patch("services.classification_service.analyze_image", side_effect=RuntimeError("model failed"))
+def test_failed_prediction_is_not_cached(mock_predict, classification_service, db_session):
+    with pytest.raises(RuntimeError):
+        classification_service.analyze(IMAGE, 1).label
+    db_session.commit()
+
+    assert db_session.query(ClassificationResult).count() == 0
+    assert classification_cache.get(content_hmac(1, IMAGE)) is None
+
+@patch("services.classification_service.analyze_image", return_value=Analysis("lion", None))
+def test_new_result_is_written_at_commit_not_while_classifying(mock_predict, tmp_path):
+    engine, write_engine = create_engines(f"sqlite:///{tmp_path / 'results.db'}")
+    Base.metadata.create_all(bind=engine)
+    with RoutingSession(bind=engine, writer=write_engine) as db:
+        ClassificationService(db).analyze(IMAGE, 1)
+        # The writer stays free for the rest of the upload
+        assert write_engine.pool.checkedout() == 0
+        db.commit()
+        assert db.query(ClassificationResult.label).scalar() == "lion"
+    engine.dispose()
+    write_engine.dispose()
+
+@patch("services.classification_service.analyze_image", return_value=Analysis("lion", None))
+def test_rolled_back_result_is_not_written(mock_predict, classification_service, db_session):
+    classification_service.analyze(IMAGE, 1)
+    db_session.rollback()
+    db_session.commit()
+    assert db_session.query(ClassificationResult).count() == 0
+
+@patch("services.classification_service.analyze_image", return_value=Analysis("lion", None))
+def test_disabled_cache_runs_the_model_every_time(mock_predict, classification_service, db_session, monkeypatch):
+    monkeypatch.setattr("services.classification_service.CLASSIFICATION_CACHE_ENABLED", False)
+    assert classification_service.analyze(IMAGE, 1).label == "lion"
+    db_session.commit()
+    assert classification_service.analyze(IMAGE, 1).label == "lion"
+    assert classification_service.cached_analysis(IMAGE, 1) is None
+
+    assert mock_predict.call_count == 2
+    assert db_session.query(ClassificationResult).count() == 0
+
+def test_enabled_cache_requires_a_key(monkeypatch):
+    monkeypatch.setattr("classification_cache.CLASSIFICATION_CACHE_KEY", None)
+    monkeypatch.setattr("classification_cache.CLASSIFICATION_CACHE_ENABLED", True)
+    with pytest.raises(RuntimeError, match="CLASSIFICATION_CACHE_KEY"):
+        check_cache_key()
+    with pytest.raises(RuntimeError, match="CLASSIFICATION_CACHE_KEY"):
+        content_hmac(1, IMAGE)
+
+    monkeypatch.setattr("classification_cache.CLASSIFICATION_CACHE_ENABLED", False)
+    check_cache_key()
+
+def test_background_mode_requires_a_job_key(monkeypatch):
+    monkeypatch.setattr("classification_jobs.CLASSIFICATION_JOB_KEY", None)
+    monkeypatch.setattr("classification_jobs.CLASSIFICATION_MODE", "background")
+    with pytest.raises(RuntimeError, match="CLASSIFICATION_JOB_KEY"):
+        check_job_key()
+    with pytest.raises(RuntimeError, match="CLASSIFICATION_JOB_KEY"):
+        seal_work_item(IMAGE, 1)
+
+    monkeypatch.setattr("classification_jobs.CLASSIFICATION_MODE", "sync")
+    check_job_key()
+
+@pytest.fixture
+def session_factory(db_engine):
+    # Jobs commit and roll back on their own, so they get real sessions instead of the test transaction
+    return sessionmaker(bind=db_engine, expire_on_commit=False)
+
+@pytest.fixture
+def owner_id(session_factory):
+    with session_factory() as db:
+        user = User(username="job_owner", hashed_password="pass")
+        db.add(user)
+        db.commit()
+        return user.id
+
+def upload_in_background(session_factory, owner_id, monkeypatch, image=IMAGE):
+    monkeypatch.setattr("services.photo_service.CLASSIFICATION_MODE", "background")
+    file = UploadFile(filename="cat.jpg", file=io.BytesIO(image), headers={"content-type": "image/jpeg"})
+    with session_factory() as db:
+        return PhotoService(db).upload_photo(file, "gallerypass", "noSubject", owner_id)
+
+def get_photo(session_factory, photo_id):
+    with session_factory() as db:
+        photo = db.get(Photo, photo_id)
+        return photo, photo.subject.name if photo.subject else None
+
+@patch("services.classification_service.analyze_image", return_value=Analysis("tabby", None))
+def test_background_upload_is_backfilled_by_worker(mock_predict, session_factory, owner_id, monkeypatch):
+    photo = upload_in_background(session_factory, owner_id, monkeypatch)
+    assert photo.classification_status == "pending"
+    assert photo.subject_id is None
+    mock_predict.assert_not_called()
+
+    with session_factory() as db:
+        job = db.query(ClassificationJob).one()
+        assert IMAGE not in job.work_item
+        assert open_work_item(job.work_item, owner_id) == IMAGE
+        with pytest.raises(InvalidTag):
+            open_work_item(job.work_item, owner_id + 1)
+
+    assert ClassificationWorker(session_factory).run_pending() == 1
+    photo, subject_name = get_photo(session_factory, photo.id)
+    assert photo.classification_status == "classified"
+    assert subject_name == "tabby"
+    with session_factory() as db:
+        assert db.query(ClassificationJob).count() == 0
+
+@patch("services.classification_service.analyze_image", return_value=Analysis("tabby", None))
+def test_background_upload_of_known_image_is_classified_immediately(mock_predict, session_factory, owner_id, monkeypatch):
+    upload_in_background(session_factory, owner_id, monkeypatch)
+    ClassificationWorker(session_factory).run_pending()
+
+    photo = upload_in_background(session_factory, owner_id, monkeypatch)
+    assert photo.classification_status == "classified"
+    assert get_photo(session_factory, photo.id)[1] == "tabby"
+    mock_predict.assert_called_once()
+    with session_factory() as db:
+        assert db.query(ClassificationJob).count() == 0
+
+@patch("services.classification_service.analyze_image",
+       return_value=Analysis("tabby", np.array([3.0, 4.0], dtype=np.float32)))
+def test_background_job_stores_embedding(mock_predict, session_factory, owner_id, monkeypatch):
+    monkeypatch.setattr("services.classification_service.EMBEDDINGS_ENABLED", True)
+    photo = upload_in_background(session_factory, owner_id, monkeypatch)
+    ClassificationWorker(session_factory).run_pending()
+
+    with session_factory() as db:
+        embedding = db.get(PhotoEmbedding, photo.id)
+        assert embedding.owner_id == owner_id
+        np.testing.assert_allclose(decode_embedding(embedding.vector), [0.6, 0.8], atol=1e-3)
+
+@patch("services.classification_service.analyze_image", side_effect=RuntimeError("model failed"))
+def test_failed_job_is_retried_then_unclassified(mock_predict, session_factory, owner_id, monkeypatch, caplog):
+    monkeypatch.setattr("services.classification_service.CLASSIFICATION_JOB_LEASE_SECONDS", 0)
+    monkeypatch.setattr("services.classification_service.CLASSIFICATION_JOB_MAX_ATTEMPTS", 3)
+    photo = upload_in_background(session_factory, owner_id, monkeypatch)
+    worker = ClassificationWorker(session_factory)
+
+    assert worker.run_pending() == 0
+    assert worker.run_pending() == 0
+    assert get_photo(session_factory, photo.id)[0].classification_status == "pending"
+    assert worker.run_pending() == 1
+
+    photo, subject_name = get_photo(session_factory, photo.id)
+    assert photo.classification_status == "unclassified"
+    assert subject_name == "unclassified"
+    assert mock_predict.call_count == 3
+    assert worker.stats()["retried"] == 2
+    assert "failed on attempt 1 of 3" in caplog.text
+    assert "failed on attempt 3 of 3" in caplog.text
+    assert "gave up" in caplog.text
+
+@patch("services.classification_service.analyze_image", return_value=Analysis("tabby", None))
+def test_claimed_job_is_not_run_twice(mock_predict, session_factory, owner_id, monkeypatch):
+    upload_in_background(session_factory, owner_id, monkeypatch)
+    with session_factory() as db:
+        job_id = db.query(ClassificationJob.id).scalar()
+        assert ClassificationService(db)._claim(job_id)
+
+    with session_factory() as db:
+        assert ClassificationService(db).run_job(job_id) is False
+    mock_predict.assert_not_called()
+
+@patch("services.classification_service.analyze_image", return_value=Analysis("tabby", None))
+def test_subject_chosen_while_pending_is_kept(mock_predict, session_factory, owner_id, monkeypatch):
+    photo = upload_in_background(session_factory, owner_id, monkeypatch)
+    with session_factory() as db:
+        PhotoService(db).update_photo_subject(photo.id, "my cat", owner_id)
+
+    assert ClassificationWorker(session_factory).run_pending() == 1
+    photo, subject_name = get_photo(session_factory, photo.id)
+    assert subject_name == "my cat"
+    assert photo.classification_status is None
+
+@patch("services.classification_service.analyze_image", return_value=Analysis("tabby", None))
+def test_duplicate_of_pending_photo_is_backfilled_too(mock_predict, session_factory, owner_id, monkeypatch):
+    photo = upload_in_background(session_factory, owner_id, monkeypatch)
+    with session_factory() as db:
+        duplicate = PhotoService(db).duplicate_photo(photo.id, owner_id)
+    assert duplicate.classification_status == "pending"
+
+    assert ClassificationWorker(session_factory).run_pending() == 2
+    assert get_photo(session_factory, photo.id)[1] == "tabby"
+    assert get_photo(session_factory, duplicate.id)[1] == "tabby"
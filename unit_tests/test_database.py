@@ -0,0 +1,59 @@
+import asyncio
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import Base, async_url, engine_options, run_db, sync_url
+from models import User
+
+
+def test_postgresql_urls_map_to_both_drivers():
+    assert sync_url("postgresql+asyncpg://u:p@db/gallery").drivername == "postgresql+psycopg"
+    assert sync_url("postgresql+psycopg2://u:p@db/gallery").drivername == "postgresql+psycopg2"
+    for url in ("postgresql://u:p@db/gallery", "postgresql+asyncpg://u:p@db/gallery"):
+        assert async_url(url).drivername == "postgresql+asyncpg"
+
+
+def test_sqlite_uses_sync_fallback():
+    assert async_url("sqlite:///./gallery.db") is None
+    assert sync_url("sqlite+aiosqlite:///./gallery.db").drivername == "sqlite"
+    assert "pool_size" not in engine_options("sqlite:///./gallery.db")
+    assert engine_options("postgresql://u:p@db/gallery")["pool_pre_ping"] is True
+
+
+def test_run_db_with_sync_session(db_session: Session):
+    db_session.add(User(username="runner", hashed_password="pass"))
+    db_session.commit()
+
+    def find(session, username):
+        return session.query(User).filter(User.username == username).one()
+
+    assert asyncio.run(run_db(db_session, find, "runner")).username == "runner"
+
+
+def test_run_db_with_async_session(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr("database.SessionLocal", sessionmaker(bind=engine, expire_on_commit=False))
+
+    def add(session, username):
+        session.add(User(username=username, hashed_password="pass"))
+        session.commit()
+
+    def usernames(session):
+        return [username for username, in session.query(User.username).order_by(User.id)]
+
+    async def run():
+        async_engine = create_async_engine(url.replace("sqlite://", "sqlite+aiosqlite://"))
+        try:
+            async with AsyncSession(async_engine) as db:
+                await run_db(db, add, "bridged")
+                await run_db(db, add, "threaded", blocking=True)
+                return await run_db(db, usernames)
+        finally:
+            await async_engine.dispose()
+
+    assert asyncio.run(run()) == ["bridged", "threaded"]
+    engine.dispose()
@@ -0,0 +1,99 @@
+import asyncio
+import time
+import threading
+
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from executors import MicroBatcher, StageTimings, StagePool
+
+
+@pytest.fixture
+def pool():
+    pool = StagePool("test", 1)
+    yield pool
+    pool.shutdown()
+
+def test_call_runs_on_pool_thread(pool):
+    thread_name = pool.call(lambda: threading.current_thread().name)
+    assert thread_name.startswith("test-pool")
+    assert pool.stats()["completed"] == 1
+
+def test_call_propagates_exceptions(pool):
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        pool.call(fail)
+    assert pool.stats()["failed"] == 1
+
+def test_queue_depth_counts_waiting_tasks(pool):
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    first = pool.submit(block)
+    started.wait()
+    second = pool.submit(lambda: None)
+
+    stats = pool.stats()
+    assert stats["running"] == 1
+    assert stats["queue_depth"] == 1
+
+    release.set()
+    first.result()
+    second.result()
+    stats = pool.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["wait_ms_max"] > 0
+
+def test_run_and_iterate_from_event_loop(pool):
+    async def collect():
+        result = await pool.run(sum, [1, 2, 3])
+        items = [item async for item in pool.iterate(iter([b"a", b"b"]))]
+        return result, items
+
+    assert asyncio.run(collect()) == (6, [b"a", b"b"])
+
+def test_stage_timings_records_each_stage():
+    timings = StageTimings("test")
+    recorded = {}
+    with timings.stage("read", recorded):
+        time.sleep(0.001)
+    assert recorded["read"] > 0
+    assert timings.stats()["read"]["count"] == 1
+
+def test_stage_timings_counts_failed_stages():
+    timings = StageTimings("test")
+    with pytest.raises(ValueError):
+        with timings.stage("read"):
+            raise ValueError("bad input")
+    assert timings.stats()["read"]["failures"] == 1
+
+def test_micro_batcher_groups_concurrent_calls(pool):
+    batch_sizes = []
+
+    def run_batch(items):
+        batch_sizes.append(len(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher("double", run_batch, max_batch_size=8, max_wait_ms=50, pool=pool)
+    with ThreadPoolExecutor(max_workers=16) as callers:
+        results = list(callers.map(batcher.call, range(16)))
+
+    assert results == [item * 2 for item in range(16)]
+    assert max(batch_sizes) <= 8
+    assert len(batch_sizes) < 16
+    assert batcher.stats()["items"] == 16
+
+def test_micro_batcher_propagates_errors():
+    def run_batch(items):
+        raise ValueError("bad batch")
+
+    batcher = MicroBatcher("failing", run_batch, max_batch_size=4, max_wait_ms=1)
+    with pytest.raises(ValueError):
+        batcher.call(1)
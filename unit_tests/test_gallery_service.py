@@ -0,0 +1,74 @@
+import pytest
+from fastapi import HTTPException
+
+from crypto_utils import derive_key, encrypt_image, decrypt_image, generate_salt
+from key_cache import key_cache
+from models import Blob, User
+from services.gallery_service import GalleryService
+
+@pytest.fixture
+def gallery_service(db_session):
+    return GalleryService(db_session)
+
+@pytest.fixture
+def user(db_session):
+    user = User(username="gallery_owner", hashed_password="pass")
+    db_session.add(user)
+    db_session.commit()
+    return user
+
+def add_legacy_blob(db_session, user, data, password):
+    salt = generate_salt()
+    encrypted_data, nonce, tag = encrypt_image(data, derive_key(password, salt))
+    blob = Blob(
+        owner_id=user.id,
+        ref_count=2,
+        encrypted_data=encrypted_data,
+        encryption_salt=salt,
+        nonce=nonce,
+        tag=tag
+    )
+    db_session.add(blob)
+    db_session.commit()
+    return blob
+
+def test_get_master_key_sets_verifier_on_first_use(gallery_service, user):
+    master_key = gallery_service.get_master_key(user.id, "gallerypass")
+    assert user.gallery_salt is not None
+    assert user.gallery_key_verifier is not None
+    assert gallery_service.get_master_key(user.id, "gallerypass") == master_key
+
+def test_get_master_key_wrong_password(gallery_service, user):
+    gallery_service.get_master_key(user.id, "gallerypass")
+    entries = key_cache.stats()["entries"]
+    with pytest.raises(HTTPException) as exc:
+        gallery_service.get_master_key(user.id, "wrongpass")
+    assert exc.value.status_code == 400
+    # A key that failed the verifier never enters the cache
+    assert key_cache.stats()["entries"] == entries
+
+def test_migrate_legacy_photos(gallery_service, db_session, user):
+    blob = add_legacy_blob(db_session, user, b"image-bytes", "gallerypass")
+    other = add_legacy_blob(db_session, user, b"other-bytes", "otherpass")
+
+    assert gallery_service.migrate_legacy_photos(user.id, "gallerypass") == 1
+
+    assert blob.wrapped_key is not None
+    assert blob.encryption_salt is None
+    assert other.wrapped_key is None
+    master_key = gallery_service.get_master_key(user.id, "gallerypass")
+    data_key = gallery_service.get_data_key(blob, master_key, "gallerypass")
+    assert decrypt_image(blob.encrypted_data, blob.nonce, blob.tag, data_key) == b"image-bytes"
+
+def test_change_gallery_password_rewraps_keys(gallery_service, db_session, user):
+    blob = add_legacy_blob(db_session, user, b"image-bytes", "oldpass")
+    encrypted_data = blob.encrypted_data
+
+    gallery_service.change_gallery_password(user.id, "oldpass", "newpass")
+
+    assert blob.encrypted_data == encrypted_data
+    with pytest.raises(HTTPException):
+        gallery_service.get_master_key(user.id, "oldpass")
+    master_key = gallery_service.get_master_key(user.id, "newpass")
+    data_key = gallery_service.get_data_key(blob, master_key, "newpass")
+    assert decrypt_image(blob.encrypted_data, blob.nonce, blob.tag, data_key) == b"image-bytes"
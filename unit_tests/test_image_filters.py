@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_filters
+from image_filters import (
+    FILTERS, MAX_PIPELINE_STEPS, apply_filter, apply_pipeline, apply_pipeline_in_strips, pipeline_is_pixelwise,
+    pipeline_summary, register_filter, validate_pipeline
+)
+
+
+@pytest.fixture
+def image():
+    pixels = np.random.RandomState(0).randint(0, 256, (64, 96, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def test_sepia_matches_float_reference(image):
+    matrix = np.array([[0.393, 0.769, 0.189], [0.349, 0.686, 0.168], [0.272, 0.534, 0.131]])
+    expected = np.dot(np.array(image), matrix.T).clip(0, 255)
+
+    result = np.array(apply_filter(image, "sepia"), dtype=np.float64)
+    assert np.abs(result - expected).max() <= 1
+
+
+def test_brightness_and_contrast_lookup_tables(image):
+    pixels = np.array(image, dtype=np.float32)
+    brighter = np.array(apply_filter(image, "brightness", factor=1.5))
+    np.testing.assert_array_equal(brighter, np.clip(np.rint(pixels * 1.5), 0, 255))
+
+    flat = np.array(apply_filter(image, "contrast", factor=0))
+    assert (flat == 128).all()
+
+
+def test_vignette_darkens_corners_only(image, monkeypatch):
+    # Several strips, the last one partial
+    monkeypatch.setattr(image_filters, "STRIP_ROWS", 10)
+    white = Image.new("RGB", (101, 101), "white")
+
+    result = np.array(apply_filter(white, "vignette", strength=0.5))
+    assert (result[50, 50] == 255).all()
+    assert (result[0, 0] == 128).all()
+    assert (result[0, 50] == result[50, 0]).all()
+    assert 128 < result[0, 50, 0] < 255
+
+
+def test_neighbourhood_filters_keep_size(image):
+    for name in ("blur", "sharpen"):
+        assert not FILTERS[name].pixelwise
+        result = apply_filter(image, name)
+        assert result.size == image.size and result.mode == "RGB"
+
+
+def test_registered_filter_is_available(image, monkeypatch):
+    monkeypatch.setitem(FILTERS, "noop", None)
+    register_filter("noop")(lambda img: img)
+
+    assert apply_filter(image, "noop") is image
+    with pytest.raises(KeyError):
+        apply_filter(image, "missing")
+
+
+def test_validate_pipeline_normalizes_steps():
+    assert validate_pipeline([{"op": "sepia"}, {"op": "blur", "params": {"radius": 1}}]) == [
+        {"op": "sepia", "params": {}}, {"op": "blur", "params": {"radius": 1}}
+    ]
+    with pytest.raises(ValueError):
+        validate_pipeline([{"op": "sepia"}] * (MAX_PIPELINE_STEPS + 1))
+    with pytest.raises(ValueError):
+        validate_pipeline([{"op": "crop", "params": {"left": True, "top": 0, "right": 1, "bottom": 1}}])
+
+
+def test_pipeline_applies_steps_in_order(image):
+    steps = validate_pipeline([
+        {"op": "crop", "params": {"left": 0, "top": 0, "right": 40, "bottom": 30}},
+        {"op": "resize", "params": {"height": 15}},
+    ])
+    assert apply_pipeline(image, steps).size == (20, 15)
+    assert pipeline_summary(steps) == "crop > resize"
+    with pytest.raises(ValueError):
+        apply_pipeline(image, list(reversed(steps)))
+
+
+def test_strips_match_whole_image(image):
+    steps = validate_pipeline([{"op": "sepia"}, {"op": "contrast", "params": {"factor": 1.4}}, {"op": "brightness"}])
+    assert pipeline_is_pixelwise(steps)
+    expected = np.array(apply_pipeline(image, steps))
+
+    result = apply_pipeline_in_strips(image, steps, strip_rows=10)
+    assert result is image
+    np.testing.assert_array_equal(np.array(result), expected)
+
+    assert not pipeline_is_pixelwise(validate_pipeline([{"op": "sepia"}, {"op": "vignette"}]))
@@ -0,0 +1,121 @@
+import functools
+import os
+
+import numpy as np
+import pytest
+
+import inference_pool
+from inference_pool import InferenceWorkerError, ProcessPoolBackend
+from subject_backends import InferenceBackend
+
+CRASH = -7.0
+
+
+class MeanBackend(InferenceBackend):
+    """Labels each image with its pixel mean; exits the process on CRASH and fails on NaN."""
+
+    def run(self, batch):
+        if (batch == CRASH).all(axis=(1, 2, 3)).any():
+            os._exit(1)
+        if np.isnan(batch).any():
+            raise ValueError("bad input")
+        return batch.mean(axis=(1, 2, 3), keepdims=True)[:, :, 0, 0], batch[:, 0, 0, :]
+
+    def top_labels(self, scores):
+        return [f"{score:.1f}|{os.getpid()}" for score in scores[:, 0]]
+
+
+def build_unless_marked(marker_path):
+    """MeanBackend, or a failed model build while marker_path exists."""
+    if os.path.exists(marker_path):
+        raise RuntimeError("model failed to load")
+    return MeanBackend()
+
+
+def image(value):
+    return np.full((224, 224, 3), value, dtype=np.float32)
+
+
+@pytest.fixture
+def pool():
+    pool = ProcessPoolBackend(2, MeanBackend, max_batch_size=4, health_check_seconds=0.2)
+    yield pool
+    pool.close()
+
+
+def test_classifies_in_worker_processes(pool):
+    analyses = pool.classify([image(value) for value in (0.5, -0.5, 1.0, 0.0, 0.25, -1.0)])
+    labels = [analysis.label for analysis in analyses]
+
+    assert [label.split("|")[0] for label in labels] == ["0.5", "-0.5", "1.0", "0.0", "0.2", "-1.0"]
+    assert {int(label.split("|")[1]) for label in labels} <= {worker["pid"] for worker in pool.stats()["workers"]}
+    assert os.getpid() not in {int(label.split("|")[1]) for label in labels}
+    np.testing.assert_allclose(analyses[0].embedding, [0.5, 0.5, 0.5])
+
+
+def test_model_errors_keep_the_worker(pool):
+    with pytest.raises(RuntimeError, match="bad input"):
+        pool.classify([image(np.nan)])
+    assert pool.classify([image(0.5)])[0].label.startswith("0.5")
+    assert all(worker["restarts"] == 0 for worker in pool.stats()["workers"])
+
+
+def test_crashed_worker_is_restarted(pool):
+    with pytest.raises(InferenceWorkerError):
+        pool.classify([image(CRASH)])
+
+    for _ in range(200):
+        stats = pool.stats()
+        if stats["idle"] == 2 and sum(worker["restarts"] for worker in stats["workers"]) == 1:
+            break
+        pool._closed.wait(0.1)
+    assert sum(worker["restarts"] for worker in pool.stats()["workers"]) == 1
+    assert all(worker["alive"] for worker in pool.stats()["workers"])
+    assert pool.classify([image(1.0)])[0].label.startswith("1.0")
+
+
+def test_health_check_restarts_killed_idle_worker(pool):
+    victim = pool.stats()["workers"][0]["pid"]
+    os.kill(victim, 9)
+
+    for _ in range(200):
+        workers = pool.stats()["workers"]
+        if workers[0]["restarts"] == 1 and workers[0]["alive"] and pool.stats()["idle"] == 2:
+            break
+        pool._closed.wait(0.1)
+    assert pool.stats()["workers"][0]["restarts"] == 1
+    assert pool.stats()["workers"][0]["pid"] != victim
+
+
+def test_restart_retries_failed_model_builds(tmp_path, monkeypatch):
+    monkeypatch.setattr(inference_pool, "_RESTART_BACKOFF_SECONDS", 0.1)
+    marker = tmp_path / "broken"
+    pool = ProcessPoolBackend(1, functools.partial(build_unless_marked, str(marker)), max_batch_size=4,
+                              health_check_seconds=60)
+    try:
+        marker.touch()
+        with pytest.raises(InferenceWorkerError):
+            pool.classify([image(CRASH)])
+
+        # Rebuilds fail with a plain RuntimeError until the model is fixed; the restart keeps trying
+        for _ in range(100):
+            if pool.stats()["workers"][0]["restarts"] >= 2:
+                break
+            pool._closed.wait(0.1)
+        assert pool.stats()["idle"] == 0
+        marker.unlink()
+
+        assert pool.classify([image(0.5)])[0].label.startswith("0.5")
+        assert pool.stats()["workers"][0]["restarts"] >= 2
+    finally:
+        pool.close()
+
+
+def test_classify_fails_when_no_worker_is_available(pool, monkeypatch):
+    monkeypatch.setattr(inference_pool, "INFERENCE_TIMEOUT_SECONDS", 0.2)
+    busy = [pool._idle.get(), pool._idle.get()]
+
+    with pytest.raises(InferenceWorkerError, match="available"):
+        pool.classify([image(0.5)])
+    for worker in busy:
+        pool._idle.put(worker)
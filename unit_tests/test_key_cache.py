@@ -0,0 +1,86 @@
+from unittest.mock import Mock
+
+from key_cache import KeyCache
+
+
+def derive(password, salt):
+    return (password.encode() + salt).ljust(32, b"\0")[:32]
+
+def accept(key):
+    return True
+
+
+def test_get_or_derive_caches_key():
+    cache = KeyCache()
+    derive_mock = Mock(side_effect=derive)
+
+    first = cache.get_or_derive(1, b"salt", "pass", derive_mock, accept)
+    second = cache.get_or_derive(1, b"salt", "pass", derive_mock, accept)
+
+    assert first == second
+    assert derive_mock.call_count == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_different_password_or_user_misses():
+    cache = KeyCache()
+    derive_mock = Mock(side_effect=derive)
+
+    cache.get_or_derive(1, b"salt", "pass", derive_mock, accept)
+    cache.get_or_derive(1, b"salt", "other", derive_mock, accept)
+    cache.get_or_derive(2, b"salt", "pass", derive_mock, accept)
+
+    assert derive_mock.call_count == 3
+
+def test_expired_entry_is_rederived():
+    cache = KeyCache(ttl_seconds=0)
+    derive_mock = Mock(side_effect=derive)
+
+    cache.get_or_derive(1, b"salt", "pass", derive_mock, accept)
+    cache.get_or_derive(1, b"salt", "pass", derive_mock, accept)
+
+    assert derive_mock.call_count == 2
+
+def test_memory_cap_evicts_least_recently_used():
+    cache = KeyCache()
+    cache.get_or_derive(1, b"salt-x", "pass", derive, accept)
+    entry_size = cache.stats()["size_bytes"]
+    cache = KeyCache(max_bytes=entry_size * 2)
+
+    cache.get_or_derive(1, b"salt-a", "pass", derive, accept)
+    cache.get_or_derive(1, b"salt-b", "pass", derive, accept)
+    cache.get_or_derive(1, b"salt-a", "pass", derive, accept)
+    cache.get_or_derive(1, b"salt-c", "pass", derive, accept)
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["size_bytes"] <= stats["max_bytes"]
+    assert stats["evictions"] == 1
+
+    derive_mock = Mock(side_effect=derive)
+    cache.get_or_derive(1, b"salt-a", "pass", derive_mock, accept)
+    derive_mock.assert_not_called()
+
+def test_invalidate_user_zeroizes_only_that_user():
+    cache = KeyCache()
+    cache.get_or_derive(1, b"salt", "pass", derive, accept)
+    cache.get_or_derive(2, b"salt", "pass", derive, accept)
+    stored = next(key for (user_id, _, _), (key, _) in cache._entries.items() if user_id == 1)
+
+    cache.invalidate_user(1)
+
+    assert stored == bytearray(len(stored))
+    assert cache.stats()["entries"] == 1
+
+def test_unconfirmed_key_is_not_cached():
+    cache = KeyCache()
+    cache.get_or_derive(1, b"salt", "pass", derive, accept)
+    derive_mock = Mock(side_effect=derive)
+
+    for attempt in range(3):
+        cache.get_or_derive(2, b"salt", f"wrong-{attempt}", derive_mock, lambda key: False)
+    cache.get_or_derive(2, b"salt", "unchecked", derive_mock)
+
+    assert derive_mock.call_count == 4
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["evictions"] == 0
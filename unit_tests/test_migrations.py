@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from blob_store import LocalBlobStore
+from database import Base
+from migrations import migrate_blobs, upgrade
+from models import Blob, Photo, Subject
+
+
+def test_migrate_blobs_moves_inline_data(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    Base.metadata.create_all(bind=engine)
+    blob_store = LocalBlobStore(str(tmp_path / "blobs"))
+
+    with Session(engine) as session:
+        blobs = [
+            Blob(owner_id=1, ref_count=1, encrypted_data=data, nonce=b"nonce", tag=b"tag")
+            for data in (b"original", b"current")
+        ]
+        session.add_all(blobs)
+        session.commit()
+
+        assert migrate_blobs(bind=engine, blob_store=blob_store, batch_size=1) == 2
+
+        session.expire_all()
+        assert all(blob.encrypted_data is None for blob in blobs)
+        assert bytes(blob_store.get(blobs[0].storage_key)) == b"original"
+        assert bytes(blob_store.get(blobs[1].storage_key)) == b"current"
+        assert blobs[1].size == len(b"current")
+        assert migrate_blobs(bind=engine, blob_store=blob_store) == 0
+
+
+def test_upgrade_moves_photo_versions_to_shared_blobs(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'upgrade.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE photos (id INTEGER PRIMARY KEY, filename VARCHAR, "
+            "original_encrypted_data BLOB, original_encryption_salt BLOB, original_nonce BLOB, original_tag BLOB, "
+            "encrypted_data BLOB, encryption_salt BLOB, nonce BLOB, tag BLOB, "
+            "filter_applied VARCHAR, uploaded_at DATETIME, mime_type VARCHAR, owner_id INTEGER, subject_id INTEGER)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO photos (id, filename, original_encrypted_data, original_encryption_salt, original_nonce, "
+            "original_tag, encrypted_data, encryption_salt, nonce, tag, filter_applied, mime_type, owner_id) VALUES "
+            "(1, 'a.jpg', x'01', x'aa', x'bb', x'cc', x'01', x'aa', x'bb', x'cc', NULL, 'image/jpeg', 1), "
+            "(2, 'b.jpg', x'02', x'aa', x'bb', x'cc', x'03', x'aa', x'bb', x'cc', 'sepia', 'image/jpeg', 1)"
+        )
+
+    upgrade(bind=engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("photos")}
+    assert "encrypted_data" not in columns and "original_nonce" not in columns
+    indexes = {index["name"] for index in inspect(engine).get_indexes("photos")}
+    assert "ix_photos_owner_uploaded" in indexes
+    with Session(engine) as session:
+        unchanged, filtered = session.get(Photo, 1), session.get(Photo, 2)
+        assert unchanged.blob_id == unchanged.original_blob_id
+        assert unchanged.blob.ref_count == 2
+        assert unchanged.blob.encrypted_data == b"\x01"
+        assert filtered.blob_id != filtered.original_blob_id
+        assert filtered.blob.encrypted_data == b"\x03" and filtered.blob.ref_count == 1
+        assert unchanged.filter_pipeline is None
+        assert filtered.filter_pipeline == [{"op": "sepia", "params": {}}]
+        assert session.query(Blob).count() == 3
+
+
+def test_upgrade_makes_subject_names_unique_per_user(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'subjects.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE subjects (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE, user_id INTEGER)"
+        )
+        conn.exec_driver_sql("INSERT INTO subjects (name, user_id) VALUES ('Holiday', 1)")
+
+    upgrade(bind=engine)
+
+    with Session(engine) as session:
+        session.add(Subject(name="Holiday", user_id=2))
+        session.commit()
+        session.add(Subject(name="Holiday", user_id=2))
+        with pytest.raises(IntegrityError):
+            session.commit()
@@ -1,10 +1,17 @@
 import io
+import os
+from datetime import datetime, timedelta, timezone
 import pytest
 from fastapi import UploadFile, HTTPException
 from PIL import Image
 from unittest.mock import patch
+from sqlalchemy import event
+from crypto_utils import encrypt_chunked
+from executors import upload_timings
+from image_filters import apply_pipeline_in_strips
 from services.photo_service import PhotoService
-from models import Photo, Subject
+from subject_backends import Analysis
+from models import Blob, Photo, Subject, User
 
 class TestUploadFile(UploadFile):
     def __init__(self, filename: str, file: io.BytesIO, content_type: str):
@@ -29,8 +36,11 @@ def upload_file():
     return TestUploadFile(filename=file.name, file=file, content_type="image/jpeg")
 
 @pytest.fixture
-def user_id():
-    return 1
+def user_id(db_session):
+    user = User(username="photo_owner", hashed_password="pass")
+    db_session.add(user)
+    db_session.commit()
+    return user.id
 
 @pytest.fixture
 def gallery_password():
@@ -48,16 +58,18 @@ def add_subject(db_session, user_id, subject_name):
     return subject
 
 def add_photo(db_session, user_id, subject=None, filename="photo.jpg"):
-    photo = Photo(
-        filename=filename,
-        original_encrypted_data=b"encrypted",
-        original_encryption_salt=b"salt",
-        original_nonce=b"nonce",
-        original_tag=b"tag",
+    blob = Blob(
+        owner_id=user_id,
+        ref_count=2,
         encrypted_data=b"encrypted",
         encryption_salt=b"salt",
         nonce=b"nonce",
-        tag=b"tag",
+        tag=b"tag"
+    )
+    photo = Photo(
+        filename=filename,
+        original_blob=blob,
+        blob=blob,
         mime_type="image/jpeg",
         owner_id=user_id,
         subject_id=subject.id if subject else None,
@@ -68,8 +80,8 @@ def add_photo(db_session, user_id, subject=None, filename="photo.jpg"):
     db_session.refresh(photo)
     return photo
 
-@patch("services.photo_service.encrypt_image", return_value=(b"encdata", b"salt", b"nonce", b"tag"))
-@patch("services.photo_service.predict_image", return_value="predicted_subject")
+@patch("services.photo_service.encrypt_chunked", return_value=b"encdata")
+@patch("services.classification_service.analyze_image", return_value=Analysis("predicted_subject", None))
 def test_upload_photo_predict_subject(mock_predict, mock_encrypt, photo_service, upload_file, gallery_password, user_id):
     photo = photo_service.upload_photo(upload_file, gallery_password, "noSubject", user_id)
     assert photo.filename == upload_file.filename
@@ -78,7 +90,15 @@ def test_upload_photo_predict_subject(mock_predict, mock_encrypt, photo_service,
     mock_predict.assert_called()
     mock_encrypt.assert_called()
 
-@patch("services.photo_service.encrypt_image", return_value=(b"enc", b"s", b"n", b"t"))
+@patch("services.classification_service.analyze_image", side_effect=RuntimeError("model failed to load"))
+def test_upload_photo_logs_and_counts_failed_analysis(mock_predict, photo_service, upload_file, gallery_password, user_id, caplog):
+    failures = upload_timings.stats().get("classify", {}).get("failures", 0)
+    photo = photo_service.upload_photo(upload_file, gallery_password, "noSubject", user_id)
+    assert photo.classification_status == "unclassified"
+    assert upload_timings.stats()["classify"]["failures"] == failures + 1
+    assert "model failed to load" in caplog.text
+
+@patch("services.photo_service.encrypt_chunked", return_value=b"enc")
 def test_upload_photo_with_existing_subject(mock_encrypt, photo_service, upload_file, gallery_password, user_id, db_session):
     subject = add_subject(db_session, user_id, "existing_subject")
     photo = photo_service.upload_photo(upload_file, gallery_password, "existing_subject", user_id)
@@ -144,15 +164,15 @@ def test_update_photo_subject_photo_not_found(photo_service, user_id):
     assert exc.value.status_code == 404
 
 @patch("services.photo_service.decrypt_image", return_value=create_test_image().getvalue())
-@patch("services.photo_service.encrypt_image", return_value=(b"encrypted", b"salt", b"nonce", b"tag"))
+@patch("services.photo_service.encrypt_chunked", return_value=b"encrypted")
 def test_apply_filter_none_restores_original(mock_encrypt, mock_decrypt, photo_service, db_session, user_id, gallery_password):
     photo = add_photo(db_session, user_id)
     updated_photo = photo_service.apply_filter_to_photo(photo.id, "none", gallery_password, user_id)
     assert updated_photo.filter_applied is None
-    assert updated_photo.encrypted_data == photo.original_encrypted_data
+    assert updated_photo.blob_id == photo.original_blob_id
 
 @patch("services.photo_service.decrypt_image", return_value=create_test_image().getvalue())
-@patch("services.photo_service.encrypt_image", return_value=(b"encrypted", b"salt", b"nonce", b"tag"))
+@patch("services.photo_service.encrypt_chunked", return_value=b"encrypted")
 def test_apply_filter_sepia(mock_encrypt, mock_decrypt, photo_service, db_session, user_id, gallery_password):
     photo = add_photo(db_session, user_id)
     updated_photo = photo_service.apply_filter_to_photo(photo.id, "sepia", gallery_password, user_id)
@@ -160,14 +180,14 @@ def test_apply_filter_sepia(mock_encrypt, mock_decrypt, photo_service, db_sessio
     mock_encrypt.assert_called_once()
 
 @patch("services.photo_service.decrypt_image", return_value=create_test_image().getvalue())
-@patch("services.photo_service.encrypt_image", return_value=(b"encrypted", b"salt", b"nonce", b"tag"))
+@patch("services.photo_service.encrypt_chunked", return_value=b"encrypted")
 def test_apply_filter_black_and_white(mock_encrypt, mock_decrypt, photo_service, db_session, user_id, gallery_password):
     photo = add_photo(db_session, user_id)
     updated_photo = photo_service.apply_filter_to_photo(photo.id, "black and white", gallery_password, user_id)
     assert updated_photo.filter_applied == "black and white"
 
 @patch("services.photo_service.decrypt_image", return_value=create_test_image().getvalue())
-@patch("services.photo_service.encrypt_image", return_value=(b"encrypted", b"salt", b"nonce", b"tag"))
+@patch("services.photo_service.encrypt_chunked", return_value=b"encrypted")
 def test_apply_filter_color_inversion(mock_encrypt, mock_decrypt, photo_service, db_session, user_id, gallery_password):
     photo = add_photo(db_session, user_id)
     updated_photo = photo_service.apply_filter_to_photo(photo.id, "color inversion", gallery_password, user_id)
@@ -190,3 +210,232 @@ def test_apply_filter_decrypt_fail(mock_decrypt, photo_service, db_session, user
     with pytest.raises(HTTPException) as exc:
         photo_service.apply_filter_to_photo(photo.id, "sepia", gallery_password, user_id)
     assert exc.value.status_code == 400
+
+def test_upload_and_get_photo_round_trip(photo_service, upload_file, gallery_password, user_id):
+    image_data = upload_file.file.getvalue()
+    photo = photo_service.upload_photo(upload_file, gallery_password, "roundtrip", user_id)
+    assert photo.blob.wrapped_key is not None
+    assert photo.blob.encryption_salt is None
+    assert photo.blob.nonce is None
+
+    result_data, mime_type = photo_service.get_photo(photo.id, gallery_password, user_id)
+    assert result_data == image_data
+    assert mime_type == "image/jpeg"
+
+def test_get_photo_adopts_legacy_key(photo_service, db_session, user_id, gallery_password):
+    photo = add_photo(db_session, user_id)
+    with patch("services.photo_service.decrypt_image", return_value=b"decrypteddata"):
+        photo_service.get_photo(photo.id, gallery_password, user_id)
+    assert photo.blob.wrapped_key is not None
+    assert photo.blob.encryption_salt is None
+
+def test_open_photo_reads_byte_ranges(photo_service, upload_file, gallery_password, user_id):
+    image_data = upload_file.file.getvalue()
+    photo = photo_service.upload_photo(upload_file, gallery_password, "ranges", user_id)
+
+    reader, _ = photo_service.open_photo(photo.id, gallery_password, user_id)
+    assert reader.size == len(image_data)
+    assert b"".join(reader.iter_range(10, 99)) == image_data[10:100]
+
+def test_open_photo_corrupted_blob(photo_service, db_session, upload_file, gallery_password, user_id):
+    photo = photo_service.upload_photo(upload_file, gallery_password, "corrupted", user_id)
+    blob_path = photo_service.blob_service.blob_store.path(photo.blob.storage_key)
+    with open(blob_path, "rb") as blob_file:
+        encrypted_data = blob_file.read()
+    with open(blob_path, "wb") as blob_file:
+        blob_file.write(encrypted_data[:-1] + bytes([encrypted_data[-1] ^ 1]))
+
+    with pytest.raises(HTTPException) as exc:
+        photo_service.open_photo(photo.id, gallery_password, user_id)
+    assert exc.value.status_code == 400
+
+def test_upload_shares_one_blob_between_versions(photo_service, upload_file, gallery_password, user_id):
+    photo = photo_service.upload_photo(upload_file, gallery_password, "shared", user_id)
+    assert photo.original_blob_id == photo.blob_id
+    assert photo.blob.ref_count == 2
+
+def test_duplicate_photo_shares_blob(photo_service, db_session, upload_file, gallery_password, user_id):
+    photo = photo_service.upload_photo(upload_file, gallery_password, "shared", user_id)
+    duplicated = photo_service.duplicate_photo(photo.id, user_id)
+
+    assert duplicated.blob_id == photo.blob_id
+    assert db_session.query(Blob).count() == 1
+    db_session.refresh(photo.blob)
+    assert photo.blob.ref_count == 4
+
+def test_apply_filter_copies_on_write_and_collects_garbage(photo_service, db_session, upload_file, gallery_password, user_id, monkeypatch):
+    monkeypatch.setattr("services.variant_service.VARIANT_CACHE_MAX_BYTES_PER_USER", 0)
+    photo = photo_service.upload_photo(upload_file, gallery_password, "cow", user_id)
+    original_blob_id = photo.blob_id
+
+    photo_service.apply_filter_to_photo(photo.id, "sepia", gallery_password, user_id)
+    filtered_blob = photo.blob
+    assert photo.blob_id != original_blob_id
+    assert photo.original_blob.ref_count == 1
+    filtered_path = photo_service.blob_service.blob_store.path(filtered_blob.storage_key)
+
+    photo_service.apply_filter_to_photo(photo.id, "none", gallery_password, user_id)
+    assert photo.blob_id == original_blob_id
+    assert db_session.get(Blob, filtered_blob.id) is None
+    assert not os.path.exists(filtered_path)
+
+def test_apply_pipeline_renders_in_one_pass(photo_service, db_session, upload_file, gallery_password, user_id):
+    photo = photo_service.upload_photo(upload_file, gallery_password, "pipeline", user_id)
+    pipeline = [
+        {"op": "crop", "params": {"left": 10, "top": 20, "right": 90, "bottom": 60}},
+        {"op": "resize", "params": {"width": 40}},
+        {"op": "sepia"},
+        {"op": "contrast", "params": {"factor": 1.3}},
+    ]
+    with patch("services.photo_service.encrypt_chunked", wraps=encrypt_chunked) as mock_encrypt:
+        photo = photo_service.apply_pipeline_to_photo(photo.id, pipeline, gallery_password, user_id)
+
+    mock_encrypt.assert_called_once()
+    assert photo.filter_applied == "crop > resize > sepia > contrast"
+    assert photo.filter_pipeline[0] == pipeline[0]
+    assert photo.filter_pipeline[2] == {"op": "sepia", "params": {}}
+    image_data, _ = photo_service.get_photo(photo.id, gallery_password, user_id)
+    assert Image.open(io.BytesIO(image_data)).size == (40, 20)
+
+    duplicated = photo_service.duplicate_photo(photo.id, user_id)
+    assert duplicated.filter_pipeline == photo.filter_pipeline
+
+    photo = photo_service.apply_pipeline_to_photo(photo.id, [], gallery_password, user_id)
+    assert photo.filter_pipeline is None and photo.filter_applied is None
+
+@pytest.mark.parametrize("pipeline", [
+    [{"op": "posterize"}],
+    [{"op": "contrast", "params": {"amount": 2}}],
+    [{"op": "contrast", "params": {"factor": "high"}}],
+    [{"op": "crop", "params": {"left": 0, "top": 0, "right": 500, "bottom": 50}}],
+])
+def test_apply_pipeline_rejects_invalid_steps(pipeline, photo_service, db_session, upload_file, gallery_password, user_id):
+    photo = photo_service.upload_photo(upload_file, gallery_password, "pipeline", user_id)
+    with pytest.raises(HTTPException) as exc:
+        photo_service.apply_pipeline_to_photo(photo.id, pipeline, gallery_password, user_id)
+    assert exc.value.status_code == 400
+    assert db_session.query(Blob).count() == 1
+
+def test_preview_renders_small_and_stores_nothing(photo_service, db_session, gallery_password, user_id):
+    file = io.BytesIO()
+    Image.new("RGB", (1600, 1200), color="navy").save(file, "jpeg")
+    file.seek(0)
+    photo = photo_service.upload_photo(TestUploadFile("big.jpg", file, "image/jpeg"), gallery_password, "big", user_id)
+    blob_count = db_session.query(Blob).count()
+    pipeline = [{"op": "crop", "params": {"left": 0, "top": 0, "right": 800, "bottom": 400}}, {"op": "sepia"}]
+
+    preview = photo_service.preview_photo(photo.id, pipeline, 200, gallery_password, user_id)
+
+    image = Image.open(io.BytesIO(preview))
+    assert image.format == "JPEG"
+    assert image.size == (200, 100)
+    assert db_session.query(Blob).count() == blob_count
+    assert photo.filter_pipeline is None and not db_session.dirty
+
+    plain = Image.open(io.BytesIO(photo_service.preview_photo(photo.id, [], 200, gallery_password, user_id)))
+    assert plain.size == (200, 150)
+
+    with pytest.raises(HTTPException) as exc:
+        photo_service.preview_photo(photo.id, [{"op": "posterize"}], 200, gallery_password, user_id)
+    assert exc.value.status_code == 400
+
+def test_large_images_are_filtered_in_strips(photo_service, upload_file, gallery_password, user_id, monkeypatch):
+    photo = photo_service.upload_photo(upload_file, gallery_password, "strips", user_id)
+    monkeypatch.setattr("services.photo_service.FILTER_STRIP_MIN_PIXELS", 100 * 100)
+
+    with patch("services.photo_service.apply_pipeline_in_strips", wraps=apply_pipeline_in_strips) as mock_strips:
+        photo_service.apply_filter_to_photo(photo.id, "sepia", gallery_password, user_id)
+        photo_service.apply_filter_to_photo(photo.id, "vignette", gallery_password, user_id)
+
+    mock_strips.assert_called_once()
+
+def test_images_above_pixel_limit_are_refused(photo_service, upload_file, gallery_password, user_id, monkeypatch):
+    photo = photo_service.upload_photo(upload_file, gallery_password, "limit", user_id)
+    monkeypatch.setattr("services.photo_service.FILTER_MAX_PIXELS", 100 * 100 - 1)
+
+    with pytest.raises(HTTPException) as exc:
+        photo_service.apply_filter_to_photo(photo.id, "sepia", gallery_password, user_id)
+    assert exc.value.status_code == 413
+    with pytest.raises(HTTPException) as exc:
+        photo_service.preview_photo(photo.id, [], 64, gallery_password, user_id)
+    assert exc.value.status_code == 413
+
+def test_get_photo_page_walks_cursor_newest_first(photo_service, db_session, user_id):
+    photos = [add_photo(db_session, user_id, filename=f"{i}.jpg") for i in range(5)]
+    expected_ids = [photo.id for photo in reversed(photos)]
+
+    seen_ids = []
+    cursor = None
+    while True:
+        page = photo_service.get_photo_page(user_id, limit=2, cursor=cursor)
+        seen_ids += [photo.id for photo in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen_ids == expected_ids
+
+def test_get_photo_page_filters(photo_service, db_session, user_id):
+    subject = add_subject(db_session, user_id, "filtered")
+    in_subject = add_photo(db_session, user_id, subject=subject)
+    sepia = add_photo(db_session, user_id)
+    sepia.filter_applied = "sepia"
+    db_session.commit()
+
+    assert [p.id for p in photo_service.get_photo_page(user_id, subject_id=subject.id)["items"]] == [in_subject.id]
+    assert [p.id for p in photo_service.get_photo_page(user_id, filter_applied="sepia")["items"]] == [sepia.id]
+    assert [p.id for p in photo_service.get_photo_page(user_id, filter_applied="none")["items"]] == [in_subject.id]
+    assert photo_service.get_photo_page(user_id, uploaded_after=sepia.uploaded_at + timedelta(days=1))["items"] == []
+
+def test_get_photo_page_converts_offset_bounds_to_utc(photo_service, db_session, user_id):
+    photo = add_photo(db_session, user_id)
+    photo.uploaded_at = datetime(2025, 8, 1, 10, 0)
+    db_session.commit()
+    plus_two = timezone(timedelta(hours=2))
+
+    # 11:30+02:00 is 09:30 UTC, half an hour before the upload
+    assert [p.id for p in photo_service.get_photo_page(
+        user_id, uploaded_after=datetime(2025, 8, 1, 11, 30, tzinfo=plus_two)
+    )["items"]] == [photo.id]
+    assert photo_service.get_photo_page(
+        user_id, uploaded_before=datetime(2025, 8, 1, 11, 30, tzinfo=plus_two)
+    )["items"] == []
+
+def test_get_photo_page_does_not_load_blob_references(photo_service, db_session, user_id):
+    add_photo(db_session, user_id)
+    db_session.expunge_all()
+    photo = photo_service.get_photo_page(user_id)["items"][0]
+    assert "blob_id" not in photo.__dict__ and "original_blob_id" not in photo.__dict__
+
+def test_get_photo_page_invalid_cursor(photo_service, user_id):
+    with pytest.raises(HTTPException) as exc:
+        photo_service.get_photo_page(user_id, cursor="not-a-cursor")
+    assert exc.value.status_code == 400
+
+def test_upload_photo_commits_once_without_reloading(photo_service, db_session, upload_file, gallery_password, user_id):
+    statements = []
+    commits = []
+    listener = lambda *args: statements.append(args[2])
+    on_commit = commits.append
+    event.listen(db_session.bind, "before_cursor_execute", listener)
+    event.listen(db_session, "after_commit", on_commit)
+    try:
+        timings = {}
+        photo = photo_service.upload_photo(upload_file, gallery_password, "pipeline", user_id, timings)
+        assert photo.id is not None and photo.uploaded_at is not None
+    finally:
+        event.remove(db_session.bind, "before_cursor_execute", listener)
+        event.remove(db_session, "after_commit", on_commit)
+
+    assert len(commits) == 1
+    photo_insert = next(i for i, sql in enumerate(statements) if sql.startswith("INSERT INTO photos"))
+    assert "RETURNING" in statements[photo_insert]
+    assert not any(sql.startswith("SELECT") for sql in statements[photo_insert:])
+    assert set(timings) == {"read", "encrypt", "persist"}
+
+@patch("services.classification_service.analyze_image")
+def test_upload_photo_with_classification_disabled(mock_predict, photo_service, db_session, upload_file, gallery_password, user_id, monkeypatch):
+    monkeypatch.setattr("services.photo_service.CLASSIFICATION_ENABLED", False)
+    photo = photo_service.upload_photo(upload_file, gallery_password, "noSubject", user_id)
+    assert db_session.get(Subject, photo.subject_id).name == "unclassified"
+    mock_predict.assert_not_called()
@@ -0,0 +1,113 @@
+import io
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from models import PhotoEmbedding, User
+from services.photo_service import PhotoService
+from services.similarity_service import SimilarityService
+from subject_backends import Analysis
+from vector_index import VectorIndex, encode_embedding, vector_indexes
+
+# Uploads are told apart by their bytes; each maps to a direction in a 3-d embedding space
+VECTORS = {
+    b"beach-1": [1.0, 0.0, 0.0],
+    b"beach-2": [0.9, 0.1, 0.0],
+    b"forest": [0.0, 1.0, 0.0],
+    b"city": [0.0, 0.0, 1.0],
+    b"beach-3": [0.8, 0.0, 0.2],
+}
+
+def fake_analysis(image_data):
+    return Analysis("seashore", np.array(VECTORS[image_data], dtype=np.float32))
+
+@pytest.fixture(autouse=True)
+def embeddings_enabled(monkeypatch):
+    monkeypatch.setattr("services.photo_service.EMBEDDINGS_ENABLED", True)
+
+@pytest.fixture
+def user_id(db_session):
+    user = User(username="similar_owner", hashed_password="pass")
+    db_session.add(user)
+    db_session.commit()
+    return user.id
+
+def upload(db_session, user_id, image_data, subject_name="holiday"):
+    file = UploadFile(filename=f"{image_data.decode()}.jpg", file=io.BytesIO(image_data),
+                      headers={"content-type": "image/jpeg"})
+    with patch("services.classification_service.analyze_image", side_effect=fake_analysis):
+        return PhotoService(db_session).upload_photo(file, "gallerypass", subject_name, user_id)
+
+def test_upload_with_subject_stores_embedding(db_session, user_id):
+    photo = upload(db_session, user_id, b"beach-1")
+    embedding = db_session.get(PhotoEmbedding, photo.id)
+    assert embedding.owner_id == user_id
+    assert len(embedding.vector) == 3 * 2
+    assert photo.subject.name == "holiday"
+
+def test_similar_photos_ranked_by_similarity(db_session, user_id):
+    photos = {image: upload(db_session, user_id, image) for image in VECTORS}
+
+    similar = SimilarityService(db_session).similar_photos(photos[b"beach-1"].id, user_id, k=2)
+
+    assert [match["photo"].id for match in similar] == [photos[b"beach-2"].id, photos[b"beach-3"].id]
+    assert similar[0]["similarity"] > similar[1]["similarity"]
+
+def test_index_picks_up_new_uploads(db_session, user_id):
+    beach = upload(db_session, user_id, b"beach-1")
+    upload(db_session, user_id, b"forest")
+    service = SimilarityService(db_session)
+    assert len(service.similar_photos(beach.id, user_id)) == 1
+    builds, updates = vector_indexes.stats()["builds"], vector_indexes.stats()["updates"]
+
+    closer = upload(db_session, user_id, b"beach-2")
+    similar = service.similar_photos(beach.id, user_id)
+
+    assert similar[0]["photo"].id == closer.id
+    assert vector_indexes.stats()["builds"] == builds
+    assert vector_indexes.stats()["updates"] == updates + 1
+
+def test_embedding_written_out_of_order_keeps_the_partitions(db_session, user_id, monkeypatch):
+    monkeypatch.setattr("services.photo_service.EMBEDDINGS_ENABLED", False)
+    late = upload(db_session, user_id, b"beach-2")
+    monkeypatch.setattr("services.photo_service.EMBEDDINGS_ENABLED", True)
+    beach = upload(db_session, user_id, b"beach-1")
+    upload(db_session, user_id, b"forest")
+    upload(db_session, user_id, b"city")
+
+    rows = db_session.query(PhotoEmbedding.photo_id, PhotoEmbedding.vector).order_by(PhotoEmbedding.photo_id).all()
+    partitioned = VectorIndex.build(rows, ivf_min_rows=1)
+    vector_indexes.put(user_id, partitioned, rebuilt=True)
+    builds = vector_indexes.stats()["builds"]
+
+    # A background job fills in the embedding of the oldest photo after newer ones were indexed
+    SimilarityService(db_session).add_embedding(late, encode_embedding(np.array(VECTORS[b"beach-2"])), user_id)
+    db_session.commit()
+    similar = SimilarityService(db_session).similar_photos(beach.id, user_id, k=1)
+
+    assert similar[0]["photo"].id == late.id
+    assert vector_indexes.stats()["builds"] == builds
+    assert vector_indexes.get(user_id).centroids is partitioned.centroids
+
+def test_duplicate_shares_the_embedding(db_session, user_id):
+    photo = upload(db_session, user_id, b"city")
+    duplicate = PhotoService(db_session).duplicate_photo(photo.id, user_id)
+
+    similar = SimilarityService(db_session).similar_photos(photo.id, user_id)
+    assert similar[0]["photo"].id == duplicate.id
+    assert similar[0]["similarity"] == pytest.approx(1.0, abs=1e-3)
+
+def test_similar_photos_of_other_users_photo(db_session, user_id):
+    photo = upload(db_session, user_id, b"city")
+    with pytest.raises(HTTPException) as exc:
+        SimilarityService(db_session).similar_photos(photo.id, user_id + 1)
+    assert exc.value.status_code == 404
+
+def test_similar_photos_without_embedding(db_session, user_id, monkeypatch):
+    monkeypatch.setattr("services.photo_service.EMBEDDINGS_ENABLED", False)
+    photo = upload(db_session, user_id, b"city")
+    with pytest.raises(HTTPException) as exc:
+        SimilarityService(db_session).similar_photos(photo.id, user_id)
+    assert exc.value.status_code == 409
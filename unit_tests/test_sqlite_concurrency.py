@@ -0,0 +1,86 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import UploadFile
+from PIL import Image
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, RoutingSession, create_engines
+from models import Photo, Subject, User
+from services.gallery_service import GalleryService
+from services.photo_service import PhotoService
+
+UPLOADS = 50
+
+
+def make_upload(index):
+    file = io.BytesIO()
+    Image.new("RGB", (64, 64), color=(index, 0, 0)).save(file, "jpeg")
+    file.seek(0)
+    return UploadFile(filename=f"{index}.jpg", file=file, headers={"content-type": "image/jpeg"})
+
+
+def test_sqlite_profile_enables_wal_and_single_writer(tmp_path):
+    engine, write_engine = create_engines(f"sqlite:///{tmp_path / 'profile.db'}")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() > 0
+    assert write_engine.pool.size() == 1
+
+
+def test_parallel_uploads_do_not_lock_the_database(tmp_path):
+    engine, write_engine = create_engines(f"sqlite:///{tmp_path / 'stress.db'}")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(class_=RoutingSession, autoflush=False, bind=engine, writer=write_engine)
+
+    with SessionLocal() as db:
+        user = User(username="stress", hashed_password="pass")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+        GalleryService(db).get_master_key(user_id, "gallerypass")
+
+    def upload(index):
+        with SessionLocal() as db:
+            # Few subject names, so concurrent uploads race to create the same subject
+            PhotoService(db).upload_photo(make_upload(index), "gallerypass", f"subject-{index % 5}", user_id)
+
+    with ThreadPoolExecutor(max_workers=UPLOADS) as pool:
+        # Re-raises the first failure, e.g. sqlite3.OperationalError: database is locked
+        list(pool.map(upload, range(UPLOADS)))
+
+    with SessionLocal() as db:
+        assert db.query(Photo).count() == UPLOADS
+        assert db.query(Subject).count() == 5
+    engine.dispose()
+    write_engine.dispose()
+
+
+def test_blob_is_stored_before_the_writer_is_taken(tmp_path, monkeypatch):
+    engine, write_engine = create_engines(f"sqlite:///{tmp_path / 'order.db'}")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(class_=RoutingSession, autoflush=False, bind=engine, writer=write_engine)
+
+    with SessionLocal() as db:
+        user = User(username="order", hashed_password="pass")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+
+    writers_during_put = []
+    with SessionLocal() as db:
+        service = PhotoService(db)
+        blob_store = service.blob_service.blob_store
+        put = blob_store.put
+
+        def recording_put(data):
+            writers_during_put.append(write_engine.pool.checkedout())
+            return put(data)
+
+        monkeypatch.setattr(blob_store, "put", recording_put)
+        service.upload_photo(make_upload(1), "gallerypass", "new subject", user_id)
+
+    assert writers_during_put == [0]
+    engine.dispose()
+    write_engine.dispose()
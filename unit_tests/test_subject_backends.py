@@ -0,0 +1,37 @@
+import json
+
+import numpy as np
+import pytest
+
+from subject_backends import OnnxBackend, create_backend, labels_path
+
+
+def test_create_backend_rejects_unknown_name():
+    with pytest.raises(ValueError):
+        create_backend("caffe")
+
+
+def test_onnx_backend_matches_tensorflow(tmp_path):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("tf2onnx")
+    from export_subject_model import export_onnx
+    from subject_backends import TensorFlowBackend
+
+    model_path = str(tmp_path / "mobilenet_v2.onnx")
+    # Class names need Keras' downloaded class index, so compare class indices instead
+    export_onnx(model_path, write_labels=False)
+    with open(labels_path(model_path), "w") as labels_file:
+        json.dump([str(index) for index in range(1000)], labels_file)
+
+    images = np.random.RandomState(0).uniform(-1, 1, (8, 224, 224, 3)).astype(np.float32)
+    expected, expected_embeddings = TensorFlowBackend().run(images)
+    onnx_backend = OnnxBackend(model_path)
+    scores, embeddings = onnx_backend.run(images)
+
+    assert scores.shape == expected.shape
+    np.testing.assert_allclose(scores, expected, atol=1e-4)
+    assert embeddings.shape == (8, 1280)
+    np.testing.assert_allclose(embeddings, expected_embeddings, atol=1e-4)
+    assert [analysis.label for analysis in onnx_backend.classify(list(images))] == [
+        str(index) for index in expected.argmax(axis=1)
+    ]
@@ -0,0 +1,96 @@
+import subprocess
+import sys
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import subject_predictor
+from subject_predictor import ClassificationDisabled, ModelLoader, predict_image
+
+
+def test_model_loader_builds_once_for_concurrent_callers():
+    builds = []
+
+    def build():
+        builds.append(threading.get_ident())
+        time.sleep(0.05)
+        return object()
+
+    loader = ModelLoader(build)
+    assert loader.status()["state"] == "not_loaded"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(loader.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+    assert len({id(model) for model in results}) == 1
+    assert loader.status()["state"] == "ready"
+
+
+def test_model_loader_retries_after_failure():
+    attempts = []
+
+    def build():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("weights unavailable")
+        return "model"
+
+    loader = ModelLoader(build)
+    with pytest.raises(OSError):
+        loader.get()
+    assert loader.status()["state"] == "failed"
+    assert loader.get() == "model"
+
+
+def test_predict_image_when_disabled(monkeypatch):
+    monkeypatch.setattr(subject_predictor, "CLASSIFICATION_ENABLED", False)
+    with pytest.raises(ClassificationDisabled):
+        predict_image(b"image")
+
+
+def test_importing_the_app_does_not_load_tensorflow():
+    code = "import sys, main; sys.exit('tensorflow' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
+
+
+def encode(image, format="JPEG", **params):
+    buffer = BytesIO()
+    image.save(buffer, format, **params)
+    return buffer.getvalue()
+
+
+def test_preprocess_scales_pixels_to_model_input():
+    pixels = subject_predictor._preprocess(encode(Image.new("RGB", (3000, 2000), (255, 0, 128))))
+
+    assert pixels.shape == (224, 224, 3)
+    assert pixels.dtype == np.float32
+    np.testing.assert_allclose(pixels[112, 112], [1.0, -1.0, 0.0039], atol=0.02)
+
+
+def test_preprocess_converts_other_modes():
+    pixels = subject_predictor._preprocess(encode(Image.new("LA", (300, 500), (0, 255)), "PNG"))
+    assert pixels.shape == (224, 224, 3)
+    np.testing.assert_allclose(pixels, -1.0)
+
+
+def test_preprocess_applies_exif_orientation():
+    # Stored landscape with the white half on top; orientation 6 means "rotate 90 degrees clockwise to view"
+    image = Image.new("RGB", (800, 400), (0, 0, 0))
+    image.paste((255, 255, 255), (0, 0, 800, 200))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+
+    pixels = subject_predictor._preprocess(encode(image, exif=exif))
+
+    # Viewed upright the white half is on the right
+    assert pixels[:, 200].mean() > 0.9
+    assert pixels[:, 24].mean() < -0.9
@@ -1,9 +1,11 @@
 import pytest
 from fastapi import HTTPException
+from sqlalchemy import event
 from starlette import status
 
 from services.subject_service import SubjectService
-from models import Subject
+from models import Blob, Photo, Subject
+from subject_cache import subject_cache
 
 @pytest.fixture
 def subject_service(db_session):
@@ -54,3 +56,75 @@ def test_get_user_subjects_nonempty(subject_service, db_session):
     assert len(subjects) == 2
     names = {sub.name for sub in subjects}
     assert names == {"Physics", "Chemistry"}
+
+def add_photo(db_session, subject, user_id):
+    blob = Blob(owner_id=user_id, ref_count=2, encrypted_data=b"encrypted")
+    photo = Photo(filename="photo.jpg", original_blob=blob, blob=blob, mime_type="image/jpeg",
+                  owner_id=user_id, subject=subject)
+    db_session.add(photo)
+    db_session.commit()
+    return photo
+
+def test_get_user_subjects_loads_photos_in_one_query(subject_service, db_session):
+    user_id = 3
+    subjects = [Subject(name=name, user_id=user_id) for name in ("Cats", "Dogs", "Birds")]
+    db_session.add_all(subjects)
+    for subject in subjects:
+        add_photo(db_session, subject, user_id)
+    db_session.expunge_all()
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db_session.bind, "before_cursor_execute", listener)
+    try:
+        loaded = subject_service.get_user_subjects(user_id)
+        assert all(len(subject.photos) == 1 for subject in loaded)
+    finally:
+        event.remove(db_session.bind, "before_cursor_execute", listener)
+
+    assert len(statements) == 2
+    assert "blob_id" not in statements[1]
+
+def test_get_subject_summaries(subject_service, db_session):
+    user_id = 4
+    cats = Subject(name="Cats", user_id=user_id)
+    empty = Subject(name="Empty", user_id=user_id)
+    db_session.add_all([cats, empty])
+    add_photo(db_session, cats, user_id)
+    latest = add_photo(db_session, cats, user_id)
+
+    summaries = subject_service.get_subject_summaries(user_id)
+
+    assert [summary["name"] for summary in summaries] == ["Cats", "Empty"]
+    assert summaries[0]["photo_count"] == 2
+    db_session.refresh(latest)
+    assert summaries[0]["latest_upload"] == latest.uploaded_at
+    assert summaries[1]["photo_count"] == 0 and summaries[1]["latest_upload"] is None
+
+def test_subject_names_are_unique_per_user(subject_service):
+    first = subject_service.create_subject("Shared", 5)
+    second = subject_service.create_subject("Shared", 6)
+    assert first.id != second.id
+
+def test_resolve_subject_id_upserts_once(subject_service, db_session):
+    subject_id = subject_service.resolve_subject_id("Trips", 7)
+    assert subject_service.resolve_subject_id("Trips", 7) == subject_id
+    db_session.commit()
+
+    assert db_session.query(Subject).filter_by(user_id=7, name="Trips").count() == 1
+    assert subject_cache.get(7, "Trips") == subject_id
+
+def test_resolve_subject_id_finds_existing_subject(subject_service, db_session):
+    existing = Subject(name="Existing", user_id=8)
+    db_session.add(existing)
+    db_session.commit()
+    assert subject_service.resolve_subject_id("Existing", 8) == existing.id
+
+def test_resolve_subject_id_is_not_cached_after_rollback(subject_service, db_session):
+    subject_service.resolve_subject_id("Discarded", 9)
+    db_session.rollback()
+    assert subject_cache.get(9, "Discarded") is None
+
+def test_create_subject_writes_through_cache(subject_service):
+    subject = subject_service.create_subject("Fresh", 10)
+    assert subject_cache.get(10, "Fresh") == subject.id
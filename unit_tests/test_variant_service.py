@@ -0,0 +1,93 @@
+import io
+from unittest.mock import patch
+
+import pytest
+from fastapi import UploadFile
+from PIL import Image
+
+from crypto_utils import encrypt_chunked
+from models import Blob, PhotoVariant, User
+from services.photo_service import PhotoService
+from variant_cache import pipeline_key, variant_cache
+
+SEPIA = [{"op": "sepia", "params": {}}]
+BLUR = [{"op": "blur", "params": {"radius": 1}}]
+
+
+@pytest.fixture
+def user_id(db_session):
+    user = User(username="variant_owner", hashed_password="pass")
+    db_session.add(user)
+    db_session.commit()
+    return user.id
+
+
+@pytest.fixture
+def photo(db_session, user_id):
+    file = io.BytesIO()
+    Image.new("RGB", (64, 48), color="teal").save(file, "jpeg")
+    file.seek(0)
+    upload = UploadFile(filename="variant.jpg", file=file, headers={"content-type": "image/jpeg"})
+    return PhotoService(db_session).upload_photo(upload, "gallerypass", "variants", user_id)
+
+
+def apply(db_session, photo, pipeline):
+    return PhotoService(db_session).apply_pipeline_to_photo(photo.id, pipeline, "gallerypass", photo.owner_id)
+
+
+def test_reapplying_a_pipeline_swaps_to_the_stored_variant(db_session, photo):
+    hits = variant_cache.stats()["hits"]
+    sepia_blob_id = apply(db_session, photo, SEPIA).blob_id
+    apply(db_session, photo, BLUR)
+
+    with patch("services.photo_service.encrypt_chunked", wraps=encrypt_chunked) as mock_encrypt:
+        photo = apply(db_session, photo, SEPIA)
+
+    mock_encrypt.assert_not_called()
+    assert photo.blob_id == sepia_blob_id
+    assert photo.filter_applied == "sepia"
+    assert variant_cache.stats()["hits"] == hits + 1
+    # Current version plus the variant
+    assert db_session.get(Blob, sepia_blob_id).ref_count == 2
+    assert db_session.query(PhotoVariant).count() == 2
+
+    photo = apply(db_session, photo, [])
+    assert photo.blob_id == photo.original_blob_id
+    assert db_session.get(Blob, sepia_blob_id).ref_count == 1
+
+
+def test_variants_are_evicted_least_recently_used_first(db_session, photo, monkeypatch):
+    apply(db_session, photo, SEPIA)
+    blur_blob_id = apply(db_session, photo, BLUR).blob_id
+    sepia_blob_id = apply(db_session, photo, SEPIA).blob_id
+    evictions = variant_cache.stats()["evictions"]
+
+    monkeypatch.setattr("services.variant_service.VARIANT_CACHE_MAX_BYTES_PER_USER",
+                        db_session.get(Blob, sepia_blob_id).size)
+    photo_service = PhotoService(db_session)
+    photo_service.variant_service._evict(photo.owner_id)
+    db_session.commit()
+    photo_service.blob_service.collect_garbage()
+
+    assert variant_cache.stats()["evictions"] == evictions + 1
+    assert db_session.query(PhotoVariant.pipeline_key).scalar() == pipeline_key(SEPIA)
+    # Neither shown nor cached any more
+    assert db_session.get(Blob, blur_blob_id) is None
+    assert db_session.get(Blob, sepia_blob_id).ref_count == 2
+
+
+def test_variant_of_a_replaced_original_is_not_reused(db_session, photo):
+    apply(db_session, photo, SEPIA)
+    apply(db_session, photo, [])
+    invalidations = variant_cache.stats()["invalidations"]
+
+    variant = db_session.query(PhotoVariant).one()
+    variant.source_blob_id = photo.original_blob_id + 100
+    db_session.commit()
+
+    with patch("services.photo_service.encrypt_chunked", wraps=encrypt_chunked) as mock_encrypt:
+        apply(db_session, photo, SEPIA)
+
+    mock_encrypt.assert_called_once()
+    assert variant_cache.stats()["invalidations"] == invalidations + 1
+    assert db_session.query(PhotoVariant).one().source_blob_id == photo.original_blob_id
@@ -0,0 +1,85 @@
+import numpy as np
+
+from vector_index import VectorIndex, decode_embedding, encode_embedding
+
+
+def rows_for(vectors, first_id=1):
+    return [(first_id + offset, encode_embedding(vector)) for offset, vector in enumerate(vectors)]
+
+
+def clustered(count, clusters=20, dimensions=64, seed=0):
+    random = np.random.default_rng(seed)
+    centers = random.standard_normal((clusters, dimensions))
+    return centers[random.integers(0, clusters, count)] + 0.2 * random.standard_normal((count, dimensions))
+
+
+def test_embeddings_are_stored_unit_length_in_half_precision():
+    encoded = encode_embedding(np.array([3.0, 4.0], dtype=np.float32))
+    assert len(encoded) == 4
+    np.testing.assert_allclose(decode_embedding(encoded), [0.6, 0.8], atol=1e-3)
+
+
+def test_search_ranks_by_cosine_similarity_and_skips_the_query():
+    index = VectorIndex.build(rows_for([[1, 0], [0.9, 0.1], [0, 1], [-1, 0], [0.5, 0.5]]))
+
+    matches = index.search(decode_embedding(encode_embedding([1, 0])), k=3, exclude_photo_id=1)
+
+    assert [photo_id for photo_id, _ in matches] == [2, 5, 3]
+    assert matches[0][1] > matches[1][1] > matches[2][1]
+    assert index.search(decode_embedding(encode_embedding([1, 0])), k=10, exclude_photo_id=1)[-1][0] == 4
+    assert len(index.search(np.array([1, 0], dtype=np.float32), k=10, exclude_photo_id=1)) == 4
+
+
+def test_add_returns_a_larger_index():
+    index = VectorIndex.build(rows_for([[1, 0], [0, 1]]))
+    grown = index.add(rows_for([[0.8, 0.2]], first_id=7))
+
+    assert index.size == 2
+    assert grown.size == 3
+    assert grown.max_photo_id == 7
+    assert grown.search(np.array([1, 0], dtype=np.float32), k=1, exclude_photo_id=1)[0][0] == 7
+
+
+def test_empty_index():
+    assert VectorIndex.build([]).search(np.ones(4, dtype=np.float32), k=5) == []
+
+
+def test_ivf_partitions_large_galleries_without_losing_neighbours():
+    vectors = clustered(4000)
+    flat = VectorIndex.build(rows_for(vectors), ivf_min_rows=10 ** 9)
+    ivf = VectorIndex.build(rows_for(vectors), ivf_min_rows=1000)
+
+    assert flat.centroids is None
+    assert ivf.centroids.shape == (63, 64)
+    recalls = []
+    for photo_id in (1, 500, 2500):
+        query = flat.vectors[photo_id - 1]
+        expected = {match for match, _ in flat.search(query, 10, exclude_photo_id=photo_id)}
+        found = {match for match, _ in ivf.search(query, 10, exclude_photo_id=photo_id)}
+        recalls.append(len(expected & found) / 10)
+    assert np.mean(recalls) >= 0.9
+
+    grown = ivf.add(rows_for(clustered(10, seed=1), first_id=5000))
+    assert len(grown.assignments) == grown.size == 4010
+
+
+def test_half_precision_index_matches_single_precision():
+    vectors = clustered(500)
+    single = VectorIndex.build(rows_for(vectors))
+    half = VectorIndex.build(rows_for(vectors), dtype=np.float16)
+
+    assert half.vectors.dtype == np.float16
+    assert half.vectors.nbytes == single.vectors.nbytes // 2
+    query = single.vectors[0]
+    half_scores = [score for _, score in half.search(query, 5, 1)]
+    single_scores = [score for _, score in single.search(query, 5, 1)]
+    np.testing.assert_allclose(half_scores, single_scores, atol=2e-3)
+
+
+def test_discard_keeps_the_partitions():
+    index = VectorIndex.build(rows_for([[1.0, 0.0], [0.9, 0.1], [0.0, 1.0]]), ivf_min_rows=1)
+    smaller = index.discard(np.array([2]))
+
+    assert smaller.photo_ids.tolist() == [1, 3]
+    assert smaller.centroids is index.centroids
+    assert len(smaller.assignments) == 2
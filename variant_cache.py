@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+import threading
+
+# Encrypted bytes of rendered variants kept per user, beyond the versions photos currently show
+VARIANT_CACHE_MAX_BYTES_PER_USER = int(os.getenv("VARIANT_CACHE_MAX_BYTES_PER_USER", str(256 * 1024 * 1024)))
+
+
+def pipeline_key(pipeline: list) -> str:
+    """Digest of a normalized pipeline (image_filters.validate_pipeline); equal pipelines render equal images."""
+    return hashlib.sha256(json.dumps(pipeline, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class VariantCacheStats:
+    """Counters for the photo_variants table, which holds the variants themselves."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def record_evictions(self, count: int):
+        with self._lock:
+            self.evictions += count
+
+    def record_invalidations(self, count: int):
+        with self._lock:
+            self.invalidations += count
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "max_bytes_per_user": VARIANT_CACHE_MAX_BYTES_PER_USER,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+variant_cache = VariantCacheStats()
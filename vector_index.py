@@ -0,0 +1,191 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+# float32 rows are scanned by BLAS; float16 halves memory but numpy multiplies it ~10x slower, so pair it with IVF
+SIMILARITY_INDEX_DTYPE = np.dtype(os.getenv("SIMILARITY_INDEX_DTYPE", "float32"))
+SIMILARITY_INDEX_MAX_USERS = int(os.getenv("SIMILARITY_INDEX_MAX_USERS", "64"))
+# Galleries at least this large are partitioned into sqrt(n) k-means lists, of which only the nearest are scanned
+SIMILARITY_IVF_MIN_ROWS = int(os.getenv("SIMILARITY_IVF_MIN_ROWS", "50000"))
+SIMILARITY_IVF_NPROBE = int(os.getenv("SIMILARITY_IVF_NPROBE", "8"))
+
+EMBEDDING_DTYPE = np.float16  # stored form: unit-length rows, 2 bytes per dimension
+
+_KMEANS_ITERATIONS = 10
+_KMEANS_SAMPLE_PER_LIST = 64
+
+
+def encode_embedding(vector: np.ndarray) -> bytes:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).astype(EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embedding(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE).astype(np.float32)
+
+
+class VectorIndex:
+    """
+    Unit-length embeddings of one user's photos; cosine similarity is a dot product. Immutable: add() returns a
+    new index, so searches never need a lock.
+    """
+
+    def __init__(self, photo_ids: np.ndarray, vectors: np.ndarray,
+                 centroids: Optional[np.ndarray] = None, assignments: Optional[np.ndarray] = None):
+        self.photo_ids = photo_ids
+        self.vectors = vectors
+        self.centroids = centroids
+        self.assignments = assignments
+
+    @classmethod
+    def build(cls, rows: list, dtype=SIMILARITY_INDEX_DTYPE, ivf_min_rows: int = SIMILARITY_IVF_MIN_ROWS):
+        """Index of (photo_id, encoded embedding) rows."""
+        photo_ids, vectors = _decode_rows(rows, dtype)
+        if len(photo_ids) < ivf_min_rows:
+            return cls(photo_ids, vectors)
+        centroids = _train_centroids(vectors, int(np.sqrt(len(photo_ids))))
+        return cls(photo_ids, vectors, centroids, _nearest(centroids, vectors))
+
+    @property
+    def size(self) -> int:
+        return len(self.photo_ids)
+
+    @property
+    def max_photo_id(self) -> int:
+        return int(self.photo_ids.max()) if self.size else 0
+
+    def add(self, rows: list) -> "VectorIndex":
+        """A new index that also holds `rows`; new rows join the nearest existing partition."""
+        if not rows:
+            return self
+        photo_ids, vectors = _decode_rows(rows, self.vectors.dtype)
+        assignments = None
+        if self.centroids is not None:
+            assignments = np.concatenate([self.assignments, _nearest(self.centroids, vectors)])
+        return VectorIndex(
+            np.concatenate([self.photo_ids, photo_ids]),
+            np.concatenate([self.vectors, vectors]),
+            self.centroids,
+            assignments
+        )
+
+    def discard(self, photo_ids: np.ndarray) -> "VectorIndex":
+        """A new index without the rows of `photo_ids`; partitions are kept."""
+        keep = ~np.isin(self.photo_ids, photo_ids)
+        return VectorIndex(
+            self.photo_ids[keep],
+            self.vectors[keep],
+            self.centroids,
+            self.assignments[keep] if self.assignments is not None else None
+        )
+
+    def search(self, query: np.ndarray, k: int, exclude_photo_id: Optional[int] = None,
+               nprobe: int = SIMILARITY_IVF_NPROBE) -> list:
+        """Up to k (photo_id, similarity) pairs, most similar first."""
+        if self.size == 0:
+            return []
+        query = np.asarray(query, dtype=self.vectors.dtype)
+        if self.centroids is None:
+            candidates = None
+            scores = self.vectors @ query
+        else:
+            probed = np.argsort(self.centroids @ query.astype(np.float32))[-nprobe:]
+            candidates = np.flatnonzero(np.isin(self.assignments, probed))
+            scores = self.vectors[candidates] @ query
+
+        scores = scores.astype(np.float32)
+        if exclude_photo_id is not None:
+            scores[(self.photo_ids if candidates is None else self.photo_ids[candidates]) == exclude_photo_id] = -np.inf
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if candidates is None else candidates[top]
+        return [
+            (int(photo_id), float(score))
+            for photo_id, score in zip(self.photo_ids[rows], scores[top]) if score != -np.inf
+        ]
+
+
+class VectorIndexCache:
+    """LRU of per-user indexes, so only the galleries being browsed stay in memory."""
+
+    def __init__(self, max_users: int = SIMILARITY_INDEX_MAX_USERS):
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.updates = 0
+
+    def get(self, user_id: int) -> Optional[VectorIndex]:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+            return index
+
+    def put(self, user_id: int, index: VectorIndex, rebuilt: bool):
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+            if rebuilt:
+                self.builds += 1
+            else:
+                self.updates += 1
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._indexes),
+                "max_users": self.max_users,
+                "vectors": sum(index.size for index in self._indexes.values()),
+                "bytes": sum(index.vectors.nbytes for index in self._indexes.values()),
+                "builds": self.builds,
+                "updates": self.updates,
+            }
+
+
+def _decode_rows(rows: list, dtype) -> tuple:
+    photo_ids = np.fromiter((photo_id for photo_id, _ in rows), dtype=np.int64, count=len(rows))
+    if not rows:
+        return photo_ids, np.empty((0, 0), dtype=dtype)
+    vectors = np.frombuffer(b"".join(vector for _, vector in rows), dtype=EMBEDDING_DTYPE)
+    return photo_ids, vectors.reshape(len(rows), -1).astype(dtype)
+
+
+def _nearest(centroids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    return np.argmax(vectors.astype(np.float32) @ centroids.T, axis=1)
+
+
+def _train_centroids(vectors: np.ndarray, lists: int) -> np.ndarray:
+    """Spherical k-means on a sample of the rows."""
+    random = np.random.default_rng(0)
+    sample_size = min(len(vectors), lists * _KMEANS_SAMPLE_PER_LIST)
+    sample = vectors[random.choice(len(vectors), sample_size, replace=False)].astype(np.float32)
+    centroids = sample[random.choice(sample_size, lists, replace=False)]
+    for _ in range(_KMEANS_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        counts = np.bincount(assignments, minlength=lists)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(sample[np.argsort(assignments, kind="stable")], starts[filled], axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # An emptied list keeps its previous centroid
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    return centroids
+
+
+vector_indexes = VectorIndexCache()